@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import namedtuple
+import weakref
 
 class EmptyList(object):
   def __iter__(self):
@@ -132,41 +132,148 @@ def extend(addr, index):
 def append(loc, index):
   return loc.append(index)
 
-class EmptyAddress(namedtuple('EmptyAddress', [])):
+######################################################################
+# Hash-consed addresses
+
+class HashConsed(object):
+  """An immutable record that is hash-consed.
+
+  Building a record with the same type and fields as a live one
+  returns the live one, so equal records are usually identical.  The
+  hash is computed once, at construction, from the hashes of the
+  fields (it equals the hash of the tuple of the fields).  Addresses
+  nest, so this makes hashing, equality and ordering O(1) instead of
+  linear in the depth of the address.
+
+  Ordering is by hash first, and only falls back to comparing the
+  fields when the hashes collide.  Equality falls back to comparing
+  the fields too, so that records built concurrently by different
+  threads still compare equal."""
+
+  __slots__ = ('_hash', '__weakref__')
+  _fields = ()
+
+  def __new__(cls, *args):
+    key = (cls, args)
+    ref = _interned.get(key)
+    if ref is not None:
+      ans = ref()
+      if ans is not None:
+        return ans
+    ans = object.__new__(cls)
+    for (name, val) in zip(cls._fields, args):
+      setattr(ans, name, val)
+    ans._hash = hash(args)
+    _interned[key] = weakref.KeyedRef(ans, _uninterned, key)
+    return ans
+
+  def _values(self):
+    return tuple(getattr(self, name) for name in self._fields)
+
+  def __hash__(self):
+    return self._hash
+
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if type(self) is not type(other) or self._hash != other._hash:
+      return False
+    return self._values() == other._values()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def _cmp(self, other):
+    if not isinstance(other, HashConsed):
+      return NotImplemented
+    if self is other:
+      return 0
+    if self._hash != other._hash:
+      return -1 if self._hash < other._hash else 1
+    return cmp((type(self).__name__, self._values()),
+               (type(other).__name__, other._values()))
+
+  def __lt__(self, other):
+    c = self._cmp(other)
+    return c if c is NotImplemented else c < 0
+  def __le__(self, other):
+    c = self._cmp(other)
+    return c if c is NotImplemented else c <= 0
+  def __gt__(self, other):
+    c = self._cmp(other)
+    return c if c is NotImplemented else c > 0
+  def __ge__(self, other):
+    c = self._cmp(other)
+    return c if c is NotImplemented else c >= 0
+
+  def __reduce__(self):
+    # Reconstructing through the constructor interns the copy
+    return (type(self), self._values())
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, _memo):
+    return self
+
+  def __repr__(self):
+    return "%s(%s)" % (type(self).__name__, ", ".join(
+      "%s=%r" % (name, getattr(self, name)) for name in self._fields))
+
+# (type, fields) -> weak reference to the live record
+_interned = {}
+
+def _uninterned(ref):
+  # Only drop the entry if it has not already been replaced by a
+  # newer record with the same key
+  if _interned.get(ref.key) is ref:
+    del _interned[ref.key]
+
+class TraceAddress(HashConsed):
+  __slots__ = ()
+
+class EmptyAddress(TraceAddress):
+  __slots__ = ()
   def asList(self):
     return self.asAddress().asList()
   def asAddress(self):
     return Address(emptyList)
 empty_address = EmptyAddress
 
-class BuiltinAddress(namedtuple('BuiltinAddress', ["name"])):
+class BuiltinAddress(TraceAddress):
+  __slots__ = ('name',)
+  _fields = ('name',)
   def asAddress(self):
     return Address(List(self.name))
 builtin_address = BuiltinAddress
 
-class DirectiveAddress(namedtuple('DirectiveAddress', ["did"])):
+class DirectiveAddress(TraceAddress):
+  __slots__ = ('did',)
+  _fields = ('did',)
   def asList(self):
     return self.asAddress().asList()
   def asAddress(self):
     return Address(List(self.did))
 directive_address = DirectiveAddress
 
-_RequestAddress = namedtuple('RequestAddress', ["app_addr", "req_id"])
-class RequestAddress(_RequestAddress):
+class RequestAddress(TraceAddress):
+  __slots__ = ('app_addr', 'req_id')
+  _fields = ('app_addr', 'req_id')
   def __new__(cls, app_addr, req_id):
     assert _is_address(app_addr)
-    return _RequestAddress.__new__(cls, app_addr, req_id)
+    return HashConsed.__new__(cls, app_addr, req_id)
   def asList(self):
     return self.asAddress().asList()
   def asAddress(self):
     return self.app_addr.asAddress().request(self.req_id.asList())
 request = RequestAddress
 
-_SubexpressionAddress = namedtuple('SubexpressionAddress', ["sup_exp", "index"])
-class SubexpressionAddress(_SubexpressionAddress):
+class SubexpressionAddress(TraceAddress):
+  __slots__ = ('sup_exp', 'index')
+  _fields = ('sup_exp', 'index')
   def __new__(cls, sup_exp, index):
     assert _is_address(sup_exp)
-    return _SubexpressionAddress.__new__(cls, sup_exp, index)
+    return HashConsed.__new__(cls, sup_exp, index)
   def asList(self):
     return self.asAddress().asList()
   def asAddress(self):
@@ -174,23 +281,25 @@ class SubexpressionAddress(_SubexpressionAddress):
 extend = SubexpressionAddress
 
 def _is_address(thing):
-  return isinstance(thing, EmptyAddress) or \
-    isinstance(thing, BuiltinAddress) or \
-    isinstance(thing, DirectiveAddress) or \
-    isinstance(thing, RequestAddress) or \
-    isinstance(thing, SubexpressionAddress)
+  return isinstance(thing, TraceAddress)
 
-class ReqLoc(namedtuple('ReqLoc', ["req_id"])):
+class ReqLoc(HashConsed):
   # Used by mem
+  __slots__ = ('req_id',)
+  _fields = ('req_id',)
   def asList(self):
     return List(self.req_id)
 req_frame = ReqLoc
 
-class DirectiveLoc(namedtuple('DirectiveLoc', ["did"])):
+class DirectiveLoc(HashConsed):
+  __slots__ = ('did',)
+  _fields = ('did',)
   def asList(self):
     return List(self.did)
 
-class SubexpressionLoc(namedtuple('SubexpressionLoc', ["sup_exp", "index"])):
+class SubexpressionLoc(HashConsed):
+  __slots__ = ('sup_exp', 'index')
+  _fields = ('sup_exp', 'index')
   def asList(self):
     return self.sup_exp.asList().append(self.index)
 append = SubexpressionLoc
@@ -18,6 +18,9 @@
 import math
 from scipy.special import gammaln
 import numpy as np
+import scipy.linalg as la
+
+from venture.lite import mvnormal
 
 from venture.lite.psp import DeterministicMakerAAAPSP
 from venture.lite.psp import NullRequestPSP
@@ -64,6 +67,24 @@ def mvtSample(mu,Sigma,N,rng):
 
   return mu + (Z.T)/np.sqrt(g)
 
+def mvtLogDensityFactored(x,mu,L,c,v):
+  # Same as mvtLogDensity, with Sigma = c L L^T for a lower-triangular
+  # Cholesky factor L, at O(p^2) rather than O(p^3) cost
+  p = np.size(x)
+  pterm1 = gammaln((v + p) / 2.)
+  nterm1 = gammaln(v / 2.)
+  nterm2 = (p / 2.) * math.log(v * math.pi)
+  nterm3 = 0.5 * p * math.log(c) + np.sum(np.log(np.diag(L)))
+  z = la.solve_triangular(L, x - mu, lower=True)
+  nterm4 = ((v + p) / 2.) * math.log1p(np.dot(z, z) / (c * v))
+  return pterm1 - (nterm1 + nterm2 + nterm3 + nterm4)
+
+def mvtSampleFactored(mu,L,c,N,rng):
+  # Same as mvtSample, with Sigma = c L L^T
+  g = rng.gamma(N/2., 2./N)
+  Z = math.sqrt(c) * np.dot(L, rng.standard_normal(len(mu)))
+  return mu + Z/math.sqrt(g)
+
 
 ### Collapsed Multivariate Normal
 # (from Murphy, section 4.6.3.3, page 134)
@@ -74,20 +95,114 @@ def mvtSample(mu,Sigma,N,rng):
 
 # TODO: I remember there being mistakes in this section (wrt dividing by N)
 
+class CMVNPosterior(object):
+  """Posterior parameters mN, kN, vN of a collapsed multivariate
+  normal, with the lower-triangular Cholesky factor L of SN.
+
+  Immutable: incorporating or unincorporating an observation yields a
+  new posterior by a rank-one update of L, which costs O(d^2) rather
+  than O(d^3) to refactor SN from scratch.  Keyed on the output PSP
+  holding the hyperparameters, which changes when they do.
+
+  Rounding errors in the updates accumulate, so after d of them, or a
+  downdate that cancels most of a pivot of L, the posterior gives way
+  to one refactored from the sufficient statistics.  That keeps the
+  amortized cost per update at O(d^2).
+  """
+
+  # Smallest ratio of a pivot of L after a downdate to before it
+  DOWNDATE_PIVOT_RATIO = 1e-3
+
+  def __init__(self, psp, mN, kN, vN, L, updates=0):
+    self.psp = psp
+    self.mN = mN
+    self.kN = kN
+    self.vN = vN
+    self.L = L
+    self.updates = updates # Rank-one updates since L was factored
+
+  @staticmethod
+  def compute(psp, aux):
+    """Return the posterior from the aux's totals, or None if SN is
+    not numerically positive-definite."""
+    (mN,kN,vN,SN) = psp.updatedParams(aux)
+    try:
+      L = la.cholesky(SN, lower=True)
+    except la.LinAlgError:
+      return None
+    return CMVNPosterior(psp, np.asarray(mN).reshape(-1), kN, vN, L)
+
+  def incorporate(self, x):
+    """Return the posterior with x, or None if it is due to be
+    recomputed from the sufficient statistics."""
+    if self.updates + 1 >= len(self.mN):
+      return None
+    # SN grows by kN/(kN+1) (x - mN)(x - mN)^T
+    kN = self.kN
+    dx = x - self.mN
+    L = mvnormal.cholesky_update(self.L, math.sqrt(kN / (kN + 1.)) * dx)
+    mN = self.mN + dx / (kN + 1.)
+    return CMVNPosterior(self.psp, mN, kN + 1, self.vN + 1, L,
+                         self.updates + 1)
+
+  def unincorporate(self, x):
+    """Return the posterior without x, or None if it is due to be
+    recomputed from the sufficient statistics (or cannot be)."""
+    if self.updates + 1 >= len(self.mN):
+      return None
+    kN = self.kN
+    dx = x - self.mN
+    try:
+      L = mvnormal.cholesky_downdate(
+        self.L, math.sqrt(kN / (kN - 1.)) * dx)
+    except la.LinAlgError:
+      return None
+    if np.min(np.diag(L) / np.diag(self.L)) < self.DOWNDATE_PIVOT_RATIO:
+      # Too much cancellation to trust the rest of L
+      return None
+    mN = self.mN - dx / (kN - 1.)
+    return CMVNPosterior(self.psp, mN, kN - 1, self.vN - 1, L,
+                         self.updates + 1)
+
+  def mvtParams(self, d):
+    # The Student-t predictive, with scale matrix c L L^T
+    vArg = self.vN - d + 1
+    c = float(self.kN + 1) / (self.kN * vArg)
+    return self.mN, self.L, c, vArg
+
 class CMVNSPAux(SPAux):
   def __init__(self,d):
     self.N = 0
     self.STotal = np.mat(np.zeros((d,d)))
     self.xTotal = np.mat(np.zeros((d,1)))
     self.d = d
+    # Cached CMVNPosterior for the current totals, or None.  It is
+    # immutable, so copies of the aux can share it.
+    self.posterior = None
 
   def copy(self):
     aux = CMVNSPAux(self.d)
     aux.N = self.N
     aux.STotal = np.copy(self.STotal)
     aux.xTotal = np.copy(self.xTotal)
+    aux.posterior = self.posterior
     return aux
 
+  def cachedPosterior(self, psp):
+    """Return the posterior under psp's hyperparameters, or None if
+    it cannot be factored.
+
+    The posterior is cached, and maintained incrementally under
+    incorporate and unincorporate; it is recomputed from the totals
+    if the hyperparameters change, or periodically to shed rounding
+    errors.
+    """
+    posterior = self.posterior
+    if posterior is None or posterior.psp is not psp:
+      posterior = CMVNPosterior.compute(psp, self)
+      self.posterior = posterior
+    return posterior
+
 class CMVNSP(SP):
   def __init__(self,requestPSP,outputPSP,d):
     super(CMVNSP,self).__init__(requestPSP,outputPSP)
@@ -134,35 +249,68 @@ class CMVNOutputPSP(RandomPSP):
     return self.mvtParams(*self.updatedParams(spaux))
 
   def simulate(self,args):
-    (mu, Sigma, N) = self.getMVTParams(args.spaux())
+    aux = args.spaux()
+    posterior = aux.cachedPosterior(self)
+    if posterior is not None:
+      (mu, L, c, N) = posterior.mvtParams(self.d)
+      return mvtSampleFactored(mu, L, c, N, args.np_prng())
+    (mu, Sigma, N) = self.getMVTParams(aux)
     x = mvtSample(mu, Sigma, N, args.np_prng())
     return x.A1
 
   def logDensity(self,x,args):
+    aux = args.spaux()
+    posterior = aux.cachedPosterior(self)
+    if posterior is not None:
+      x = np.asarray(x, dtype=float).reshape(self.d)
+      return mvtLogDensityFactored(x, *posterior.mvtParams(self.d))
     x = np.mat(x).reshape((self.d,1))
-    return mvtLogDensity(x, *self.getMVTParams(args.spaux()))
+    return mvtLogDensity(x, *self.getMVTParams(aux))
 
   def incorporate(self,x,args):
-    x = np.mat(x).reshape((self.d,1))
+    x = np.asarray(x, dtype=float).reshape(self.d)
     aux = args.spaux()
+    posterior = aux.posterior
+    if posterior is not None:
+      if posterior.psp is self:
+        posterior = posterior.incorporate(x)
+      else:
+        posterior = None
+    aux.posterior = posterior
+    x = np.mat(x).reshape((self.d,1))
     aux.N += 1
     aux.xTotal += x
     aux.STotal += x * x.T
 
   def unincorporate(self,x,args):
-    x = np.mat(x).reshape((self.d,1))
+    x = np.asarray(x, dtype=float).reshape(self.d)
     aux = args.spaux()
+    posterior = aux.posterior
+    if posterior is not None:
+      if posterior.psp is self:
+        posterior = posterior.unincorporate(x)
+      else:
+        posterior = None
+    aux.posterior = posterior
+    x = np.mat(x).reshape((self.d,1))
     aux.N -= 1
     aux.xTotal -= x
     aux.STotal -= x * x.T
 
   def logDensityOfData(self,aux):
-    (mN,kN,vN,SN) = self.updatedParams(aux)
+    posterior = aux.cachedPosterior(self)
+    if posterior is not None:
+      vN = posterior.vN
+      kN = posterior.kN
+      logdetSN = 2 * np.sum(np.log(np.diag(posterior.L)))
+    else:
+      (_mN,kN,vN,SN) = self.updatedParams(aux)
+      logdetSN = np.linalg.slogdet(SN)[1]
     term1 = - (aux.N * self.d * math.log(math.pi)) / 2.
     term2 = logGenGamma(self.d, vN / 2.)
     term3 = - logGenGamma(self.d, self.v0 / 2.)
     term4 = (self.v0 / 2.) * np.linalg.slogdet(self.S0)[1] # first is sign
-    term5 = -(vN / 2.) * np.linalg.slogdet(SN)[1]
+    term5 = -(vN / 2.) * logdetSN
     term6 = (self.d / 2.) * math.log(float(self.k0) / kN)
     return term1 + term2 + term3 + term4 + term5 + term6
 
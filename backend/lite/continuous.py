@@ -349,6 +349,18 @@ class NormalOutputPSP(RandomPSP):
   def logDensityBound(self, x, args):
     return self.logDensityBoundNumeric(x, *args.operandValues())
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    return self.simulateNumeric(params, np_rng)
+
+  def logDensityBatch(self, xs, params):
+    (mu, sigma) = params
+    deviation = xs - mu
+    return - np.log(sigma) - HALF_LOG2PI \
+      - (0.5 * deviation * deviation / (sigma * sigma))
+
   def hasDeltaKernel(self):
     return False # have each gkernel control whether it is delta or not
 
@@ -653,6 +665,15 @@ class UniformOutputPSP(RandomPSP):
   def logDensity(self, x, args):
     return self.logDensityNumeric(x,*args.operandValues())
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    return self.simulateNumeric(*(params + [np_rng]))
+
+  def logDensityBatch(self, xs, params):
+    return self.logDensityNumeric(xs, *params)
+
   def gradientOfLogDensity(self, _, args):
     (low, high) = args.operandValues()
     spread = 1.0 / (high - low)
@@ -1143,6 +1164,15 @@ class ExponOutputPSP(RandomPSP):
   def logDensity(self,x,args):
     return self.logDensityNumeric(x,*args.operandValues())
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    return self.simulateNumeric(*(params + [np_rng]))
+
+  def logDensityBatch(self, xs, params):
+    return self.logDensityNumeric(xs, *params)
+
   def gradientOfLogDensity(self,x,args):
     theta = args.operandValues()[0]
     gradX = -theta
@@ -1205,6 +1235,15 @@ class GammaOutputPSP(RandomPSP):
           (beta * value) ** alpha - 1)) - alpha + 1) ** x0 / beta ** 2.0 )
     return [direction * gradAlpha, direction * gradBeta]
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    return self.simulateNumeric(*(params + [np_rng]))
+
+  def logDensityBatch(self, xs, params):
+    return self.logDensityNumeric(xs, *params)
+
   def logDensity(self, x, args):
     return self.logDensityNumeric(x,*args.operandValues())
 
@@ -1237,20 +1276,33 @@ class StudentTOutputPSP(RandomPSP):
   def simulate(self, args):
     vals = args.operandValues()
     loc = vals[1] if len(vals) > 1 else 0
-    shape = vals[2] if len(vals) > 1 else 1
+    shape = vals[2] if len(vals) > 2 else 1
     return self.simulateNumeric(vals[0],loc,shape,args.np_prng())
 
   def logDensity(self, x, args):
     vals = args.operandValues()
     loc = vals[1] if len(vals) > 1 else 0
-    shape = vals[2] if len(vals) > 1 else 1
+    shape = vals[2] if len(vals) > 2 else 1
     return self.logDensityNumeric(x,vals[0],loc,shape)
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    loc = params[1] if len(params) > 1 else 0
+    shape = params[2] if len(params) > 2 else 1
+    return self.simulateNumeric(params[0], loc, shape, np_rng)
+
+  def logDensityBatch(self, xs, params):
+    loc = params[1] if len(params) > 1 else 0
+    shape = params[2] if len(params) > 2 else 1
+    return self.logDensityNumeric(xs, params[0], loc, shape)
+
   def gradientOfLogDensity(self, x, args):
     vals = args.operandValues()
     nu = vals[0]
     loc = vals[1] if len(vals) > 1 else 0
-    shape = vals[2] if len(vals) > 1 else 1
+    shape = vals[2] if len(vals) > 2 else 1
     gradX = (loc - x) * (nu + 1) / (nu * shape ** 2 + (loc - x) ** 2)
     # we'll do gradNu in pieces because it's messy
     x0 = 1.0 / nu
@@ -1265,6 +1317,8 @@ class StudentTOutputPSP(RandomPSP):
     if len(vals) == 1:
       return (gradX,[gradNu])
     gradLoc = -(loc - x) * (nu + 1) / (nu * shape ** 2 + (loc - x) ** 2)
+    if len(vals) == 2:
+      return (gradX,[gradNu,gradLoc])
     gradShape = ((-nu * shape ** 2 + (loc - x) ** 2 * (nu + 1) -
                  (loc - x) ** 2) / (shape * (nu * shape ** 2 + (loc - x) ** 2)))
     return (gradX,[gradNu,gradLoc,gradShape])
@@ -1294,6 +1348,15 @@ class InvGammaOutputPSP(RandomPSP):
     return self.simulateNumeric(*(args.operandValues() +
                                   [args.np_prng()]))
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    return self.simulateNumeric(*(params + [np_rng]))
+
+  def logDensityBatch(self, xs, params):
+    return self.logDensityNumeric(xs, *params)
+
   def logDensity(self, x, args):
     return self.logDensityNumeric(x, *args.operandValues())
 
@@ -1327,6 +1390,15 @@ class LaplaceOutputPSP(RandomPSP):
     return self.simulateNumeric(*(args.operandValues() +
                                   [args.np_prng()]))
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    return self.simulateNumeric(*(params + [np_rng]))
+
+  def logDensityBatch(self, xs, params):
+    return self.logDensityNumeric(xs, *params)
+
   def logDensity(self, x, args):
     return self.logDensityNumeric(x,*args.operandValues())
 
@@ -50,6 +50,18 @@ parameters theta^i must be scalars; there is no other matrix
 representation of a linear map from a rank-n tensor into matrices for
 n > 0.
 
+The derivative is evaluated together with the covariance matrix
+itself: df_theta(X, Y) returns the pair (k_theta(X, Y), [t_1, t_2, ...,
+t_h]), computed from one set of pairwise distances, so callers that
+need both should not also call f.
+
+Isotropic kernels depend on X and Y only through the matrix of
+squared distances |x_i - y_j|^2, which does not change when only the
+parameters theta do.  Those matrices are cached by the contents of X
+and Y, least recently used first out, so that re-evaluating a kernel
+with new parameters at the same inputs costs no new distances.  See
+set_r2_cache_bound and clear_r2_cache to limit or release them.
+
 XXX Replace the computational representation of the derivatives by a
 function that computes the increment in the covariance matrix, rather
 than a function that returns a matrix whose product with an increment
@@ -58,6 +70,10 @@ in theta is an increment in the covariance matrix.
 
 from __future__ import division
 
+from collections import OrderedDict
+import hashlib
+import threading
+
 import numpy as np
 import scipy.spatial.distance
 
@@ -127,11 +143,7 @@ class Isotropic(Kernel):
 
   @override(Kernel)
   def f(self, X, Y):
-    # XXX Use _isotropic.
-    f = self.k_r2
-    X = X.reshape(len(X), -1)
-    Y = Y.reshape(len(Y), -1)
-    return f(scipy.spatial.distance.cdist(X, Y, 'sqeuclidean'))
+    return _isotropic(self.k_r2, X, Y)
 
   @override(Kernel)
   def df_theta(self, X, Y):
@@ -233,9 +245,90 @@ class Isotropic(Kernel):
 
 
 def _isotropic(f, X, Y):
+  return f(_sqeuclidean(X, Y))
+
+
+# Bound on the total number of entries of the cached distance
+# matrices, enough for one among 2000 inputs (32 MiB).
+_r2_cache_bound = 2**22
+
+_r2_cache = OrderedDict() # (X key, Y key) -> read-only r2 matrix
+_r2_cache_elements = 0
+# Kernels of different particles may be evaluated in different threads
+_r2_cache_lock = threading.Lock()
+
+def set_r2_cache_bound(elements):
+  """Bound the total number of entries of the squared-distance
+  matrices isotropic kernels keep for reuse; 0 keeps none."""
+  global _r2_cache_bound # pylint:disable=global-statement
+  with _r2_cache_lock:
+    _r2_cache_bound = elements
+    _shrink_r2_cache()
+
+def clear_r2_cache():
+  """Forget the squared-distance matrices isotropic kernels keep for
+  reuse."""
+  global _r2_cache_elements # pylint:disable=global-statement
+  with _r2_cache_lock:
+    _r2_cache.clear()
+    _r2_cache_elements = 0
+
+def _sqeuclidean(X, Y):
+  """Matrix of squared distances |x_i - y_j|^2 between arrays of input
+  points X and Y, cached by their contents.
+
+  The result is shared with later callers, so it is read-only.
+  """
+  X = np.asarray(X)
+  Y = np.asarray(Y)
   X = X.reshape(len(X), -1)
   Y = Y.reshape(len(Y), -1)
-  return f(scipy.spatial.distance.cdist(X, Y, 'sqeuclidean'))
+  x_key = _inputs_key(X)
+  y_key = _inputs_key(Y)
+  if x_key is None or y_key is None:
+    return scipy.spatial.distance.cdist(X, Y, 'sqeuclidean')
+  key = (x_key, y_key)
+  with _r2_cache_lock:
+    r2 = _r2_cache.pop(key, None)
+    if r2 is not None:
+      _r2_cache[key] = r2 # Now the most recently used
+      return r2
+    # The transpose is served from the same entry, not stored again
+    r2_T = _r2_cache.pop((y_key, x_key), None)
+    if r2_T is not None:
+      _r2_cache[(y_key, x_key)] = r2_T
+      return r2_T.T
+  if x_key == y_key and len(X) > 1:
+    r2 = scipy.spatial.distance.squareform(
+      scipy.spatial.distance.pdist(X, 'sqeuclidean'))
+  else:
+    r2 = scipy.spatial.distance.cdist(X, Y, 'sqeuclidean')
+  r2.setflags(write=False)
+  with _r2_cache_lock:
+    _store_r2(key, r2)
+  return r2
+
+def _store_r2(key, r2):
+  global _r2_cache_elements # pylint:disable=global-statement
+  if key in _r2_cache or r2.size > _r2_cache_bound:
+    # Already stored by another thread, or too big to keep
+    return
+  _r2_cache[key] = r2
+  _r2_cache_elements += r2.size
+  _shrink_r2_cache()
+
+def _shrink_r2_cache():
+  global _r2_cache_elements # pylint:disable=global-statement
+  while _r2_cache_elements > _r2_cache_bound:
+    (_, evicted) = _r2_cache.popitem(last=False)
+    _r2_cache_elements -= evicted.size
+
+def _inputs_key(X):
+  # Only numeric arrays can be keyed by their bytes.
+  if X.dtype.kind not in 'biuf':
+    return None
+  digest = hashlib.sha1(np.ascontiguousarray(X).tobytes()).digest()
+  return (X.shape, X.dtype.str, digest)
 
 
 class delta(Isotropic):
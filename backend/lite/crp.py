@@ -31,14 +31,12 @@ with valid domains will result in dangerous behavior.
 """
 
 from collections import OrderedDict
-from copy import deepcopy
 from weakref import WeakKeyDictionary
 import itertools
 import math
 
 from scipy.special import digamma, gammaln
 
-from venture.lite.orderedset import OrderedSet
 from venture.lite.psp import DeterministicMakerAAAPSP
 from venture.lite.psp import NullRequestPSP
 from venture.lite.psp import RandomPSP
@@ -51,27 +49,41 @@ from venture.lite.sp_help import typed_nr
 from venture.lite.sp_registry import registerBuiltinSP
 from venture.lite.sp_use import MockArgs
 from venture.lite.utils import logsumexp
-from venture.lite.utils import simulateCategorical
+from venture.lite.wttree import PMap
+from venture.lite.wttree import PSet
 import venture.lite.types as t
 
+def _increment(ct): return ct + 1
+def _decrement(ct): return ct - 1
+
 class CRPSPAux(SPAux):
+  """The table counts and the free tables are persistent maps and
+  sets, so copies of the aux (as particles make) share them, and only
+  the tables a copy touches are duplicated.  The count map caches
+  subtree sums, so seating a customer samples a table in O(log K)."""
+
   def __init__(self):
-    self.tableCounts = OrderedDict()
+    self.tableCounts = PMap() # table -> number of customers
     self.nextTable = 1
-    self.freeTables = OrderedSet()
+    self.freeTables = PSet()
     self.numTables = 0
     self.numCustomers = 0
+    # (d, sum over tables of log (1-d)_{ct-1}), the table counts'
+    # term of logDensityOfData under discount d, maintained under
+    # incorporate and unincorporate; or None if not known.
+    self.countsTerm = None
 
     # application node ---> most recently unincorporated table
     self.cachedTables = WeakKeyDictionary()
 
   def copy(self):
     crp = CRPSPAux()
-    crp.tableCounts = deepcopy(self.tableCounts)
+    crp.tableCounts = self.tableCounts
     crp.nextTable = self.nextTable
-    crp.freeTables = self.freeTables.copy()
+    crp.freeTables = self.freeTables
     crp.numTables = self.numTables
     crp.numCustomers = self.numCustomers
+    crp.countsTerm = self.countsTerm
     crp.cachedTables = WeakKeyDictionary(self.cachedTables)
     return crp
 
@@ -86,7 +98,7 @@ class CRPSP(SP):
   def show(self, spaux):
     return OrderedDict([
       ('type', 'crp'),
-      ('counts', spaux.tableCounts),
+      ('counts', OrderedDict(spaux.tableCounts.iteritems())),
     ])
 
 class MakeCRPOutputPSP(DeterministicMakerAAAPSP):
@@ -123,18 +135,23 @@ class CRPOutputPSP(RandomPSP):
 
   def simulate(self, args):
     aux = args.spaux()
-    oldTables = [i for i in aux.tableCounts]
-    counts = [aux.tableCounts[i] - self.d for i in oldTables] + \
-        [self.alpha + (aux.numTables * self.d)]
-    nextTable = aux.nextTable if len(aux.freeTables) == 0 \
-        else iter(aux.freeTables).next()
-    allTables = oldTables + [nextTable]
-    return simulateCategorical(counts, args.np_prng(), allTables)
+    # The occupied tables weigh numCustomers - numTables*d in all,
+    # and a new table alpha + numTables*d.
+    oldWeight = aux.numCustomers - aux.numTables * self.d
+    x = args.np_prng().random_sample() * (oldWeight + self.alpha +
+                                          aux.numTables * self.d)
+    if x < oldWeight:
+      return aux.tableCounts.keyAtWeight(x, self.d)
+    elif len(aux.freeTables) == 0:
+      return aux.nextTable
+    else:
+      return iter(aux.freeTables).next()
 
   def logDensity(self, table, args):
     aux = args.spaux()
-    if table in aux.tableCounts:
-      return math.log(aux.tableCounts[table] - self.d) - \
+    ct = aux.tableCounts.lookup(table)
+    if ct is not None:
+      return math.log(ct - self.d) - \
         math.log(self.alpha + aux.numCustomers)
     else:
       return math.log(self.alpha + (aux.numTables * self.d)) - \
@@ -143,13 +160,15 @@ class CRPOutputPSP(RandomPSP):
   def incorporate(self, table, args):
     aux = args.spaux()
     aux.numCustomers += 1
-    if table in aux.tableCounts:
-      aux.tableCounts[table] += 1
+    ct = aux.tableCounts.lookup(table)
+    if ct is not None:
+      self._updateCountsTerm(aux, math.log(ct - self.d))
+      aux.tableCounts = aux.tableCounts.adjust(table, _increment)
     else:
-      aux.tableCounts[table] = 1
+      aux.tableCounts = aux.tableCounts.insert(table, 1)
       aux.numTables += 1
       if table in aux.freeTables:
-        aux.freeTables.discard(table)
+        aux.freeTables = aux.freeTables.delete(table)
       else:
         aux.nextTable = max(table+1, aux.nextTable)
     if args.node in aux.cachedTables:
@@ -158,12 +177,34 @@ class CRPOutputPSP(RandomPSP):
   def unincorporate(self, table, args):
     aux = args.spaux()
     aux.numCustomers -= 1
-    aux.tableCounts[table] -= 1
-    if aux.tableCounts[table] == 0:
+    ct = aux.tableCounts.lookup(table) - 1
+    if ct > 0:
+      self._updateCountsTerm(aux, -math.log(ct - self.d))
+    if ct == 0:
       aux.numTables -= 1
-      del aux.tableCounts[table]
-      aux.freeTables.add(table)
+      aux.tableCounts = aux.tableCounts.delete(table)
+      aux.freeTables = aux.freeTables.insert(table)
       aux.cachedTables[args.node] = table
+    else:
+      aux.tableCounts = aux.tableCounts.adjust(table, _decrement)
+
+  def _updateCountsTerm(self, aux, delta):
+    # Seating a customer at a table with ct others multiplies the
+    # table's term by (ct - d); opening or closing a table leaves it
+    # unchanged.
+    if aux.countsTerm is not None:
+      (d, term) = aux.countsTerm
+      if d == self.d:
+        aux.countsTerm = (d, term + delta)
+      else:
+        aux.countsTerm = None
+
+  def _countsTerm(self, aux):
+    if aux.countsTerm is None or aux.countsTerm[0] != self.d:
+      term = sum(gammaln(ct-self.d) - gammaln(1-self.d)
+        for (_, ct) in aux.tableCounts.iteritems())
+      aux.countsTerm = (self.d, term)
+    return aux.countsTerm[1]
 
   def logDensityOfData(self, aux):
     # For derivation see Section Chinese Restaraunt Process in
@@ -174,17 +215,24 @@ class CRPOutputPSP(RandomPSP):
     # log( (foo+1)_{bar-1} ) in the notation of sp-math.tex turns into
     # gammaln(foo+bar) - gammaln(foo+1)
     # TODO No doubt there is a numerically better way to compute this quantity.
-    term1 = sum(math.log(self.alpha + i*self.d)
-      for i in xrange(1, aux.numTables))
-    term2 = sum(gammaln(aux.tableCounts[t]-self.d) - gammaln(1-self.d)
-      for t in aux.tableCounts)
+    if self.d == 0:
+      term1 = max(aux.numTables - 1, 0) * math.log(self.alpha)
+    elif self.d > 0 and aux.numTables > 1:
+      # prod_{i=1}^{K-1} (alpha + i d) = d^{K-1} (alpha/d + 1)_{K-1}
+      a = self.alpha / self.d
+      term1 = (aux.numTables - 1) * math.log(self.d) + \
+        gammaln(a + aux.numTables) - gammaln(a + 1)
+    else:
+      term1 = sum(math.log(self.alpha + i*self.d)
+        for i in xrange(1, aux.numTables))
+    term2 = self._countsTerm(aux)
     term3 = gammaln(self.alpha + max(aux.numCustomers, 1)) - \
         gammaln(self.alpha+1)
     return term1 + term2 - term3
 
   def enumerateValues(self, args):
     aux = args.spaux()
-    tables = aux.tableCounts.keys()
+    tables = list(aux.tableCounts)
     # If there were recently unincorporated applications that emptied
     # tables, offer those as possibilities.  Otherwise, offer the next
     # unseated table.
@@ -18,6 +18,7 @@
 import math
 from collections import OrderedDict
 
+import numpy as np
 import scipy
 import scipy.special
 
@@ -66,6 +67,17 @@ class BernoulliOutputPSP(DiscretePSP):
     else:
       return log1p(-p)
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, size, np_rng):
+    p = params[0] if params else 0.5
+    return np_rng.uniform(size=size) < p
+
+  def logDensityBatch(self, vals, params):
+    p = params[0] if params else 0.5
+    return np.where(vals, np.log(p), np.log1p(-p))
+
   def gradientOfLogDensity(self, val, args):
     vals = args.operandValues()
     if len(vals) > 0:
@@ -346,6 +358,17 @@ class PoissonOutputPSP(DiscretePSP):
   def logDensity(self, val, args):
     return scipy.stats.poisson.logpmf(val, args.operandValues()[0])
 
+  def canBatch(self):
+    return True
+
+  def simulateBatch(self, params, _size, np_rng):
+    (lam,) = params
+    return np_rng.poisson(lam=lam)
+
+  def logDensityBatch(self, vals, params):
+    (lam,) = params
+    return scipy.stats.poisson.logpmf(vals, lam)
+
   def description(self, name):
     return '  %s(mu) samples a Poisson with rate mu' % name
 
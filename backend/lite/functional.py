@@ -28,6 +28,7 @@ from venture.lite.request import ESR
 from venture.lite.request import Request
 from venture.lite.sp import SP
 from venture.lite.sp import SPType
+from venture.lite.sp import VentureSPRecord
 from venture.lite.sp_help import esr_output
 from venture.lite.sp_help import typed_nr
 from venture.lite.sp_registry import registerBuiltinSP
@@ -165,18 +166,26 @@ registerBuiltinSP(
                         t.HomogeneousArrayType(t.ExpressionType())],
                        EnvironmentType()))))
 
+def madeSPRecordOf(spref):
+    # XXX trace.madeSPRecordAt(spref.makerNode)
+    record = spref.makerNode.madeSPRecord
+    if record is None:
+        # A builtin procedure, whose record each trace keeps (see
+        # venture.lite.node.BuiltinNode); a fresh one has the same
+        # procedure and an empty aux.
+        record = VentureSPRecord(spref.makerNode.sp)
+    return record
+
 class AssessOutputPSP(DeterministicPSP):
     def simulate(self, args):
         vals = args.operandValues()
         value = vals[0]
         if isinstance(value, SPRef):
-            # XXX trace.madeSPRecordAt(value.makerNode)
-            value = value.makerNode.madeSPRecord
+            value = madeSPRecordOf(value)
 
         operator = vals[1]
         if isinstance(operator, SPRef):
-            # XXX trace.madeSPRecordAt(operator.makerNode)
-            operator = operator.makerNode.madeSPRecord
+            operator = madeSPRecordOf(operator)
         if not isinstance(operator.sp.requestPSP, NullRequestPSP):
             raise VentureValueError("Cannot assess a requesting SP.")
         if not operator.sp.outputPSP.isRandom():
@@ -19,6 +19,7 @@ import copy
 from collections import OrderedDict
 
 import numpy as np
+import scipy.linalg as la
 
 from venture.lite.function import ParamLeaf
 from venture.lite.function import parameter_nest
@@ -40,15 +41,15 @@ import venture.lite.types as t
 import venture.lite.value as v
 import venture.value.dicts as vv
 
-def _gp_sample(mean, covariance, samples, xs, np_rng):
-  mu, sigma = _gp_mvnormal(mean, covariance, samples, xs)
+def _gp_sample(mean, covariance, samples, xs, np_rng, covf22=None):
+  mu, sigma = _gp_mvnormal(mean, covariance, samples, xs, covf22=covf22)
   return np_rng.multivariate_normal(mu, sigma)
 
-def _gp_logDensity(mean, covariance, samples, xs, os):
-  mu, sigma = _gp_mvnormal(mean, covariance, samples, xs)
+def _gp_logDensity(mean, covariance, samples, xs, os, covf22=None):
+  mu, sigma = _gp_mvnormal(mean, covariance, samples, xs, covf22=covf22)
   return mvnormal.logpdf(np.asarray(os).reshape(len(xs),), mu, sigma)
 
-def _gp_gradientOfLogDensity(mean, covariance, samples, xs, os):
+def _gp_gradientOfLogDensity(mean, covariance, samples, xs, os, covf22=None):
   # d/do_1 log P(o_1 | Mu, Sigma, x_1, X_2, O_2),
   # d/dx_1 log P(o_1 | Mu, Sigma, x_1, X_2, O_2)
   xs1 = xs
@@ -61,8 +62,8 @@ def _gp_gradientOfLogDensity(mean, covariance, samples, xs, os):
 
   if samples:
     mu2 = mean.f(xs2)
-    sigma22 = covariance.f(xs2, xs2)
-    covf22 = mvnormal._covariance_factor(sigma22) # XXX Expose?
+    if covf22 is None:
+      covf22 = mvnormal._covariance_factor(covariance.f(xs2, xs2))
     alpha2 = covf22.solve(os2 - mu2)
 
   for x1, o1 in zip(xs1, os1):
@@ -79,8 +80,8 @@ def _gp_gradientOfLogDensity(mean, covariance, samples, xs, os):
       assert len(dsigma12_dx1) == np.asarray(x1).reshape(-1).shape[0], \
         '%r %r %r' % (x1, dsigma12_dx1, np.asarray(x1).reshape(-1).shape)
       sigma21 = sigma12.T
-      mu_, sigma_ = mvnormal.conditional(
-        os2, mu1, mu2, sigma11, sigma12, sigma21, sigma22)
+      mu_, sigma_ = mvnormal.conditional_factored(
+        os2, mu1, mu2, sigma11, sigma12, sigma21, covf22)
       dmu_ = dmu1_dx1 + np.dot(dsigma12_dx1, alpha2)
       dsigma_ = dsigma11_dx1 - np.dot(dsigma12_dx1, covf22.solve(sigma21))
     else:
@@ -93,16 +94,22 @@ def _gp_gradientOfLogDensity(mean, covariance, samples, xs, os):
 
   return np.array(dos1), [np.array(dxs1)]
 
-def _gp_logDensityOfData(mean, covariance, samples):
+def _gp_logDensityOfData(mean, covariance, samples, covf=None):
   if len(samples) == 0:
     return 0
   xs = np.asarray(samples.keys())
   os = np.asarray(samples.values())
   mu = mean.f(xs)
-  sigma = covariance.f(xs, xs)
-  return mvnormal.logpdf(os, mu, sigma)
-
-def _gp_gradientOfLogDensityOfData(mean, covariance, samples):
+  if covf is None:
+    sigma = covariance.f(xs, xs)
+    return mvnormal.logpdf(os, mu, sigma)
+  return mvnormal.logpdf_factored(os, mu, covf)
+
+def _gp_gradientOfLogDensityOfData(mean, covariance, samples, factor=None):
+  # If given, factor maps the covariance matrix of the sample inputs
+  # to a factor of it, as GPSPAux.covariance_factor maintains; the
+  # matrix comes along with its derivatives, so it is not computed
+  # twice.
   if len(samples) == 0:
     return 0
   xs = np.asarray(samples.keys())
@@ -110,11 +117,17 @@ def _gp_gradientOfLogDensityOfData(mean, covariance, samples):
   dos = np.zeros(os.shape)
   mu, dmu = mean.df_theta(xs)
   sigma, dsigma = covariance.df_theta(xs, xs)
+  if factor is None:
+    covf = mvnormal._covariance_factor(sigma)
+  else:
+    covf = factor(sigma)
   _dlogp_dos_i, dlogp_dmu_j, dlogp_dsigma_k = \
-    mvnormal.dlogpdf(os, dos, mu, dmu, sigma, dsigma)
+    mvnormal.dlogpdf_factored(os, dos, mu, dmu, covf, dsigma)
   return [dlogp_dmu_j, dlogp_dsigma_k]
 
-def _gp_mvnormal(mean, covariance, samples, xs):
+def _gp_mvnormal(mean, covariance, samples, xs, covf22=None):
+  # If given, covf22 is a factor of the covariance matrix of the
+  # sample inputs, as GPSPAux.covariance_factor maintains.
   xs = np.asarray(xs)
   if len(samples) == 0:
     mu = mean.f(xs)
@@ -126,10 +139,11 @@ def _gp_mvnormal(mean, covariance, samples, xs):
     mu2 = mean.f(x2s)
     sigma11 = covariance.f(xs, xs)
     sigma12 = covariance.f(xs, x2s)
-    sigma21 = covariance.f(x2s, xs)
-    sigma22 = covariance.f(x2s, x2s)
-    mu, sigma = mvnormal.conditional(
-      o2s, mu1, mu2, sigma11, sigma12, sigma21, sigma22)
+    sigma21 = sigma12.T # Covariance kernels are symmetric
+    if covf22 is None:
+      covf22 = mvnormal._covariance_factor(covariance.f(x2s, x2s))
+    mu, sigma = mvnormal.conditional_factored(
+      o2s, mu1, mu2, sigma11, sigma12, sigma21, covf22)
   return mu, sigma
 
 class GPOutputPSP(RandomPSP):
@@ -138,71 +152,71 @@ class GPOutputPSP(RandomPSP):
     self.covariance = covariance
 
   def simulate(self, args):
-    samples = args.spaux().samples
+    aux = args.spaux()
     xs = args.operandValues()[0]
-    return _gp_sample(self.mean, self.covariance, samples, xs,
-                      args.np_prng())
+    return _gp_sample(self.mean, self.covariance, aux.samples, xs,
+                      args.np_prng(),
+                      covf22=aux.covariance_factor(self.covariance))
 
   def logDensity(self, os, args):
-    samples = args.spaux().samples
+    aux = args.spaux()
     xs = args.operandValues()[0]
-    return _gp_logDensity(self.mean, self.covariance, samples, xs, os)
+    return _gp_logDensity(self.mean, self.covariance, aux.samples, xs, os,
+                          covf22=aux.covariance_factor(self.covariance))
 
   def gradientOfLogDensity(self, os, args):
-    samples = args.spaux().samples
+    aux = args.spaux()
     xs = args.operandValues()[0]
     return _gp_gradientOfLogDensity(
-      self.mean, self.covariance, samples, xs, os)
+      self.mean, self.covariance, aux.samples, xs, os,
+      covf22=aux.covariance_factor(self.covariance))
 
   def logDensityOfData(self, aux):
-    ans = _gp_logDensityOfData(self.mean, self.covariance, aux.samples)
+    ans = _gp_logDensityOfData(self.mean, self.covariance, aux.samples,
+                               covf=aux.covariance_factor(self.covariance))
     assert not np.isnan(ans), \
       "GP got NaN log density of data at %s, %s, %s" \
       % (self.mean, self.covariance, aux.samples)
     return ans
 
   def incorporate(self, os, args):
-    samples = args.spaux().samples
     xs = args.operandValues()[0]
-
-    for x, o in zip(xs, os):
-      samples[tuple(x) if isinstance(x, np.ndarray) else x] = o
+    args.spaux().incorporate(self.covariance, xs, os)
 
   def unincorporate(self, _os, args):
-    samples = args.spaux().samples
     xs = args.operandValues()[0]
-    for x in xs:
-      del samples[tuple(x) if isinstance(x, np.ndarray) else x]
+    args.spaux().unincorporate(self.covariance, xs)
 
 class GPOutputPSP1(GPOutputPSP):
   # version of GPOutputPSP that accepts and returns scalars.
 
   def simulate(self, args):
-    samples = args.spaux().samples
+    aux = args.spaux()
     x = args.operandValues()[0]
-    return _gp_sample(self.mean, self.covariance, samples, [x],
-                      args.np_prng())[0]
+    return _gp_sample(self.mean, self.covariance, aux.samples, [x],
+                      args.np_prng(),
+                      covf22=aux.covariance_factor(self.covariance))[0]
 
   def logDensity(self, o, args):
-    samples = args.spaux().samples
+    aux = args.spaux()
     x = args.operandValues()[0]
-    return _gp_logDensity(self.mean, self.covariance, samples, [x], [o])
+    return _gp_logDensity(self.mean, self.covariance, aux.samples, [x], [o],
+                          covf22=aux.covariance_factor(self.covariance))
 
   def gradientOfLogDensity(self, o, args):
-    samples = args.spaux().samples
+    aux = args.spaux()
     x = args.operandValues()
     return _gp_gradientOfLogDensity(
-      self.mean, self.covariance, samples, [x], [o])
+      self.mean, self.covariance, aux.samples, [x], [o],
+      covf22=aux.covariance_factor(self.covariance))
 
   def incorporate(self, o, args):
-    samples = args.spaux().samples
     x = args.operandValues()[0]
-    samples[x] = o
+    args.spaux().incorporate(self.covariance, [x], [o])
 
   def unincorporate(self, _o, args):
-    samples = args.spaux().samples
     x = args.operandValues()[0]
-    del samples[x]
+    args.spaux().unincorporate(self.covariance, [x])
 
 gpType = SPType(
   [t.ArrayUnboxedType(t.NumericArrayType())],
@@ -210,13 +224,125 @@ gpType = SPType(
 
 gp1Type = SPType([t.NumberType()], t.NumberType())
 
+def _sample_key(x):
+  return tuple(x) if isinstance(x, np.ndarray) else x
+
+class GPCovarianceFactor(object):
+  """Factor of the covariance matrix among a GP's sample inputs.
+
+  Immutable: incorporating or unincorporating a sample yields a new
+  factor by a Cholesky update, which costs O(n^2) for n samples rather
+  than O(n^3) to refactor from scratch.  If the covariance matrix is
+  not numerically positive-definite, we fall back to whatever
+  mvnormal._covariance_factor can manage, which cannot be updated.
+  """
+
+  def __init__(self, covariance, keys, covf, L=None):
+    self.covariance = covariance
+    self.keys = keys
+    self.covf = covf
+    self._L = L
+
+  @staticmethod
+  def compute(covariance, keys, sigma=None):
+    if sigma is None:
+      xs = np.asarray(keys)
+      sigma = covariance.f(xs, xs)
+    try:
+      L = la.cholesky(sigma, lower=True)
+    except la.LinAlgError:
+      return GPCovarianceFactor(
+        covariance, keys, mvnormal._covariance_factor(sigma))
+    return GPCovarianceFactor.from_lower(covariance, keys, L)
+
+  @staticmethod
+  def from_lower(covariance, keys, L):
+    covf = mvnormal.Covariance_Cholesky.from_lower(L)
+    return GPCovarianceFactor(covariance, keys, covf, L)
+
+  def extend(self, new_keys):
+    """Return the factor with new_keys appended, or None if impossible."""
+    if self._L is None:
+      return None
+    xs1 = np.asarray(self.keys)
+    xs2 = np.asarray(new_keys)
+    try:
+      L = mvnormal.cholesky_extend(self._L,
+        self.covariance.f(xs1, xs2), self.covariance.f(xs2, xs2))
+    except la.LinAlgError:
+      return None
+    return GPCovarianceFactor.from_lower(
+      self.covariance, self.keys + new_keys, L)
+
+  def remove(self, key):
+    """Return the factor with key removed, or None if impossible."""
+    if self._L is None:
+      return None
+    i = self.keys.index(key)
+    keys = self.keys[:i] + self.keys[i+1:]
+    if not keys:
+      return None
+    try:
+      L = mvnormal.cholesky_delete(self._L, i)
+    except la.LinAlgError:
+      return None
+    return GPCovarianceFactor.from_lower(self.covariance, keys, L)
+
 class GPSPAux(SPAux):
 
-  def __init__(self, samples):
+  def __init__(self, samples, factor=None):
     self.samples = samples
+    # Cached GPCovarianceFactor for the current samples, or None.  It
+    # is immutable, so copies of the aux can share it.
+    self.factor = factor
 
   def copy(self):
-    return GPSPAux(copy.copy(self.samples))
+    return GPSPAux(copy.copy(self.samples), self.factor)
+
+  def covariance_factor(self, covariance, sigma=None):
+    """Return a factor of the covariance matrix among the sample inputs.
+
+    The factor is cached, and maintained incrementally under
+    incorporate and unincorporate; it is recomputed from scratch
+    only if the covariance kernel changes, as when the GP's
+    hyperparameters change.  If the caller already has the covariance
+    matrix, it may pass it as sigma to save recomputing it.
+    """
+    if len(self.samples) == 0:
+      return None
+    factor = self.factor
+    if factor is None or factor.covariance is not covariance:
+      factor = GPCovarianceFactor.compute(covariance, self.samples.keys(),
+                                          sigma=sigma)
+      self.factor = factor
+    assert len(factor.keys) == len(self.samples)
+    return factor.covf
+
+  def incorporate(self, covariance, xs, os):
+    new_keys = []
+    for x, o in zip(xs, os):
+      key = _sample_key(x)
+      if key not in self.samples:
+        new_keys.append(key)
+      self.samples[key] = o
+    factor = self.factor
+    if factor is not None and new_keys:
+      if factor.covariance is covariance:
+        factor = factor.extend(new_keys)
+      else:
+        factor = None
+    self.factor = factor
+
+  def unincorporate(self, covariance, xs):
+    factor = self.factor
+    if factor is not None and factor.covariance is not covariance:
+      factor = None
+    for x in xs:
+      key = _sample_key(x)
+      del self.samples[key]
+      if factor is not None:
+        factor = factor.remove(key)
+    self.factor = factor
 
   def asVentureValue(self):
     def encode(xy):
@@ -250,8 +376,8 @@ class MakeGPOutputPSP(DeterministicMakerAAAPSP):
 
   def gradientOfLogDensityOfData(self, aux, args):
     mean, covariance = args.operandValues()
-    samples = aux.samples
-    return _gp_gradientOfLogDensityOfData(mean, covariance, samples)
+    return _gp_gradientOfLogDensityOfData(mean, covariance, aux.samples,
+      factor=lambda sigma: aux.covariance_factor(covariance, sigma=sigma))
 
   def childrenCanAAA(self): return True
 
@@ -39,22 +39,104 @@ def npSampleVector(pVec, np_rng):
   return np_rng.multinomial(1, pVec)
 def npIndexOfOne(pVec):
   return np.where(pVec == 1)[0][0]
-def npMakeDiag(colvec):
-  return np.diag(np.array(colvec))
-def npNormalizeVector(vec): return vec / np.sum(vec)
+def npLog(a):
+  with np.errstate(divide='ignore'):
+    return np.log(a)
 
 class HMMSPAux(SPAux):
+  # Enough for the current parameters and a proposal
+  FILTERS_KEPT = 2
+
   def __init__(self):
     super(HMMSPAux, self).__init__()
     self.xs = [] # [ x_n ],
     self.os = OrderedDict() #  { n => [o_n1, ... ,o_nK] }
+    # { HMM parameters => HMMForwardFilter }, most recently used last.
+    # Keyed by the parameters rather than the made SP, because the
+    # maker makes a new SP whenever it is resimulated.
+    self.filters = OrderedDict()
 
   def copy(self):
     ans = HMMSPAux()
     ans.xs = copy(self.xs)
     ans.os = OrderedDict((k, copy(v)) for k, v in self.os.iteritems())
+    ans.filters = OrderedDict((k, f.copy()) for k, f in self.filters.iteritems())
+    return ans
+
+  def __getstate__(self):
+    # The cached filters are rebuilt on demand
+    state = dict(self.__dict__)
+    del state['filters']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.filters = OrderedDict()
+
+  def observationsChanged(self, n):
+    for f in self.filters.values():
+      f.truncate(n)
+
+class HMMForwardFilter(object):
+  """The forward filtering pass of an HMM over a prefix of its time
+  steps: the filtered state distribution at each step, given the
+  observations through it, and the cumulative log marginal likelihood
+  of those observations.
+
+  Emission likelihoods are computed in log space, and each filtered
+  distribution is renormalized with its log normalizer accumulated
+  into the marginal, so long sequences neither underflow nor overflow.
+
+  The aux truncates the filter at the first step whose observations
+  change, so a filter survives appending observations at the end and
+  is then extended from where it stopped rather than from step 0.
+  """
+
+  def __init__(self):
+    self.fs = [] # [ normalized filtered distribution of x_n ]
+    self.weights = [] # [ log p(observations through step n) ]
+
+  def copy(self):
+    ans = HMMForwardFilter()
+    ans.fs = copy(self.fs)
+    ans.weights = copy(self.weights)
     return ans
 
+  def truncate(self, n):
+    del self.fs[n:]
+    del self.weights[n:]
+
+  def extend(self, sp, os, length):
+    """Filter through step length - 1."""
+    start = len(self.fs)
+    if start >= length: return
+    logE = sp.emissionLogLikelihoods(os, start, length)
+    shift = np.max(logE, axis=1)
+    shift[shift == float('-inf')] = 0
+    E = np.exp(logE - shift[:, np.newaxis])
+    shift = shift.tolist()
+    if start == 0:
+      f = sp.p0
+      weight = 0
+    else:
+      f = np.dot(self.fs[-1], sp.T)
+      weight = self.weights[-1]
+    T = sp.T
+    fs = self.fs
+    weights = self.weights
+    for i in xrange(length - start):
+      if i > 0:
+        f = np.dot(f, T)
+      f = f * E[i]
+      z = f.sum()
+      if z > 0:
+        f = f / z
+        weight += math.log(z) + shift[i]
+      else:
+        weight = float('-inf')
+      fs.append(f)
+      weights.append(weight)
+
 class MakeUncollapsedHMMOutputPSP(RandomPSP):
   def childrenCanAAA(self):
     return True
@@ -71,11 +153,16 @@ class MakeUncollapsedHMMOutputPSP(RandomPSP):
   def canAbsorb(self, _trace, _appNode, _parentNode):
     # always resample (and marginalize over) the state sequence
     # when reproposing parameters.
-    # TODO: define a logDensity for the parameters given the state
-    # sequence, so that the user can choose whether to block propose the
-    # state sequence or not.
+    # TODO: let the user choose whether to block propose the state
+    # sequence or not, absorbing at the made SP's logDensityOfData
+    # (the density of the state sequence and the observations) if not.
     return False
 
+  def marginalLogDensityOfData(self, aux, args):
+    (p0, T, O) = args.operandValues()
+    sp = UncollapsedHMMSP(p0, np.transpose(T), np.transpose(O))
+    return sp.forwardMarginalWeight(aux)
+
   def description(self, _name):
     return "  Discrete-state HMM of unbounded length with discrete " \
       "observations.  The inputs are the probability distribution of " \
@@ -104,14 +191,17 @@ class UncollapsedHMMAAALKernel(SimulationAAALKernel):
 
 class UncollapsedHMMSP(SP):
   def __init__(self, p0, T, O):
+    self.p0 = np.asarray(p0, dtype=float)
+    self.T = np.asarray(T, dtype=float)
+    self.O = np.asarray(O, dtype=float)
+    self.logO = npLog(self.O)
+    self.parameters_key = (self.T.shape, self.O.shape, self.p0.tobytes(),
+                           self.T.tobytes(), self.O.tobytes())
     req = TypedPSP(UncollapsedHMMRequestPSP(),
                    SPType([t.CountType()], t.RequestType()))
-    output = TypedPSP(UncollapsedHMMOutputPSP(O),
+    output = TypedPSP(UncollapsedHMMOutputPSP(self.p0, self.T, self.O),
                       SPType([t.CountType()], t.IntegerType()))
     super(UncollapsedHMMSP, self).__init__(req, output)
-    self.p0 = p0
-    self.T = T
-    self.O = O
 
   def constructSPAux(self): return HMMSPAux()
   def constructLatentDB(self): return OrderedDict() # { n => x_n }
@@ -145,57 +235,80 @@ class UncollapsedHMMSP(SP):
         assert len(aux.xs) == maxObservation + 1
     return 0
 
+  def forwardFilter(self, aux):
+    """The forward filter of this HMM over the time steps of aux,
+    reusing (and then caching) whatever the aux already holds for
+    the same parameters."""
+    key = self.parameters_key
+    f = aux.filters.pop(key, None)
+    if f is None:
+      f = HMMForwardFilter()
+      while len(aux.filters) >= aux.FILTERS_KEPT:
+        aux.filters.popitem(last=False)
+    aux.filters[key] = f
+    f.extend(self, aux.os, len(aux.xs))
+    return f
+
+  def emissionLogLikelihoods(self, os, start, end):
+    """The log likelihood of the observations at each of the time
+    steps start through end - 1, given each state, as an array with
+    one row per step."""
+    logE = np.zeros((end - start, len(self.p0)))
+    times = []
+    values = []
+    if end - start < len(os):
+      for n in xrange(start, end):
+        for o in os.get(n, ()):
+          times.append(n - start)
+          values.append(o)
+    else:
+      for (n, obs) in os.iteritems():
+        if start <= n < end:
+          for o in obs:
+            times.append(n - start)
+            values.append(o)
+    if times:
+      np.add.at(logE, times, self.logO[:, values].T)
+    return logE
+
   def forwardBackwardSample(self, aux, np_rng):
     # called by UncollapsedHMMAAALKernel.simulate
     if not aux.os: return
-
-    # forward filtering
-    fs = []
-    for i in range(len(aux.xs)):
-      if i == 0:
-        f = self.p0
-      else:
-        f = np.dot(fs[i-1], self.T)
-      if i in aux.os:
-        for o in aux.os[i]:
-          f = np.dot(f, npMakeDiag(self.O[:, o]))
-
-      fs.append(npNormalizeVector(f))
-
-    # backwards sampling
-    aux.xs[-1] = npSampleVector(fs[-1], np_rng)
-    for i in range(len(aux.xs) - 2, -1, -1):
-      index = npIndexOfOne(aux.xs[i+1])
-      T_i = npMakeDiag(self.T[:, index])
-      gamma = npNormalizeVector(np.dot(fs[i], T_i))
-      aux.xs[i] = npSampleVector(gamma, np_rng)
+    n = len(aux.xs)
+    fs = self.forwardFilter(aux).fs
+    # backwards sampling, drawing all the uniforms at once
+    us = np_rng.random_sample(n).tolist()
+    states = [0] * n
+    x = sampleIndex(fs[n-1], us[n-1])
+    states[n-1] = x
+    TT = self.T.T # TT[x] is the column of T into state x
+    for i in xrange(n - 2, -1, -1):
+      x = sampleIndex(fs[i] * TT[x], us[i])
+      states[i] = x
+    aux.xs[:] = list(np.eye(len(self.p0), dtype=int)[states])
 
   def forwardMarginalWeight(self, aux):
     # called by UncollapsedHMMAAALKernel.weight
-    # TODO: cache redundant work between this and forwardBackwardSample?
-
     if not aux.os: return 0
-
-    weight = 0
-    fs = []
-    for i in range(len(aux.xs)):
-      if i == 0:
-        f = self.p0
-      else:
-        f = np.dot(fs[i-1], self.T)
-      if i in aux.os:
-        for o in aux.os[i]:
-          f = np.dot(f, npMakeDiag(self.O[:, o]))
-
-      weight += np.log(np.sum(f))
-      fs.append(npNormalizeVector(f))
-
-    return weight
+    return self.forwardFilter(aux).weights[len(aux.xs) - 1]
+
+def sampleIndex(weights, u):
+  # Draw an index with probability proportional to the (unnormalized)
+  # weights, given a uniform u in [0, 1)
+  cs = weights.cumsum()
+  if cs[-1] > 0:
+    return int(cs.searchsorted(u * cs[-1], side='right'))
+  else:
+    # Impossible observations; the weight of this proposal will be
+    # -inf, so the state does not matter
+    return int(u * len(weights))
 
 class UncollapsedHMMOutputPSP(RandomPSP):
 
-  def __init__(self, O):
+  def __init__(self, p0, T, O):
     super(UncollapsedHMMOutputPSP, self).__init__()
+    self.p0 = p0
+    self.T = T
     self.O = O
 
   def simulate(self, args):
@@ -219,12 +332,25 @@ class UncollapsedHMMOutputPSP(RandomPSP):
     os = args.spaux().os
     if n not in os: os[n] = []
     os[n].append(value)
+    args.spaux().observationsChanged(n)
 
   def unincorporate(self, value, args):
     n = args.operandValues()[0]
     os = args.spaux().os
     del os[n][os[n].index(value)]
     if not os[n]: del os[n]
+    args.spaux().observationsChanged(n)
+
+  def logDensityOfData(self, aux):
+    # The joint density of the state sequence and the observations
+    if not aux.xs: return 0
+    states = np.argmax(np.array(aux.xs), axis=1)
+    ans = npLog(self.p0[states[0]]) + \
+      np.sum(npLog(self.T[states[:-1], states[1:]]))
+    times = [n for (n, obs) in aux.os.iteritems() for _ in obs]
+    values = [o for obs in aux.os.itervalues() for o in obs]
+    ans += np.sum(npLog(self.O[states[times], values]))
+    return float(ans)
 
 class UncollapsedHMMRequestPSP(DeterministicPSP):
   def simulate(self, args): return Request([], [args.operandValues()[0]])
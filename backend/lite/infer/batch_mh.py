@@ -0,0 +1,231 @@
+# Copyright (c) 2015 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Resimulation MH over many single-choice blocks at once.
+
+A sweep of resimulation MH over the blocks of a scope with many
+conditionally independent latents (one per datapoint, say) spends
+nearly all its time in scaffold construction, detach and regen,
+which is interpreted Python per node.  When a block consists of one
+random choice whose distribution and whose absorbing children are
+all PSPs offering simulateBatch and logDensityBatch, the whole
+transition amounts to one simulation and a handful of log density
+evaluations, which BatchMixMH performs with numpy for all such blocks
+together.
+
+Blocks are batched only if their scaffolds touch pairwise disjoint
+sets of nodes, so that the simultaneous transitions are the same
+Markov chain as resimulation MH applied to each block in turn.  Any
+block that cannot be batched gets an ordinary scalar transition after
+the batch.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from venture.lite.infer.mh import BlockScaffoldIndexer
+from venture.lite.infer.mh import MHOperator
+from venture.lite.infer.mh import mixMH
+from venture.lite.node import isLookupNode
+from venture.lite.node import isOutputNode
+from venture.lite.node import isRequestNode
+from venture.lite.psp import NullRequestPSP
+from venture.lite.scaffold import constructScaffold
+from venture.lite.scope import isTagExcludeOutputPSP
+from venture.lite.scope import isTagOutputPSP
+
+class BatchMixMH(object):
+  """Sweeps of resimulation MH over every block of a scope.
+
+  The block argument is "each" or "each_reverse"; any other block is
+  handed to the scalar mixMH unchanged.  Batching only ever changes
+  the values of principal nodes and of nodes that copy them, so if a
+  sweep needed no scalar transitions, the trace structure is as it
+  was, and the next sweep reuses the same batch plans.
+  """
+  def __init__(self, scope, block):
+    self.scope = scope
+    self.block = block
+    self.plans = None
+
+  def __call__(self, trace):
+    """Run one sweep; return the average number of nodes touched per
+    block, as scaffolder_loop does."""
+    (scope, block) = (self.scope, self.block)
+    if block == "each":
+      blocks = trace.getScope(scope).keys()
+    elif block == "each_reverse":
+      blocks = trace.getScope(scope).keys()[::-1]
+    else:
+      return mixMH(trace, BlockScaffoldIndexer(scope, block), MHOperator())
+    if len(blocks) == 0:
+      return 0
+
+    if trace.profiling_enabled:
+      # The profiler records each proposal individually
+      (plans, scalar) = ([], blocks)
+    elif self.plans is not None:
+      (plans, scalar) = (self.plans, [])
+    else:
+      (plans, scalar) = _batchPlans(trace, scope, blocks)
+
+    ct = 0
+    if plans:
+      (ct_batch, failed) = _batchTransition(trace, plans)
+      ct += ct_batch
+      scalar = scalar + [plan.block for plan in failed]
+    for b in scalar:
+      ct += mixMH(trace, BlockScaffoldIndexer(scope, b), MHOperator())
+    self.plans = plans if not scalar else None
+    return ct/len(blocks)
+
+def _batchPlans(trace, scope, blocks):
+  plans = []
+  scalar = []
+  claimed = set()
+  for b in blocks:
+    plan = _batchPlan(trace, scope, b)
+    if plan is None or not claimed.isdisjoint(plan.footprint):
+      scalar.append(b)
+    else:
+      claimed.update(plan.footprint)
+      plans.append(plan)
+  return (plans, scalar)
+
+class _BlockPlan(object):
+  """The nodes of one batchable block: the principal node, the nodes
+  that merely copy its value, and the absorbing applications together
+  with the PSPs that batch them."""
+  def __init__(self, block, pnode, delegate, passthrough, absorbing,
+               footprint, numAffected):
+    self.block = block
+    self.pnode = pnode
+    self.delegate = delegate
+    self.passthrough = passthrough # Set Node, including pnode
+    self.absorbing = absorbing # [(Node, TypedPSP)]
+    self.footprint = footprint # Set Node
+    self.numAffected = numAffected
+
+def _batchPlan(trace, scope, block):
+  pnodes = trace.getNodesInBlock(scope, block)
+  if len(pnodes) != 1: return None
+  scaffold = constructScaffold(trace, [pnodes])
+  if scaffold.brush or scaffold.aaa or scaffold.lkernels: return None
+  pnode = scaffold.getPNode()
+  if not isOutputNode(pnode) or trace.esrParentsAt(pnode): return None
+  delegate = trace.pspAt(pnode).batchDelegate(trace.argsAt(pnode))
+  if delegate is None: return None
+
+  drg = scaffold.drg
+  for node in drg:
+    if node is not pnode and not _isPassthrough(trace, drg, node):
+      return None
+
+  absorbing = []
+  for node in scaffold.absorbing:
+    if isRequestNode(node) and isinstance(trace.pspAt(node), NullRequestPSP):
+      continue
+    if not isOutputNode(node) or node.operatorNode in drg or \
+       trace.esrParentsAt(node):
+      return None
+    node_delegate = trace.pspAt(node).batchDelegate(trace.argsAt(node))
+    if node_delegate is None: return None
+    absorbing.append((node, node_delegate))
+
+  footprint = set(drg)
+  footprint.update(scaffold.absorbing)
+  return _BlockPlan(block, pnode, delegate, drg, absorbing, footprint,
+                    scaffold.numAffectedNodes())
+
+def _isPassthrough(trace, drg, node):
+  """Whether the node's value is always that of its one parent in the
+  drg; by induction from the principal node, that makes it the value
+  of the principal node."""
+  if isLookupNode(node):
+    return node.sourceNode in drg
+  if isOutputNode(node) and node.operandNodes and \
+     node.operatorNode not in drg and not trace.esrParentsAt(node):
+    psp = trace.pspAt(node)
+    if isTagOutputPSP(psp) or isTagExcludeOutputPSP(psp):
+      # The tagged value is the last operand; the scope and block must
+      # not change, or the block structure would.
+      (others, tagged) = (node.operandNodes[:-1], node.operandNodes[-1])
+      return tagged in drg and not any(n in drg for n in others)
+  return False
+
+def _columns(rows):
+  return [np.array(col) for col in zip(*rows)]
+
+def _batchTransition(trace, plans):
+  n = len(plans)
+
+  # Propose, grouping the principal nodes by distribution and arity
+  proposals = [None] * n
+  groups = OrderedDict()
+  for (i, plan) in enumerate(plans):
+    f_type = plan.delegate.f_type
+    params = f_type.unwrap_arg_list(
+      [trace.valueAt(o) for o in plan.pnode.operandNodes])
+    groups.setdefault((plan.delegate, len(params)), []).append((i, params))
+  for ((delegate, _), rows) in groups.iteritems():
+    params = _columns([row[1] for row in rows])
+    values = delegate.psp.simulateBatch(params, len(rows), trace.np_rng)
+    for ((i, _), value) in zip(rows, np.asarray(values).tolist()):
+      proposals[i] = delegate.f_type.wrap_return(value)
+
+  # Score the absorbing nodes at the current and proposed values
+  groups = OrderedDict()
+  for (i, plan) in enumerate(plans):
+    for (node, delegate) in plan.absorbing:
+      f_type = delegate.f_type
+      old = [trace.valueAt(o) for o in node.operandNodes]
+      new = [proposals[i] if o in plan.passthrough else val
+             for (o, val) in zip(node.operandNodes, old)]
+      row = (i, f_type.unwrap_return(trace.valueAt(node)),
+             f_type.unwrap_arg_list(old), f_type.unwrap_arg_list(new))
+      groups.setdefault((delegate, len(old)), []).append(row)
+  rho = np.zeros(n)
+  xi = np.zeros(n)
+  with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+    for ((delegate, _), rows) in groups.iteritems():
+      index = np.array([row[0] for row in rows])
+      values = np.array([row[1] for row in rows])
+      rho += np.bincount(index, minlength=n, weights=
+        delegate.psp.logDensityBatch(values, _columns([row[2] for row in rows])))
+      xi += np.bincount(index, minlength=n, weights=
+        delegate.psp.logDensityBatch(values, _columns([row[3] for row in rows])))
+    alpha = xi - rho
+  # The same policy on infinities as MHOperator.propose
+  alpha[(rho == float('-inf')) & (xi == float('-inf'))] = float('+inf')
+  alpha[(rho == float('+inf')) & (xi == float('+inf'))] = float('-inf')
+  logU = np.log(trace.np_rng.uniform(size=n))
+
+  # Commit the accepted proposals; blocks whose densities came out NaN
+  # (e.g., out-of-support parameters) are left to the scalar path,
+  # which reports such problems.
+  ct = 0
+  failed = []
+  for (i, plan) in enumerate(plans):
+    if np.isnan(alpha[i]):
+      failed.append(plan)
+      continue
+    if logU[i] < alpha[i]:
+      for node in plan.passthrough:
+        trace.setValueAt(node, proposals[i])
+    ct += plan.numAffected
+  return (ct, failed)
@@ -19,10 +19,13 @@ from collections import OrderedDict
 import numbers
 
 from venture.lite.detach import detachAndExtract
+from venture.lite.infer.batch_mh import BatchMixMH
 from venture.lite.infer.draw_scaffold import drawScaffold
 from venture.lite.infer.egibbs import EnumerativeGibbsOperator
 from venture.lite.infer.egibbs import EnumerativeMAPOperator
+from venture.lite.infer.hmc import AdaptiveHamiltonianMonteCarloOperator
 from venture.lite.infer.hmc import HamiltonianMonteCarloOperator
+from venture.lite.infer.hmc import adaptation_for
 from venture.lite.infer.map_gradient import GradientAscentOperator
 from venture.lite.infer.map_gradient import NesterovAcceleratedGradientAscentOperator
 from venture.lite.infer.meanfield import MeanfieldOperator
@@ -56,6 +59,13 @@ def parse_arguments(trace, args):
     transitions = 0
   return (scope, block, transitions, extra)
 
+def parse_particles_extra(extra):
+  particles = int(extra[0])
+  if len(extra) > 1:
+    return (particles, float(extra[1]))
+  else:
+    return (particles, None)
+
 def parse_transitions_extra(args):
   if len(args) == 0:
     transitions = 1
@@ -139,6 +149,10 @@ def primitive_infer(trace, exp):
     def doit(scaffolder):
       return mixMH(trace, scaffolder, FuncMHOperator())
     return transloop(trace, transitions, scaffolder_loop(scaffolders, doit))
+  elif operator == "mh_batch":
+    (scope, block, transitions, _) = parse_arguments(trace, exp)
+    sweep = BatchMixMH(scope, block)
+    return transloop(trace, transitions, lambda : sweep(trace))
   elif operator == "draw_scaffold":
     (scaffolders, _transitions, _) = dispatch_arguments(trace, exp)
     drawScaffold(trace, scaffolders[0])
@@ -172,6 +186,29 @@ def primitive_infer(trace, exp):
     def doit(scaffolder):
       return mixMH(trace, scaffolder, HamiltonianMonteCarloOperator(epsilon, int(L)))
     return transloop(trace, transitions, scaffolder_loop(scaffolders, doit))
+  elif operator == "adaptive_hmc":
+    (scaffolders, transitions, (L, warmup)) = dispatch_arguments(trace, exp)
+    assert isinstance(L, numbers.Number)
+    assert isinstance(warmup, numbers.Number)
+    # Consecutive transitions on the same block may reuse the
+    # gradient at the state the last one ended in, unless other
+    # blocks or AAA kernels move in between.
+    reuse = len(scaffolders) == 1 and not trace.aes
+    operators = []
+    for scaffolder in scaffolders:
+      if isinstance(scaffolder, BlockScaffoldIndexer):
+        key = (scaffolder.scope, scaffolder.block, int(L))
+      else:
+        key = None
+      adaptation = adaptation_for(trace, key, int(warmup))
+      operators.append(AdaptiveHamiltonianMonteCarloOperator(
+        adaptation, int(L), reuse_gradients=reuse))
+    def doit_all():
+      ct = 0
+      for (scaffolder, op) in zip(scaffolders, operators):
+        ct += mixMH(trace, scaffolder, op)
+      return ct/len(scaffolders)
+    return transloop(trace, transitions, doit_all)
   elif operator == "gibbs":
     (scaffolders, transitions, _) = dispatch_arguments(trace, exp)
     def doit(scaffolder):
@@ -199,57 +236,57 @@ def primitive_infer(trace, exp):
     return transloop(trace, transitions, scaffolder_loop(scaffolders, doit))
   elif operator == "pgibbs":
     (scope, block, transitions, extra) = parse_arguments(trace, exp)
-    particles = int(extra[0])
+    (particles, essThreshold) = parse_particles_extra(extra)
     if isinstance(block, list): # Ordered range
       (_, min_block, max_block) = block
       scaffolder = BlockScaffoldIndexer(scope, "ordered_range",
                                         (min_block, max_block))
       return transloop(trace, transitions, lambda : \
-        mixMH(trace, scaffolder, PGibbsOperator(particles)))
+        mixMH(trace, scaffolder, PGibbsOperator(particles, essThreshold)))
     else:
       return transloop(trace, transitions, lambda : \
         mixMH(trace, BlockScaffoldIndexer(scope, block),
-              PGibbsOperator(particles)))
+              PGibbsOperator(particles, essThreshold)))
   elif operator == "pgibbs_update":
     (scope, block, transitions, extra) = parse_arguments(trace, exp)
-    particles = int(extra[0])
+    (particles, essThreshold) = parse_particles_extra(extra)
     if isinstance(block, list): # Ordered range
       (_, min_block, max_block) = block
       scaffolder = BlockScaffoldIndexer(
         scope, "ordered_range",
         (min_block, max_block), updateValues=True)
       return transloop(trace, transitions, lambda : \
-        mixMH(trace, scaffolder, PGibbsOperator(particles)))
+        mixMH(trace, scaffolder, PGibbsOperator(particles, essThreshold)))
     else:
       return transloop(trace, transitions, lambda : \
         mixMH(trace, BlockScaffoldIndexer(scope, block, updateValues=True),
-              PGibbsOperator(particles)))
+              PGibbsOperator(particles, essThreshold)))
   elif operator == "func_pgibbs":
     (scope, block, transitions, extra) = parse_arguments(trace, exp)
-    particles = int(extra[0])
+    (particles, essThreshold) = parse_particles_extra(extra)
     if isinstance(block, list): # Ordered range
       (_, min_block, max_block) = block
       scaffolder = BlockScaffoldIndexer(scope, "ordered_range",
                                         (min_block, max_block))
       return transloop(trace, transitions, lambda : \
-        mixMH(trace, scaffolder, ParticlePGibbsOperator(particles)))
+        mixMH(trace, scaffolder, ParticlePGibbsOperator(particles, essThreshold)))
     else:
       return transloop(trace, transitions, lambda : \
         mixMH(trace, BlockScaffoldIndexer(scope, block),
-              ParticlePGibbsOperator(particles)))
+              ParticlePGibbsOperator(particles, essThreshold)))
   elif operator == "func_pmap":
     (scope, block, transitions, extra) = parse_arguments(trace, exp)
-    particles = int(extra[0])
+    (particles, essThreshold) = parse_particles_extra(extra)
     if isinstance(block, list): # Ordered range
       (_, min_block, max_block) = block
       scaffolder = BlockScaffoldIndexer(scope, "ordered_range",
                                         (min_block, max_block))
       return transloop(trace, transitions, lambda : \
-        mixMH(trace, scaffolder, ParticlePMAPOperator(particles)))
+        mixMH(trace, scaffolder, ParticlePMAPOperator(particles, essThreshold)))
     else:
       return transloop(trace, transitions, lambda : \
         mixMH(trace, BlockScaffoldIndexer(scope, block),
-              ParticlePMAPOperator(particles)))
+              ParticlePMAPOperator(particles, essThreshold)))
   elif operator == "gradient_ascent":
     # XXX, in order to mak default args work here, I need to check the lenght of
     # the args to `gradient_ascent` conditioned on whether the second arg is a
@@ -16,6 +16,9 @@
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import OrderedDict
+import math
+
+import numpy as np
 
 from ..omegadb import OmegaDB
 from ..orderedset import OrderedSet
@@ -166,3 +169,236 @@ class HamiltonianMonteCarloOperator(InPlaceOperator):
     return q, self.kinetic(p)
 
   def name(self): return "hamiltonian monte carlo"
+
+def flatten_reals(values):
+  """The real coordinates of the given values, as one flat array, and
+  how many each value contributes (zero for discrete values)."""
+  xs = []
+  sizes = []
+  def note(x):
+    xs.append(x)
+    return x
+  for val in values:
+    before = len(xs)
+    val.map_real(note)
+    sizes.append(len(xs) - before)
+  return (np.array(xs, dtype=float), sizes)
+
+def flatten_cotangents(cotangents, sizes):
+  """Flatten cotangents (e.g. gradients) of values of the given sizes,
+  treating a symbolic zero as a zero vector."""
+  xs = []
+  def note(x):
+    xs.append(x)
+    return x
+  for (dx, size) in zip(cotangents, sizes):
+    if dx is 0 or size == 0:
+      xs.extend([0.0] * size)
+    else:
+      dx.map_real(note)
+  return np.array(xs, dtype=float)
+
+def unflatten_reals(values, sizes, xs):
+  """New values like the given ones, with their real coordinates
+  replaced by xs; discrete values are returned unchanged."""
+  it = iter(xs.tolist())
+  return [val.map_real(lambda _: it.next()) if size > 0 else val
+          for (val, size) in zip(values, sizes)]
+
+class HMCAdaptation(object):
+  """Step size and diagonal mass matrix for HMC on one block, adapted
+  over a warmup of a given number of transitions.
+
+  The step size is tuned by the dual averaging scheme of Hoffman and
+  Gelman, "The No-U-Turn Sampler", JMLR 15, 2014 (Algorithm 5), toward
+  an average acceptance probability of target_accept.  The inverse
+  mass matrix is the (regularized) variance of the positions visited
+  in the middle half of the warmup, after which the step size
+  adaptation restarts.  After the warmup both are frozen.
+
+  Lives on the trace across infer calls, so that repeated calls on the
+  same scope and block continue the warmup rather than repeat it.
+  """
+
+  gamma = 0.05
+  t0 = 10
+  kappa = 0.75
+
+  def __init__(self, warmup, epsilon=0.1, target_accept=0.8):
+    self.warmup = warmup
+    self.target_accept = target_accept
+    self.count = 0 # Warmup transitions so far
+    self.inv_mass = None
+    self._restart_step_size(epsilon)
+    self._reset_variance()
+
+  def _restart_step_size(self, epsilon):
+    self.mu = math.log(10 * epsilon)
+    self.log_epsilon = math.log(epsilon)
+    self.log_epsilon_bar = 0.0
+    self.h_bar = 0.0
+    self.m = 0
+
+  def _reset_variance(self):
+    # Welford's running variance of the positions
+    self.n = 0
+    self.mean = None
+    self.m2 = None
+
+  def adapting(self):
+    return self.count < self.warmup
+
+  def step_size(self):
+    if self.adapting() or self.m == 0:
+      return math.exp(self.log_epsilon)
+    else:
+      return math.exp(self.log_epsilon_bar)
+
+  def inverse_mass(self, dim):
+    if self.inv_mass is None or len(self.inv_mass) != dim:
+      # First use, or the block changed shape
+      self.inv_mass = np.ones(dim)
+      self._reset_variance()
+    return self.inv_mass
+
+  def update(self, accept_prob, position):
+    """Record the outcome of one transition during the warmup."""
+    if not self.adapting():
+      return
+    self.count += 1
+
+    self.m += 1
+    eta = 1.0 / (self.m + self.t0)
+    self.h_bar = (1 - eta) * self.h_bar + \
+      eta * (self.target_accept - accept_prob)
+    self.log_epsilon = self.mu - math.sqrt(self.m) / self.gamma * self.h_bar
+    w = self.m ** -self.kappa
+    self.log_epsilon_bar = w * self.log_epsilon + \
+      (1 - w) * self.log_epsilon_bar
+
+    window_start = self.warmup // 4
+    window_end = 3 * self.warmup // 4
+    if window_start < self.count <= window_end:
+      self.n += 1
+      if self.mean is None:
+        self.mean = np.zeros(len(position))
+        self.m2 = np.zeros(len(position))
+      delta = position - self.mean
+      self.mean += delta / self.n
+      self.m2 += delta * (position - self.mean)
+    if self.count == window_end and self.n > 1:
+      # Regularize toward the unit metric, as Stan does
+      variance = self.m2 / (self.n - 1)
+      self.inv_mass = (self.n / (self.n + 5.0)) * variance + \
+        1e-3 * (5.0 / (self.n + 5.0))
+      self._reset_variance()
+      self._restart_step_size(math.exp(self.log_epsilon))
+
+def adaptation_for(trace, key, warmup):
+  """The HMCAdaptation the trace keeps under key, creating it if need
+  be.  A key of None, or a trace that keeps none, gets a fresh one."""
+  adaptations = trace.hmc_adaptations
+  if key is None or adaptations is None:
+    return HMCAdaptation(warmup)
+  if key not in adaptations:
+    adaptations[key] = HMCAdaptation(warmup)
+  return adaptations[key]
+
+class AdaptiveHamiltonianMonteCarloOperator(HamiltonianMonteCarloOperator):
+  """HMC whose step size and diagonal mass matrix come from (and, during
+  warmup, feed) an HMCAdaptation.
+
+  If reuse_gradients is set, the caller promises that nothing else
+  changes the trace between consecutive transitions of this operator,
+  so the gradient at the state one transition ends in can stand in
+  for computing it again at the start of the next.
+  """
+
+  def __init__(self, adaptation, L, reuse_gradients=False):
+    self.adaptation = adaptation
+    self.num_steps = L
+    self.reuse_gradients = reuse_gradients
+    self.last_pnodes = None
+    self.last_grad = None
+
+  def propose(self, trace, scaffold):
+    pnodes = list(scaffold.getPrincipalNodes())
+    currentValues = getCurrentValues(trace, pnodes)
+    (q0, sizes) = flatten_reals(currentValues)
+    inv_mass = self.adaptation.inverse_mass(len(q0))
+
+    known_grad = self.reuse_gradients and self.last_pnodes == pnodes and \
+      self.last_grad is not None and len(self.last_grad) == len(q0)
+    registerDeterministicLKernels(trace, scaffold, pnodes, currentValues)
+    rhoWeight = self.prepare(trace, scaffold, not known_grad)
+    if known_grad:
+      start_grad_pot = self.last_grad
+    else:
+      start_grad_pot = -flatten_cotangents(
+        [self.rhoDB.getPartial(pnode) for pnode in pnodes], sizes)
+
+    grad = GradientOfRegen(trace, scaffold, pnodes)
+    def grad_potential(q):
+      values = unflatten_reals(currentValues, sizes, q)
+      return -flatten_cotangents(grad(values), sizes)
+
+    momenta = trace.np_rng.standard_normal(len(q0)) / np.sqrt(inv_mass)
+    start_K = self.kinetic_flat(momenta, inv_mass)
+
+    # Smashes the trace but leaves it a torus
+    (q, end_grad_pot, end_K) = self.evolve_flat(
+      grad_potential, q0, start_grad_pot, momenta, inv_mass)
+
+    xiWeight = grad.regen(unflatten_reals(currentValues, sizes, q))
+    logAlpha = xiWeight - rhoWeight + start_K - end_K
+
+    self.last_pnodes = pnodes
+    self.start = (q0, start_grad_pot)
+    self.end = (q, end_grad_pot)
+    if math.isnan(logAlpha):
+      self.accept_prob = 0.0
+    else:
+      self.accept_prob = math.exp(min(0.0, logAlpha))
+    return (trace, logAlpha)
+
+  def accept(self):
+    self.finish(*self.end)
+    return super(AdaptiveHamiltonianMonteCarloOperator, self).accept()
+
+  def reject(self):
+    self.finish(*self.start)
+    return super(AdaptiveHamiltonianMonteCarloOperator, self).reject()
+
+  def finish(self, q, grad_pot):
+    self.last_grad = grad_pot
+    self.adaptation.update(self.accept_prob, q)
+
+  def kinetic_flat(self, momenta, inv_mass):
+    return np.dot(momenta * inv_mass, momenta) / 2.0
+
+  def evolve_flat(self, grad_U, start_q, start_grad_q, start_p, inv_mass):
+    epsilon = self.adaptation.step_size()
+    num_steps = self.trace.np_rng.randint(int(self.num_steps))+1
+    q = start_q
+    # The initial momentum half-step
+    dpdt = start_grad_q
+    p = start_p - dpdt * (epsilon / 2.0)
+
+    for i in range(num_steps):
+      # Position step
+      q = q + inv_mass * p * epsilon
+
+      # Momentum step, except at the end
+      if i < num_steps - 1:
+        dpdt = grad_U(q)
+        p = p - dpdt * epsilon
+
+    # The final momentum half-step
+    dpdt = grad_U(q)
+    p = p - dpdt * (epsilon / 2.0)
+
+    # The kinetic energy is symmetric, so there is no need to negate
+    # the momenta
+    return q, dpdt, self.kinetic_flat(p, inv_mass)
+
+  def name(self): return "adaptive hamiltonian monte carlo"
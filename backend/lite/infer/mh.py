@@ -117,8 +117,8 @@ class BlockScaffoldIndexer(object):
                useDeltaKernels=False, deltaKernelArgs=None,
                updateValues=False):
     if scope == "default" and \
-       not (block == "all" or block == "none" or \
-            block == "one" or block == "ordered"):
+       not (block == "all" or block == "none" or block == "one" or \
+            block == "one_by_size" or block == "ordered"):
         raise Exception(
           "INFER default scope does not admit custom blocks (%r)" % block)
     self.scope = scope
@@ -132,6 +132,9 @@ class BlockScaffoldIndexer(object):
     if self.block == "one":
       self.true_block = trace.sampleBlock(self.scope)
       setsOfPNodes = [trace.getNodesInBlock(self.scope, self.true_block)]
+    elif self.block == "one_by_size":
+      self.true_block = trace.sampleBlockBySize(self.scope)
+      setsOfPNodes = [trace.getNodesInBlock(self.scope, self.true_block)]
     elif self.block == "all":
       setsOfPNodes = [trace.getAllNodesInScope(self.scope)]
     elif self.block == "none":
@@ -146,13 +149,43 @@ class BlockScaffoldIndexer(object):
 
   def sampleIndex(self, trace):
     setsOfPNodes = self.getSetsOfPNodes(trace)
-    return constructScaffold(
-      trace, setsOfPNodes,
-      useDeltaKernels=self.useDeltaKernels,
-      deltaKernelArgs=self.deltaKernelArgs, updateValues=self.updateValues)
+    for pnodes in setsOfPNodes:
+      trace.refreshStaleSections(pnodes)
+    scaffold = None
+    if trace.scaffold_cache is not None:
+      key = self.cacheKey()
+      if key is not None:
+        scaffold = trace.scaffold_cache.construct(
+          trace, key, setsOfPNodes,
+          useDeltaKernels=self.useDeltaKernels,
+          deltaKernelArgs=self.deltaKernelArgs, updateValues=self.updateValues)
+    if scaffold is None:
+      scaffold = constructScaffold(
+        trace, setsOfPNodes,
+        useDeltaKernels=self.useDeltaKernels,
+        deltaKernelArgs=self.deltaKernelArgs, updateValues=self.updateValues)
+    trace.refreshStaleSectionsResampledBy(scaffold)
+    return scaffold
+
+  def cacheKey(self):
+    """The key of the most recently selected block in the trace's
+    scaffold cache, or None if it should not be cached."""
+    if self.block == "one" or self.block == "one_by_size":
+      block = self.true_block
+    else:
+      block = self.block
+    key = (self.scope, block, self.interval, self.useDeltaKernels,
+           self.deltaKernelArgs, self.updateValues)
+    try:
+      hash(key)
+    except TypeError:
+      return None
+    return key
 
   def logDensityOfIndex(self, trace, _):
     if self.block == "one": return trace.logDensityOfBlock(self.scope)
+    elif self.block == "one_by_size":
+      return trace.logDensityOfBlockBySize(self.scope, self.true_block)
     elif self.block == "all": return 0
     elif self.block == "none": return 0
     elif self.block == "ordered": return 0
@@ -21,8 +21,10 @@ from collections import OrderedDict
 from ..omegadb import OmegaDB
 from ..regen import regenAndAttachAtBorder
 from ..detach import detachAndExtractAtBorder
+from ..utils import effectiveSampleSize
 from ..utils import sampleLogCategorical
 from ..utils import logsumexp
+from ..utils import resampleLogCategorical
 from ..consistency import assertTrace
 from ..consistency import assertTorus
 
@@ -47,12 +49,26 @@ def detachRest(trace,border,scaffold,t):
     detachAndExtractAtBorder(trace,border[i],scaffold)
 
 
+def shouldResample(weights, essThreshold):
+  """Whether to resample particles with the given log weights, given
+  the threshold on the effective sample size as a fraction of the
+  number of particles (None means always).
+
+  The decision must not depend on which particle is the reference
+  one, so the effective sample size includes it."""
+  if essThreshold is None:
+    return True
+  return effectiveSampleSize(weights) < essThreshold * len(weights)
+
 # P particles, not including RHO
-# T groups of sinks, with T-1 resampling steps
+# T groups of sinks, with T-1 resampling steps (fewer if the effective
+# sample size threshold skips some, in which case every particle
+# extends itself and the weights accumulate)
 # and then one final resampling step to select XI
 class PGibbsOperator(object):
-  def __init__(self,P):
+  def __init__(self,P,essThreshold=None):
     self.P = P
+    self.essThreshold = essThreshold
 
   def propose(self,trace,scaffold):
     self.trace = trace
@@ -82,20 +98,29 @@ class PGibbsOperator(object):
       regenAndAttachAtBorder(trace,scaffold.border[0],scaffold,False,OmegaDB(),OrderedDict())
       (xiWeights[p],omegaDBs[0][p]) = detachAndExtractAtBorder(trace,scaffold.border[0],scaffold)
 
+    rhoWeight = rhoWeights[0]
+
 #   for every time step,
     for t in range(1,T):
       newWeights = [None for p in range(P)]
+      extendedWeights = xiWeights + [rhoWeight]
+      if shouldResample(extendedWeights, self.essThreshold):
+        ancestorIndices[t][0:P] = resampleLogCategorical(
+          extendedWeights, P, self.trace.np_rng)
+        baseWeights = [0 for p in range(P+1)]
+      else:
+        ancestorIndices[t][0:P] = range(P)
+        baseWeights = extendedWeights
       # Sample new particle and propagate
       for p in range(P):
-        extendedWeights = xiWeights + [rhoWeights[t-1]]
-        ancestorIndices[t][p] = sampleLogCategorical(extendedWeights,
-                                                     self.trace.np_rng)
         path = constructAncestorPath(ancestorIndices,t,p)
         restoreAncestorPath(trace,self.scaffold.border,self.scaffold,omegaDBs,t,path)
         regenAndAttachAtBorder(trace,self.scaffold.border[t],self.scaffold,False,OmegaDB(),OrderedDict())
         (newWeights[p],omegaDBs[t][p]) = detachAndExtractAtBorder(trace,self.scaffold.border[t],self.scaffold)
+        newWeights[p] += baseWeights[ancestorIndices[t][p]]
         detachRest(trace,self.scaffold.border,self.scaffold,t)
       xiWeights = newWeights
+      rhoWeight = baseWeights[P] + rhoWeights[t]
 
     # Now sample a NEW particle in proportion to its weight
     finalIndex = sampleLogCategorical(xiWeights, self.trace.np_rng)
@@ -105,7 +130,7 @@ class PGibbsOperator(object):
     restoreAncestorPath(trace,self.scaffold.border,self.scaffold,omegaDBs,T,path)
     assertTrace(self.trace,self.scaffold)
 
-    return trace,self._compute_alpha(rhoWeights[T-1], xiWeights, finalIndex)
+    return trace,self._compute_alpha(rhoWeight, xiWeights, finalIndex)
 
   def _compute_alpha(self, rhoWeight, xiWeights, finalIndex):
     # Remove the weight of the chosen xi from the list instead of
@@ -140,8 +165,9 @@ class PGibbsOperator(object):
 #### Functional PGibbs
 
 class ParticlePGibbsOperator(object):
-  def __init__(self,P):
+  def __init__(self,P,essThreshold=None):
     self.P = P
+    self.essThreshold = essThreshold
 
   def propose(self,trace,scaffold):
     from ..particle import Particle
@@ -181,15 +207,21 @@ class ParticlePGibbsOperator(object):
 
 #   for every time step,
     for t in range(1,T):
-      newParticles = [None for p in range(P+1)]
+      if shouldResample(particleWeights, self.essThreshold):
+        parents = resampleLogCategorical(particleWeights, P, self.trace.np_rng)
+        newParticles = [Particle(particles[parent]) for parent in parents] + \
+                       [Particle(particles[P])]
+        baseWeights = [0 for p in range(P+1)]
+      else:
+        # Each particle is the only descendant of itself, so can be
+        # extended in place.
+        newParticles = particles
+        baseWeights = particleWeights
       newParticleWeights = [None for p in range(P+1)]
-      # Sample new particle and propagate
+      # Propagate
       for p in range(P):
-        parent = sampleLogCategorical(particleWeights, self.trace.np_rng)
-        newParticles[p] = Particle(particles[parent])
-        newParticleWeights[p] = regenAndAttachAtBorder(newParticles[p],self.scaffold.border[t],self.scaffold,False,OmegaDB(),OrderedDict())
-      newParticles[P] = Particle(particles[P])
-      newParticleWeights[P] = regenAndAttachAtBorder(newParticles[P],self.scaffold.border[t],self.scaffold,True,rhoDBs[t],OrderedDict())
+        newParticleWeights[p] = baseWeights[p] + regenAndAttachAtBorder(newParticles[p],self.scaffold.border[t],self.scaffold,False,OmegaDB(),OrderedDict())
+      newParticleWeights[P] = baseWeights[P] + regenAndAttachAtBorder(newParticles[P],self.scaffold.border[t],self.scaffold,True,rhoDBs[t],OrderedDict())
       # assert_almost_equal(newParticleWeights[P],rhoWeights[t])
       particles = newParticles
       particleWeights = newParticleWeights
@@ -66,12 +66,16 @@ from venture.lite.infer.mh import InPlaceOperator
 #   sections will occur. But it is a little slower than regular MH by a
 #   constant factor.
 #
-# When there exist unconstrained random choices in the border of a stale local
-# section, if that node is later selected as a principal component later, it
-# will not give a correct weight during inference because its parents may have
-# stale values. makeConsistent is provided to update stale nodes but takes
-# O(N) time.
-# TODO Relax this constaint with a smart stale node tagging method.
+# Stale local sections are tagged on the trace (see StaleSections) and
+# brought up to date lazily: when evalOneLocalSection next touches one, when
+# a value in or below one is read (report, peek, or a lookup or request of a
+# new directive), when a node below one is selected as a principal node by a
+# block scaffold indexer, or when such an indexer's scaffold resamples their
+# global border (since detaching and regenerating it goes through all its
+# local sections).  makeConsistent updates all the stale sections of a global
+# section at once, and only those.  Other kernels (e.g. pgibbs, or anything
+# that builds its own scaffold) do not check, and may compute their weights
+# from stale values.
 
 def subsampledMixMH(trace,indexer,operator,Nbatch,k0,epsilon):
   # Construct the global section with a globalBorder node or None.
@@ -106,14 +110,123 @@ def subsampledMixMH(trace,indexer,operator,Nbatch,k0,epsilon):
         lambda i: operator.evalOneLocalSection(indexer, perm_local_roots[i]))
 
   if accept:
-    return operator.accept() # May mutate trace
+    ans = operator.accept() # May mutate trace
+    if global_index.globalBorder:
+      staleSectionsOf(trace).accepted(
+        global_index.globalBorder[0], perm_local_roots[:int(n)],
+        global_index.N)
   else:
-    return operator.reject(indexer, perm_local_roots, n) # May mutate trace
+    ans = operator.reject(indexer, perm_local_roots, n) # May mutate trace
+    if global_index.globalBorder and trace.stale_sections is not None:
+      trace.stale_sections.touched(
+        global_index.globalBorder[0], perm_local_roots[:int(n)])
+  return ans
 
   # DEBUG
   # if global_index.globalBorder:
   #   operator.makeConsistent(trace,indexer)
 
+def staleSectionsOf(trace):
+  if trace.stale_sections is None:
+    trace.stale_sections = StaleSections()
+  return trace.stale_sections
+
+class StaleSections(object):
+  """The local sections of a trace whose values lag behind their
+  global border.
+
+  An accepted subsampled proposal evaluates only some of the N local
+  sections under its global border, leaving the rest stale.  Rather
+  than tag each of those, which would cost O(N) again, the border
+  counts such proposals, and each local section records the count it
+  last agreed with; a section is stale if the two differ.  Sections
+  that have never recorded a count are taken to be stale, which may
+  cost a needless update but is never wrong.
+  """
+
+  def __init__(self):
+    # global border node -> [version, {local root -> version}]
+    self.borders = {}
+
+  def accepted(self, border, roots, N):
+    """Record that a proposal to border was accepted after
+    evaluating the local sections at roots."""
+    if len(roots) == N:
+      # Everything is up to date
+      self.borders.pop(border, None)
+      return
+    entry = self.borders.get(border)
+    if entry is None:
+      entry = [0, {}]
+      self.borders[border] = entry
+    entry[0] += 1
+    self._mark(entry, roots)
+
+  def touched(self, border, roots):
+    """Record that the local sections at roots agree with border."""
+    entry = self.borders.get(border)
+    if entry is not None:
+      self._mark(entry, roots)
+
+  def _mark(self, entry, roots):
+    (version, fresh) = entry
+    for root in roots:
+      fresh[root] = version
+
+  def isStale(self, border, root):
+    entry = self.borders.get(border)
+    return entry is not None and entry[1].get(root, 0) != entry[0]
+
+  def refreshSection(self, trace, border, root):
+    scaffold = constructScaffold(trace, [OrderedSet([root])])
+    _, rhoDB = detachAndExtract(trace, scaffold)
+    regenAndAttach(trace, scaffold, False, rhoDB, OrderedDict())
+    self.touched(border, [root])
+
+  def refreshBorder(self, trace, border, roots):
+    """Bring the stale sections among roots under border up to date,
+    returning how many there were."""
+    ct = 0
+    for root in roots:
+      if self.isStale(border, root):
+        self.refreshSection(trace, border, root)
+        ct += 1
+    return ct
+
+  def refreshAll(self, trace):
+    for border in list(self.borders):
+      self.refreshBorder(trace, border, list(trace.childrenAt(border)))
+      del self.borders[border]
+
+  def refreshResampled(self, trace, scaffold):
+    """Bring up to date the stale sections under every global border
+    the scaffold resamples."""
+    for border in list(self.borders):
+      if scaffold.isResampling(border):
+        self.refreshBorder(trace, border, list(trace.childrenAt(border)))
+        del self.borders[border]
+
+  def refreshAbove(self, trace, nodes):
+    """Bring up to date the stale sections any of nodes is in or
+    depends on."""
+    if not self.borders:
+      return
+    seen = set()
+    stack = list(nodes)
+    while stack:
+      node = stack.pop()
+      if node in seen:
+        continue
+      seen.add(node)
+      if node in self.borders:
+        # Above a global border is its global section, which is
+        # never stale
+        continue
+      for parent in trace.parentsAt(node):
+        if self.isStale(parent, node):
+          self.refreshSection(trace, parent, node)
+        stack.append(parent)
+
 # Sequential Testing.
 def sequentialTest(mu_0, k0, Nbatch, N, epsilon, fun_dllh):
   # Sequentially do until termination condition is met.
@@ -395,10 +508,12 @@ class SubsampledInPlaceOperator(InPlaceOperator):
     # trace.setValueAt(globalBorderNode, self.rhoDB.getValue(globalBorderNode))
     # regenAndAttach(trace,local_scaffold,False,local_rhoDB,OrderedDict())
 
-    # Update with the old value.
+    # Update with the old value, if the section is stale.
     proposed_value = trace.valueAt(globalBorderNode)
     trace.setValueAt(globalBorderNode, self.rhoDB.getValue(globalBorderNode))
-    updateValuesAtScaffold(trace,local_scaffold,OrderedSet(globalBorder))
+    if trace.stale_sections is not None and \
+       trace.stale_sections.isStale(globalBorderNode, local_root):
+      updateValuesAtScaffold(trace,local_scaffold,OrderedSet(globalBorder))
 
     # Detach and extract
     rhoWeight,local_rhoDB = detachAndExtract(trace, local_scaffold, compute_gradient)
@@ -442,14 +557,10 @@ class SubsampledInPlaceOperator(InPlaceOperator):
 
   # Make consistent local sections given a global scaffold.
   def makeConsistentGivenGlobal(self,trace,indexer,scaffold):
-    # Go through every local child and do extract and regen.
-    # This is to be called at the end of a number of transitions.
-    if scaffold.globalBorder:
-      for local_root in scaffold.local_roots:
-        local_scaffold = indexer.sampleLocalIndex(trace,local_root,
-            scaffold.globalBorder)
-        _,local_rhoDB = detachAndExtract(trace, local_scaffold)
-        regenAndAttach(trace,local_scaffold,False,local_rhoDB,OrderedDict())
+    # Extract and regen every stale local child.
+    if scaffold.globalBorder and trace.stale_sections is not None:
+      trace.stale_sections.refreshBorder(
+        trace, scaffold.globalBorder[0], scaffold.local_roots)
       return scaffold.numAffectedNodes() # TODO Is this actually right?
     else:
       return 0
@@ -201,7 +201,7 @@ don't actually read the state (e.g., for doing IO)"""
 
 inferenceSPsList = []
 
-inferenceKeywords = [ "default", "all", "none", "one", "each", "each_reverse", "ordered" ]
+inferenceKeywords = [ "default", "all", "none", "one", "one_by_size", "each", "each_reverse", "ordered" ]
 
 def registerBuiltinInferenceSP(name, sp_obj):
   inferenceSPsList.append([name, sp_obj])
@@ -237,6 +237,26 @@ Run a Metropolis-Hastings kernel, proposing by resimulating the prior.
 The `transitions` argument specifies how many transitions of the chain
 to run.
 
+With block `one_by_size`, each transition picks a block of the scope
+with probability proportional to the number of random choices in it,
+rather than uniformly as with `one`.
+
+Returns the average number of nodes touched per transition in each particle.
+""")
+
+register_trace_method_sp("mh_batch", transition_oper_type(), desc="""\
+Run resimulation MH on every block of a scope, vectorizing across blocks.
+
+With block `each` (or `each_reverse`), blocks that consist of a single
+random choice from a built-in distribution, whose absorbing children
+are likewise built-in distributions, are proposed to and accepted or
+rejected together, with their log densities computed in bulk.  Such
+blocks must not share scaffold nodes with each other; any other block
+gets an ordinary `resimulation_mh` transition afterwards.  With any
+other block this is the same as `resimulation_mh`.
+
+The `transitions` argument specifies how many sweeps to run.
+
 Returns the average number of nodes touched per transition in each particle.
 """)
 
@@ -285,7 +305,7 @@ Returns the average number of nodes touched per transition in each particle.
 """)
 
 register_trace_method_sp("func_pgibbs",
-                  par_transition_oper_type([t.IntegerType("particles : int")]),
+                  par_transition_oper_type([t.IntegerType("particles : int"), t.NumberType("ess_threshold : number")]),
                   desc="""\
 Move to a sample of the local conditional by particle Gibbs.
 
@@ -296,6 +316,12 @@ choices in the `scope`.  This can be done by supplying the keyword
 The ``particles`` argument specifies how many particles to use in the
 particle Gibbs filter.
 
+The ``ess_threshold`` argument, if supplied, skips the resampling step
+between groups of the block unless the effective sample size of the
+particle weights (counting the retained particle) is below that
+fraction of the number of particles.  When it is supplied, the
+``transitions`` must be too.
+
 The ``transitions`` argument specifies how many times to do this.
 
 The ``in-parallel`` argument, if supplied, toggles per-particle
@@ -306,7 +332,7 @@ Returns the average number of nodes touched per transition in each particle.
 """)
 
 register_trace_method_sp("pgibbs",
-                  par_transition_oper_type([t.IntegerType("particles : int")]),
+                  par_transition_oper_type([t.IntegerType("particles : int"), t.NumberType("ess_threshold : number")]),
                   desc="""\
 Like `func_pgibbs` but reuse a single trace instead of having several.
 
@@ -320,7 +346,7 @@ Returns the average number of nodes touched per transition in each particle.
 """)
 
 register_trace_method_sp("func_pmap",
-                  par_transition_oper_type([t.IntegerType("particles : int")]),
+                  par_transition_oper_type([t.IntegerType("particles : int"), t.NumberType("ess_threshold : number")]),
                   desc="""\
 Like func_pgibbs, but deterministically
 select the maximum-likelihood particle at the end instead of sampling.
@@ -424,6 +450,36 @@ The ``transitions`` argument specifies how many times to do this.
 Returns the average number of nodes touched per transition in each particle.
 """)
 
+register_trace_method_sp("adaptive_hmc",
+                  transition_oper_type([t.IntegerType("steps : int"), t.IntegerType("warmup : int")]),
+                  desc="""\
+Run a Hamiltonian Monte Carlo transition kernel that adapts its own
+step size and (diagonal) mass matrix.
+
+Not available in the Puma backend.  Not all the builtin procedures
+support all the gradient information necessary for this.
+
+The presence of discrete random choices in the scope-block pair will
+not prevent this inference strategy, but none of the discrete
+choices will be moved.
+
+The ``steps`` argument gives how many steps to take in each HMC
+trajectory.
+
+The ``warmup`` argument gives how many transitions to spend adapting.
+During the warmup, the step size is tuned by dual averaging toward an
+acceptance rate of 0.8, and the mass matrix is estimated from the
+variance of the states visited; after it, both are fixed.  The
+adaptation is kept per scope, block, and ``steps``, and carries over
+across calls, so a long warmup may be spread over several calls.
+Since the warmup does not leave the posterior invariant, samples taken
+during it should be discarded.
+
+The ``transitions`` argument specifies how many times to do this.
+
+Returns the average number of nodes touched per transition in each particle.
+""")
+
 register_trace_method_sp("rejection", transition_oper_type([t.AnyType("density_bound : maybe number"), t.NumberType("attempt_bound : number")], min_req_args=1), desc="""\
 Sample from the local conditional by rejection sampling.
 
@@ -560,6 +616,10 @@ The ``max_processes`` argument, if supplied, puts a cap on the number of
 processes to make.  The particles are distributed evenly among the
 processes.  If no cap is given, fork one process per particle.
 
+Resampling again with the same cap, into as many processes, keeps the
+existing processes: each copies its own surviving particles as far as
+it has room, and only the remaining survivors are transmitted.
+
 Subtlety: Collecting results (and especially performing further
 resampling steps) requires inter-process communication, and therefore
 requires serializing and deserializing any state that needs
@@ -567,6 +627,18 @@ transmitting.  `resample_multiprocess` is therefore not a drop-in
 replacement for `resample`, as the former will handle internal
 states that cannot be serialized, whereas the latter will not.  """)
 
+register_engine_method_sp("resample_forking",
+                   infer_action_maker_type([t.IntegerType("particles : int")]),
+                   desc="""\
+Like `resample_multiprocess` with one process per particle, but
+resampling from particles that are already in such processes does not
+serialize them.
+
+Instead, the process holding each surviving particle forks once per
+copy of it, so the copies share the memory of their ancestor
+copy-on-write, and only the choice of ancestors is communicated.
+Requires an operating system with fork.  """)
+
 register_engine_method_sp("resample_serializing",
                    infer_action_maker_type([t.IntegerType("particles : int")]),
                    desc="""\
@@ -599,6 +671,23 @@ Might be useful for debugging concurrency+serialization problems
 without messing with actual multiprocessing, but then one is messing
 with multithreading.""")
 
+register_engine_method_sp("set_resampling",
+                   infer_action_maker_type([t.SymbolType("scheme"), t.NumberType("ess_threshold")], min_req_args=1),
+                   desc="""\
+Choose how subsequent `resample` steps (of every mode) pick survivors.
+
+The ``scheme`` is one of ``multinomial`` (the default), ``systematic``,
+``stratified``, or ``residual``.  The last three copy each particle a
+number of times within one of its expected number, and so add less
+variance than multinomial resampling, which draws the survivors
+independently.
+
+If the ``ess_threshold`` is supplied, a resampling step that would
+keep the number of particles (and the mode) does nothing unless the
+effective sample size of the particle weights is below that fraction
+of the number of particles.  Such steps keep the particles and their
+weights as they are.""")
+
 register_engine_method_sp("likelihood_weight", infer_action_maker_type([]), desc="""\
 Likelihood-weight the full particle set.
 
@@ -46,6 +46,13 @@ def _covariance_factor(Sigma):
 class Covariance_Cholesky(object):
   def __init__(self, Sigma):
     self._cholesky = la.cho_factor(Sigma)
+  @staticmethod
+  def from_lower(L):
+    # Wrap an existing lower-triangular Cholesky factor L, with Sigma
+    # = L L^T, without refactoring Sigma.
+    covf = Covariance_Cholesky.__new__(Covariance_Cholesky)
+    covf._cholesky = (L, True)
+    return covf
   def solve(self, Y):
     return la.cho_solve(self._cholesky, Y)
   def inverse(self):
@@ -98,8 +105,12 @@ def logpdf(X, Mu, Sigma):
   assert np.all(np.isfinite(Mu))
   assert np.all(np.isfinite(Sigma))
 
+  return logpdf_factored(X, Mu, _covariance_factor(Sigma))
+
+def logpdf_factored(X, Mu, covf):
+  """Multivariate normal log pdf, given a factor of the covariance."""
+  n = len(X)
   X_ = X - Mu
-  covf = _covariance_factor(Sigma)
 
   logp = -np.dot(X_.T, covf.solve(X_)/2.)
   logp -= (n/2.)*np.log(2*np.pi)
@@ -223,8 +234,15 @@ def dlogpdf(X, dX, Mu, dMu, Sigma, dSigma):
   assert np.all(np.isfinite(Mu))
   assert np.all(np.isfinite(Sigma))
 
+  return dlogpdf_factored(X, dX, Mu, dMu, _covariance_factor(Sigma), dSigma)
+
+def dlogpdf_factored(X, dX, Mu, dMu, covf, dSigma):
+  """Derivative of multivariate normal logpdf, given a covariance factor.
+
+  Same as dlogpdf, but with the covariance matrix Sigma given by a
+  factor covf such as _covariance_factor(Sigma) computes.
+  """
   X_ = X - Mu
-  covf = _covariance_factor(Sigma)
 
   # Solve Sigma alpha = X - Mu for alpha.
   #
@@ -280,7 +298,84 @@ def conditional(X2, Mu1, Mu2, Sigma11, Sigma12, Sigma21, Sigma22):
   assert np.all(np.isfinite(Sigma21))
   assert np.all(np.isfinite(Sigma22))
 
-  covf22 = _covariance_factor(Sigma22)
+  return conditional_factored(
+    X2, Mu1, Mu2, Sigma11, Sigma12, Sigma21, _covariance_factor(Sigma22))
+
+def conditional_factored(X2, Mu1, Mu2, Sigma11, Sigma12, Sigma21, covf22):
+  """Parameters of conditional multivariate normal, given a factor of Sigma22.
+
+  Same as conditional, but with Sigma22 given by a factor covf22 such
+  as _covariance_factor(Sigma22) computes.
+  """
   Mu_ = Mu1 + np.dot(Sigma12, covf22.solve(X2 - Mu2))
   Sigma_ = Sigma11 - np.dot(Sigma12, covf22.solve(Sigma21))
   return (Mu_, Sigma_)
+
+# Incremental maintenance of lower-triangular Cholesky factors.  All
+# of these return a fresh factor and leave their arguments unmodified,
+# so that a factor may be shared by anything that has a copy of it.
+
+def cholesky_update(L, x):
+  """Rank-one update: return the Cholesky factor of L L^T + x x^T."""
+  return _cholesky_rank_one(L, x, 1)
+
+def cholesky_downdate(L, x):
+  """Rank-one downdate: return the Cholesky factor of L L^T - x x^T.
+
+  Raises la.LinAlgError if the result is not positive-definite.
+  """
+  return _cholesky_rank_one(L, x, -1)
+
+def _cholesky_rank_one(L, x, sign):
+  # Standard O(n^2) sequence of Givens-like rotations, one column at a
+  # time, vectorized within each column.
+  L = np.array(L, dtype=float)
+  x = np.array(x, dtype=float)
+  n = len(x)
+  for k in xrange(n):
+    Lkk = L[k, k]
+    r2 = Lkk*Lkk + sign*x[k]*x[k]
+    if not r2 > 0:
+      raise la.LinAlgError('Cholesky %s is not positive-definite' %
+        ('update' if sign > 0 else 'downdate',))
+    r = np.sqrt(r2)
+    c = r/Lkk
+    s = x[k]/Lkk
+    L[k, k] = r
+    if k + 1 < n:
+      L[k+1:, k] = (L[k+1:, k] + sign*s*x[k+1:])/c
+      x[k+1:] = c*x[k+1:] - s*L[k+1:, k]
+  return L
+
+def cholesky_extend(L, Sigma12, Sigma22):
+  """Return the Cholesky factor of [Sigma11, Sigma12; Sigma12^T, Sigma22].
+
+  L is the lower-triangular Cholesky factor of Sigma11.  Costs
+  O(n^2 k + n k^2 + k^3) for an n-by-n Sigma11 and k-by-k Sigma22,
+  rather than O((n + k)^3) to factor the whole matrix afresh.
+
+  Raises la.LinAlgError if the result is not positive-definite.
+  """
+  n = L.shape[0]
+  k = Sigma22.shape[0]
+  if n == 0:
+    return la.cholesky(Sigma22, lower=True)
+  L21 = la.solve_triangular(L, Sigma12, lower=True).T
+  L22 = la.cholesky(Sigma22 - np.dot(L21, L21.T), lower=True)
+  L_ = np.zeros((n + k, n + k))
+  L_[:n, :n] = L
+  L_[n:, :n] = L21
+  L_[n:, n:] = L22
+  return L_
+
+def cholesky_delete(L, i):
+  """Return the Cholesky factor of L L^T without its ith row and column."""
+  n = L.shape[0]
+  L_ = np.zeros((n - 1, n - 1))
+  L_[:i, :i] = L[:i, :i]
+  L_[i:, :i] = L[i+1:, :i]
+  if i + 1 < n:
+    # The trailing block loses the contribution of column i, which
+    # must be folded back in as a rank-one update.
+    L_[i:, i:] = cholesky_update(L[i+1:, i+1:], L[i+1:, i])
+  return L_
@@ -19,9 +19,14 @@ from venture.lite.orderedset import OrderedSet
 from venture.lite.psp import IArgs
 from venture.lite.request import Request
 from venture.lite.types import ExpressionType
+from venture.lite.value import SPRef
 from venture.lite.value import VentureValue
 import venture.lite.address as addr
 
+# A node keeps up to this many children in a tuple, which is far
+# smaller than a set; only nodes with more children pay for one.
+MAX_TUPLE_CHILDREN = 8
+
 class Node(object):
   __slots__ = ('address', 'value', 'children', 'isObservation', 'observedValue',
     'madeSPRecord', 'aaaMadeSPAux', 'numRequests', 'esrParents', 'isFrozen')
@@ -29,15 +34,36 @@ class Node(object):
     assert address is not None
     self.address = address
     self.value = None
-    self.children = OrderedSet()
+    self.children = () # Tuple, or OrderedSet if there are many
     self.isObservation = False
     self.observedValue = None
     self.madeSPRecord = None
     self.aaaMadeSPAux = None
     self.numRequests = 0
-    self.esrParents = []
+    self.esrParents = () # Becomes a list on the first ESR edge
     self.isFrozen = False
 
+  def addChild(self, child):
+    children = self.children
+    if type(children) is tuple: # pylint: disable=unidiomatic-typecheck
+      if child not in children:
+        if len(children) < MAX_TUPLE_CHILDREN:
+          self.children = children + (child,)
+        else:
+          self.children = OrderedSet(children + (child,))
+    else:
+      children.add(child)
+
+  def removeChild(self, child):
+    children = self.children
+    if type(children) is tuple: # pylint: disable=unidiomatic-typecheck
+      if child not in children:
+        raise KeyError(child)
+      i = children.index(child)
+      self.children = children[:i] + children[i+1:]
+    else:
+      children.remove(child)
+
   def observe(self,val):
     self.observedValue = val
     self.isObservation = True
@@ -66,6 +92,24 @@ class ConstantNode(Node):
   def definiteParents(self): return []
 
 
+class BuiltinNode(ConstantNode):
+  """A node of the builtin frame, which all Lite traces share.
+
+  A builtin node records no children, since it would collect the
+  lookups of every trace at once, and a builtin procedure keeps no SP
+  record on the node: each trace makes its own on first use, so SP
+  families and auxes stay per-trace (see Trace.madeSPRecordAt)."""
+  __slots__ = ('sp',)
+  def __init__(self, address, value, sp=None):
+    if sp is not None:
+      value = SPRef(self)
+    super(BuiltinNode, self).__init__(address, value)
+    self.sp = sp
+
+  def addChild(self, child): pass
+  def removeChild(self, child): pass
+
+
 class LookupNode(Node):
   __slots__ = ('sourceNode')
   def __init__(self,address,sourceNode):
@@ -92,7 +136,7 @@ class RequestNode(ApplicationNode):
 
   def registerOutputNode(self,outputNode):
     self.outputNode = outputNode
-    self.children.add(outputNode)
+    self.addChild(outputNode)
 
   def definiteParents(self): return [self.operatorNode] + self.operandNodes
 
@@ -111,12 +155,14 @@ class OutputNode(ApplicationNode):
     self.isFrozen = False
 
   def definiteParents(self): return [self.operatorNode] + self.operandNodes + [self.requestNode]
-  def parents(self): return self.definiteParents() + self.esrParents
+  def parents(self): return self.definiteParents() + list(self.esrParents)
   def relevantPSP(self, sp): return sp.outputPSP
 
 
 def isConstantNode(thing):
   return isinstance(thing, ConstantNode) or (isinstance(thing, Node) and thing.isFrozen)
+def isBuiltinNode(thing):
+  return isinstance(thing, BuiltinNode)
 def isLookupNode(thing):
   return isinstance(thing, LookupNode) and not thing.isFrozen
 def isApplicationNode(thing):
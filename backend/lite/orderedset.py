@@ -18,32 +18,67 @@
 
 import copy
 
-from collections import OrderedDict
+
+# Marks the slot of a removed element until the next compaction
+_REMOVED = object()
 
 
 class OrderedFrozenSet(object):
     """Variant of `frozenset` which remembers element insertion order.
 
     Iteration happens in order of insertion.
+
+    The elements are kept in a list, with a dict from each element to
+    its position for membership.  Removing an element (from an
+    `OrderedSet`) leaves a hole in the list, which is compacted away
+    once holes make up half of it.  Copying a set copies the list and
+    the dict wholesale, without rehashing the elements one by one.
     """
 
+    __slots__ = ('_items', '_index', '_head', '__weakref__')
+
     def __init__(self, iterable=None):
-        self._dict = OrderedDict((x, 1) for x in iterable or ())
+        if isinstance(iterable, OrderedFrozenSet):
+            iterable._compact()
+            self._items = list(iterable._items)
+            self._index = dict(iterable._index)
+        else:
+            self._items = []
+            self._index = {}
+            if iterable:
+                self._extend(iterable)
+        self._head = 0 # No live element precedes this position
+
+    def _extend(self, iterable):
+        items = self._items
+        index = self._index
+        for x in iterable:
+            if x not in index:
+                index[x] = len(items)
+                items.append(x)
+
+    def _compact(self):
+        if len(self._items) != len(self._index):
+            self._items = [x for x in self._items if x is not _REMOVED]
+            self._index = dict((x, i) for i, x in enumerate(self._items))
+            self._head = 0
 
     def __iter__(self):
-        return self._dict.iterkeys()
+        if len(self._items) == len(self._index):
+            return iter(self._items)
+        return (x for x in self._items if x is not _REMOVED)
 
     def __len__(self):
-        return len(self._dict)
+        return len(self._index)
 
     def __contains__(self, x):
-        return x in self._dict
+        return x in self._index
 
     def isdisjoint(self, other):
-        for x in self._dict.iterkeys():
+        for x in self:
             if x in other:
                 return False
-        for x in other._dict.iterkeys():
+        for x in other:
             if x in self:
                 return False
         return True
@@ -52,7 +87,7 @@ class OrderedFrozenSet(object):
         return self <= other
 
     def __le__(self, other):
-        for x in self._dict.iterkeys():
+        for x in self:
             if x not in other:
                 return False
         return True
@@ -60,7 +95,7 @@ class OrderedFrozenSet(object):
     def __lt__(self, other):
         if not self <= other:
             return False
-        if all(x in self for x in other._dict.iterkeys()):
+        if all(x in self for x in other):
             return False
         return True
 
@@ -68,7 +103,7 @@ class OrderedFrozenSet(object):
         return self >= other
 
     def __ge__(self, other):
-        for x in other._dict.iterkeys():
+        for x in other:
             if x not in self:
                 return False
         return True
@@ -76,7 +111,7 @@ class OrderedFrozenSet(object):
     def __gt__(self, other):
         if not self >= other:
             return False
-        if all(x in other for x in self._dict.iterkeys()):
+        if all(x in other for x in self):
             return False
         return True
 
@@ -91,50 +126,43 @@ class OrderedFrozenSet(object):
         return True
 
     def union(self, *others):
-        def union():
-            for x in self:
-                yield x
-            for other in others:
-                for x in other:
-                    yield x
-        return type(self)(union())
+        ans = type(self)(self)
+        for other in others:
+            ans._extend(other)
+        return ans
 
     def __or__(self, other):
-        def union():
-            for x in self:
-                yield x
-            for x in other:
-                yield x
-        return type(self)(union())
+        ans = type(self)(self)
+        ans._extend(other)
+        return ans
 
     def intersection(self, *others):
         assert all(isinstance(other, OrderedFrozenSet) for other in others), others
-        return type(self)(x for x in self
-            if all(x in other for other in others))
+        return type(self)([x for x in self
+            if all(x in other for other in others)])
 
     def __and__(self, other):
-        return type(self)(x for x in self if x in other)
+        return type(self)([x for x in self if x in other])
 
     def difference(self, *others):
         assert all(isinstance(other, OrderedFrozenSet) for other in others), others
-        return type(self)(x for x in self
-            if not any(x in other for other in others))
+        if not others:
+            return type(self)(self)
+        if len(others) == 1:
+            return self - others[0]
+        return type(self)([x for x in self
+            if not any(x in other for other in others)])
 
     def __sub__(self, other):
-        return type(self)(x for x in self if x not in other)
+        return type(self)([x for x in self if x not in other])
 
     def symmetric_difference(self, other):
         return self ^ other
 
     def __xor__(self, other):
-        def symdiff():
-            for x in self:
-                if x not in other:
-                    yield x
-            for x in other:
-                if x not in self:
-                    yield x
-        return type(self)(symdiff())
+        ans = type(self)([x for x in self if x not in other])
+        ans._extend(x for x in other if x not in self)
+        return ans
 
     def copy(self):
         return type(self)(self)
@@ -145,10 +173,18 @@ class OrderedFrozenSet(object):
     def __deepcopy__(self, memo):
         c = type(self)()
         memo[id(self)] = c
-        for x in self:
-            c._dict[copy.deepcopy(x, memo)] = 1
+        c._extend(copy.deepcopy(x, memo) for x in self)
         return c
 
+    def __getstate__(self):
+        return list(self)
+
+    def __setstate__(self, state):
+        self._items = []
+        self._index = {}
+        self._head = 0
+        self._extend(state)
+
     def __repr__(self):
         return '%s([%s])' % \
             (type(self).__name__, ', '.join('%r' % (x,) for x in self))
@@ -162,13 +198,14 @@ class OrderedSet(OrderedFrozenSet):
     its original place in the ordering.
     """
 
+    __slots__ = ()
+
     def update(self, *others):
         for other in others:
-            self |= other
+            self._extend(other)
 
     def __ior__(self, other):
-        for x in other:
-            self.add(x)
+        self._extend(other)
         return self
 
     def intersection_update(self, *others):
@@ -176,9 +213,8 @@ class OrderedSet(OrderedFrozenSet):
             self &= other
 
     def __iand__(self, other):
-        for x in self:
-            if x not in other:
-                self.remove(x)
+        for x in [x for x in self if x not in other]:
+            self.remove(x)
         return self
 
     def difference_update(self, *others):
@@ -194,22 +230,40 @@ class OrderedSet(OrderedFrozenSet):
         self ^= other
 
     def __ixor__(self, other):
-        self._dict = (self ^ other)._dict
+        ans = self ^ other
+        (self._items, self._index, self._head) = \
+            (ans._items, ans._index, ans._head)
         return self
 
     def add(self, x):
-        self._dict[x] = 1
+        if x not in self._index:
+            self._index[x] = len(self._items)
+            self._items.append(x)
 
     def remove(self, x):
-        del self._dict[x]
+        i = self._index.pop(x)
+        if i == len(self._items) - 1:
+            self._items.pop()
+        else:
+            self._items[i] = _REMOVED
+            if 2 * len(self._index) < len(self._items):
+                self._compact()
 
     def discard(self, x):
-        if x in self:
+        if x in self._index:
             self.remove(x)
 
     def pop(self):
-        x, _ = self._dict.popitem(last=False)
+        if not self._index:
+            raise KeyError('pop from an empty set')
+        items = self._items
+        while items[self._head] is _REMOVED:
+            self._head += 1
+        x = items[self._head]
+        self.remove(x)
         return x
 
     def clear(self):
-        self._dict.clear()
+        self._items = []
+        self._index = {}
+        self._head = 0
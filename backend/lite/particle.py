@@ -20,6 +20,7 @@ import numpy.random as npr
 from collections import OrderedDict
 
 from venture.lite.node import Node
+from venture.lite.orderedset import OrderedSet
 from venture.lite.sp import VentureSPRecord
 from venture.lite.trace import Trace
 from venture.lite.utils import override
@@ -192,7 +193,8 @@ class Particle(Trace):
 
   def childrenAt(self, node):
     if node in self.newChildren:
-      return self.base.childrenAt(node).union(self.newChildren.lookup(node))
+      return OrderedSet(self.base.childrenAt(node)).union(
+        self.newChildren.lookup(node))
     else:
       return self.base.childrenAt(node)
 
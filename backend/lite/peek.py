@@ -0,0 +1,188 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Evaluating an expression against a trace without changing it.
+
+This is how sample and collect read the model: rather than evaluating
+a directive and forgetting it, the expression is evaluated by a
+variant of the untraced evaluator (venture.untraced.evaluator) that
+looks its free variables up in the trace and applies the procedures
+they denote, but makes no trace nodes and registers no families with
+those procedures.
+
+Incorporating a value into a procedure's auxiliary state writes to a
+copy of that state private to the one evaluation, made when it is
+first written.  So (list (f) (f)) for a collapsed f sees its own
+first draw, as a predicted directive would, and the trace never does.
+
+Latent simulation requests are not supported; peek raises
+PeekUnsupported on meeting one, and the caller should fall back to
+evaluating and forgetting a directive.
+"""
+
+import copy
+
+from venture.exception import VentureException
+from venture.lite import exp as e
+from venture.lite.exception import VentureError
+from venture.lite.exception import VentureNestedRiplMethodError
+from venture.lite.psp import IArgs
+from venture.lite.sp import VentureSPRecord
+from venture.lite.value import SPRef
+from venture.untraced.evaluator import nonRepeatableRequestID
+import venture.lite.address as addr
+import venture.untraced.node as node
+
+class PeekUnsupported(Exception):
+  """The expression cannot be evaluated without changing the trace."""
+
+def peek(trace, address, exp, env):
+  return _Peek(trace).eval(address, exp, env)
+
+class _Peek(object):
+  def __init__(self, trace):
+    self.trace = trace
+    self.auxes = {} # id(SP record) -> (record, private copy of its aux)
+    self.families = {} # (id(SP record), request id) -> (record, node)
+
+  def valueOf(self, source):
+    if isinstance(source, node.Node):
+      return source.value
+    else:
+      self.trace.refreshStaleSections([source])
+      return self.trace.valueAt(source)
+
+  def aux(self, spr, write):
+    if id(spr) in self.auxes:
+      return self.auxes[id(spr)][1]
+    elif write:
+      aux = spr.spAux.copy()
+      self.auxes[id(spr)] = (spr, aux)
+      return aux
+    else:
+      return spr.spAux
+
+  def record(self, value, address):
+    if isinstance(value, SPRef):
+      return self.trace.madeSPRecordAt(value.makerNode)
+    elif isinstance(value, VentureSPRecord):
+      return value
+    else:
+      raise VentureException("evaluation", "Cannot apply a non-procedure",
+                             address=address)
+
+  def eval(self, address, exp, env):
+    if e.isVariable(exp):
+      try:
+        source = env.findSymbol(exp)
+      except VentureError as err:
+        import sys
+        info = sys.exc_info()
+        raise VentureException("evaluation", err.message, address=address), \
+          None, info[2]
+      return self.valueOf(source)
+    elif e.isSelfEvaluating(exp): return node.normalize(exp)
+    elif e.isQuotation(exp): return node.normalize(e.textOfQuotation(exp))
+    else:
+      nodes = []
+      for index, subexp in enumerate(exp):
+        addr2 = addr.extend(address, index)
+        nodes.append(node.Node(addr2, self.eval(addr2, subexp, env)))
+      try:
+        return self.apply(address, nodes, env)
+      except VentureNestedRiplMethodError as err:
+        # See the corresponding clause in venture.lite.regen.evalFamily
+        import sys
+        info = sys.exc_info()
+        raise VentureException("evaluation", err.message, address=err.addr,
+                               cause=err), None, info[2]
+      except (VentureException, PeekUnsupported):
+        raise # Avoid rewrapping with the below
+      except Exception as err:
+        import sys
+        info = sys.exc_info()
+        raise VentureException("evaluation", err.message, address=address,
+                               cause=err), None, info[2]
+
+  def apply(self, address, nodes, env):
+    spr = self.record(nodes[0].value, address)
+    req_args = PeekArgs(self, spr, address, nodes[1:], env)
+    requests = applyPSP(spr.sp.requestPSP, req_args)
+    if requests.lsrs:
+      raise PeekUnsupported()
+    esr_nodes = [self.evalRequest(req_args, spr, r) for r in requests.esrs]
+    out_args = PeekArgs(self, spr, address, nodes[1:], env, esr_nodes,
+                        requests)
+    return applyPSP(spr.sp.outputPSP, out_args)
+
+  def evalRequest(self, req_args, spr, r):
+    key = (id(spr), r.id)
+    if key in self.families:
+      return self.families[key][1]
+    elif spr.spFamilies.containsFamily(r.id):
+      return spr.spFamilies.getFamily(r.id)
+    else:
+      new_addr = addr.request(req_args.node.address, r.addr)
+      ans = node.Node(new_addr, self.eval(new_addr, r.exp, r.env))
+      if key in self.families:
+        # As in venture.lite.regen.evalRequests
+        raise VentureException("evaluation", "Recursive mem argument " \
+          "loop detected.", address=req_args.node.address)
+      if not nonRepeatableRequestID(req_args, r.id):
+        self.families[key] = (spr, ans)
+      return ans
+
+def applyPSP(psp, args):
+  val = psp.simulate(args)
+  psp.incorporate(val, args.writing())
+  return val
+
+class PeekArgs(IArgs):
+  """The evaluation context of an application in a peek, parallel to
+  venture.lite.node.TraceNodeArgs."""
+
+  def __init__(self, peek_, spr, address, operandNodes, env,
+               esrNodes=None, requests=None):
+    super(PeekArgs, self).__init__()
+    self.peek = peek_
+    self.spr = spr
+    self.node = node.Node(address)
+    self.operandNodes = operandNodes
+    self.env = env
+    self.esr_nodes = esrNodes
+    self.requests = requests
+    self.write = False
+
+  def writing(self):
+    """These args, but with writes to the SP's aux going to the peek's
+    private copy of it."""
+    ans = copy.copy(self)
+    ans.write = True
+    return ans
+
+  def operandValues(self):
+    return [self.peek.valueOf(n) for n in self.operandNodes]
+
+  def spaux(self): return self.peek.aux(self.spr, self.write)
+  def madeSPAux(self): return None
+
+  def requestValue(self): return self.requests
+  def esrNodes(self): return self.esr_nodes
+  def esrValues(self): return [self.peek.valueOf(n) for n in self.esr_nodes]
+
+  def py_prng(self): return self.peek.trace.py_rng
+  def np_prng(self): return self.peek.trace.np_rng
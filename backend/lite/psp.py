@@ -254,6 +254,36 @@ class PSP(object):
     """
     raise VentureBuiltinSPMethodError("Cannot enumerate %s.", type(self))
 
+  def canBatch(self):
+    """Return whether this PSP implements simulateBatch and
+    logDensityBatch.  Batching is used only by batch MH (mh_batch),
+    which vectorizes proposals over many single-choice blocks.
+    """
+    return False
+
+  def batchDelegate(self, _args):
+    """Return the PSP whose simulateBatch and logDensityBatch methods
+    stand in for this PSP at the given args, or None if applications
+    at these args cannot be batched.  The delegate must carry an
+    f_type, which is used to marshal the rows of the batch.
+    """
+    return None
+
+  def simulateBatch(self, _params, _size, _np_rng):
+    """Return a numpy array of size independent simulations, one per
+    row of params.  params is a list of numpy arrays of that length,
+    one per operand, holding the Python representations of the
+    operands; it is empty if the PSP was applied to no operands.
+    """
+    raise VentureBuiltinSPMethodError("Cannot batch simulate %s.", type(self))
+
+  def logDensityBatch(self, _values, _params):
+    """Return a numpy array of the log densities of each of the given
+    values at the corresponding row of params, as in simulateBatch.
+    """
+    raise VentureBuiltinSPMethodError("Cannot batch compute log density of "
+      "%s.", type(self))
+
   def description(self, _name):
     """Return a string describing this PSP.  The string may include the
     name argument, which is the symbol that the enclosing SP is bound to.
@@ -559,6 +589,15 @@ class TypedPSP(PSP):
   def canEnumerate(self):
     return self.psp.canEnumerate()
 
+  def canBatch(self):
+    return self.psp.canBatch()
+
+  def batchDelegate(self, _args):
+    if self.psp.canBatch():
+      return self
+    else:
+      return None
+
   def hasVariationalLKernel(self): return self.psp.hasVariationalLKernel()
 
   def getVariationalLKernel(self, args):
@@ -639,6 +678,9 @@ class DispatchingPSP(PSP):
   def canEnumerate(self):
     return self.psps[0].canEnumerate()
 
+  def batchDelegate(self, args):
+    return self._disptach(args).batchDelegate(args)
+
   def hasVariationalLKernel(self):
     return self.psps[0].hasVariationalLKernel()
 
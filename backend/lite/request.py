@@ -16,6 +16,7 @@
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
 class Request(object):
+  __slots__ = ('esrs', 'lsrs')
   def __init__(self,esrs=None,lsrs=None):
     if esrs is None: esrs = []
     if lsrs is None: lsrs = []
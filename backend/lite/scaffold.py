@@ -47,6 +47,10 @@ class Scaffold(object):
     # Store the drg for introspection; not directly read by regen/detach
 
   def getPrincipalNodes(self):
+    if len(self.setsOfPNodes) == 1 and \
+       type(self.setsOfPNodes[0]) is OrderedFrozenSet:
+      # Already the union, and cannot change under the caller
+      return self.setsOfPNodes[0]
     return OrderedFrozenSet([]).union(*self.setsOfPNodes)
   def getRegenCount(self,node): return self.regenCounts[node]
   def incrementRegenCount(self,node): self.regenCounts[node] += 1
@@ -172,6 +176,182 @@ def constructScaffold(trace, setsOfPNodes, useDeltaKernels=False, deltaKernelArg
 
   return scaffold
 
+class ScaffoldCache(object):
+  """Memo of constructed scaffolds, for kernels that keep selecting the
+  same blocks while the structure of the trace stays put.
+
+  Entries are keyed by the caller (by scope, block, and kernel
+  options) and remember the principal node sets they were built from,
+  so a block whose membership changed simply misses.  The trace
+  reports structural changes (to children, ESR edges, request counts,
+  or which procedure a node holds) at individual nodes, which marks
+  every entry whose scaffold, or the parents of whose scaffold,
+  includes that node.  A marked entry is rechecked against the
+  structure of the marked nodes when next used, since a rejected
+  proposal puts back exactly what it took apart.
+
+  Dynamic extents that trace search computes are remembered the same
+  way, watching every node their walk looked at.
+
+  At most max_entries entries are kept, evicting the least recently
+  used, so that entries for blocks that have since gone away do not
+  accumulate.
+  """
+
+  max_entries = 4096
+
+  def __init__(self, max_entries=None):
+    if max_entries is not None:
+      self.max_entries = max_entries
+    # key -> ScaffoldCacheEntry or ExtentCacheEntry, least recently
+    # used first
+    self.entries = OrderedDict()
+    self.watchers = {} # node -> set(key)
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+  def construct(self, trace, key, setsOfPNodes, useDeltaKernels=False,
+                deltaKernelArgs=None, updateValues=False):
+    entry = self._lookup(key)
+    if entry is not None and not entry.isValid(trace, setsOfPNodes):
+      self.discard(key)
+      self.invalidations += 1
+      entry = None
+    if entry is not None:
+      self.hits += 1
+      scaffold = entry.scaffold
+      lkernels = loadKernels(trace, scaffold.drg, scaffold.aaa,
+                             useDeltaKernels, deltaKernelArgs)
+      scaffold = Scaffold(setsOfPNodes, OrderedDict(entry.regenCounts),
+                          scaffold.absorbing, scaffold.aaa,
+                          [list(segment) for segment in entry.border],
+                          lkernels, scaffold.brush, scaffold.drg)
+      if updateValues:
+        updateValuesAtScaffold(trace, scaffold, OrderedSet())
+      return scaffold
+    self.misses += 1
+    scaffold = constructScaffold(trace, setsOfPNodes,
+      useDeltaKernels=useDeltaKernels, deltaKernelArgs=deltaKernelArgs,
+      updateValues=updateValues)
+    self.store(trace, key, setsOfPNodes, scaffold)
+    return scaffold
+
+  def store(self, trace, key, setsOfPNodes, scaffold):
+    self.discard(key)
+    core = set(scaffold.drg)
+    core.update(scaffold.absorbing)
+    core.update(scaffold.brush)
+    for pnodes in setsOfPNodes: core.update(pnodes)
+    watched = set(core)
+    for node in core: watched.update(trace.parentsAt(node))
+    for node in watched:
+      self.watchers.setdefault(node, set()).add(key)
+    self.entries[key] = ScaffoldCacheEntry(trace, setsOfPNodes, scaffold,
+                                           watched)
+    self._evict()
+
+  def randomChoicesInExtent(self, trace, nodes):
+    """The random choices in the dynamic extent of the given nodes,
+    remembered until the structure of the walk that found them
+    changes."""
+    key = (ExtentCacheEntry, tuple(nodes))
+    entry = self._lookup(key)
+    if entry is not None and not entry.isValid(trace):
+      self.discard(key)
+      self.invalidations += 1
+      entry = None
+    if entry is not None:
+      self.hits += 1
+      return OrderedSet(entry.pnodes)
+    self.misses += 1
+    visited = set()
+    pnodes = trace.randomChoicesInExtent(nodes, None, None, visited)
+    for node in visited:
+      self.watchers.setdefault(node, set()).add(key)
+    self.entries[key] = ExtentCacheEntry(trace, pnodes, visited)
+    self._evict()
+    return OrderedSet(pnodes)
+
+  def _lookup(self, key):
+    entry = self.entries.pop(key, None)
+    if entry is not None:
+      self.entries[key] = entry # Now the most recently used
+    return entry
+
+  def _evict(self):
+    while len(self.entries) > self.max_entries:
+      self.discard(next(iter(self.entries)))
+
+  def discard(self, key):
+    entry = self.entries.pop(key, None)
+    if entry is None: return
+    for node in entry.signatures:
+      keys = self.watchers[node]
+      keys.discard(key)
+      if not keys: del self.watchers[node]
+
+  def noteStructureChange(self, node):
+    for key in self.watchers.get(node, ()):
+      self.entries[key].dirty.add(node)
+
+  def stats(self):
+    return {"hits": self.hits, "misses": self.misses,
+            "invalidations": self.invalidations, "size": len(self.entries)}
+
+class ScaffoldCacheEntry(object):
+  def __init__(self, trace, setsOfPNodes, scaffold, watched):
+    self.setsOfPNodes = setsOfPNodes
+    self.scaffold = scaffold
+    # Snapshots, because the caller's detach and regen mutate these
+    self.regenCounts = OrderedDict(scaffold.regenCounts)
+    self.border = [list(segment) for segment in scaffold.border]
+    self.signatures = dict((node, structureSignature(trace, node))
+                           for node in watched)
+    self.dirty = set()
+
+  def isValid(self, trace, setsOfPNodes):
+    # Registration order within a block shifts as its nodes are
+    # regenerated, but does not matter to the scaffold.
+    if len(setsOfPNodes) != len(self.setsOfPNodes): return False
+    for (pnodes1, pnodes2) in zip(setsOfPNodes, self.setsOfPNodes):
+      if len(pnodes1) != len(pnodes2) or set(pnodes1) != set(pnodes2):
+        return False
+    for node in self.dirty:
+      if structureSignature(trace, node) != self.signatures[node]:
+        return False
+    self.dirty = set()
+    return True
+
+class ExtentCacheEntry(object):
+  def __init__(self, trace, pnodes, watched):
+    self.pnodes = list(pnodes)
+    self.signatures = dict((node, extentSignature(trace, node))
+                           for node in watched)
+    self.dirty = set()
+
+  def isValid(self, trace):
+    for node in self.dirty:
+      if extentSignature(trace, node) != self.signatures[node]:
+        return False
+    self.dirty = set()
+    return True
+
+def structureSignature(trace, node):
+  """Everything about the node that constructScaffold looks at, and
+  that can change without the node being replaced."""
+  value = trace.valueAt(node)
+  if isinstance(value, SPRef):
+    procedure = (value.makerNode, type(trace.madeSPAt(value.makerNode)))
+  else:
+    procedure = None
+  return (tuple(trace.childrenAt(node)), tuple(trace.esrParentsAt(node)),
+          trace.numRequestsAt(node), procedure, node.isFrozen)
+
+def extentSignature(trace, node):
+  """Everything about the node that randomChoicesInExtent looks at."""
+  return (structureSignature(trace, node), node in trace.ccs)
+
 def addResamplingNode(trace,drg,absorbing,aaa,q,node,indexAssignments,i,hardBorder):
   if node not in hardBorder:
     if node not in drg or \
@@ -254,8 +434,10 @@ def removeBrush(cDRG,cAbsorbing,cAAA,brush):
   return drg,absorbing,aaa
 
 def hasChildInAorD(trace,drg,absorbing,node):
-  kids = trace.childrenAt(node)
-  return kids.intersection(drg) or kids.intersection(absorbing)
+  for kid in trace.childrenAt(node):
+    if kid in drg or kid in absorbing:
+      return True
+  return False
 
 def findBorder(trace,drg,absorbing,aaa):
   border = absorbing.union(aaa)
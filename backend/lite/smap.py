@@ -15,21 +15,44 @@
 # You should have received a copy of the GNU General Public License
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
+"""Maps from which to sample entries uniformly at random.
+
+A SamplableMap keeps its entries in a contiguous array, so sampling
+one takes constant time, as do insertion and deletion (by moving the
+last entry into the hole).  It also keeps the keys in a sorted index,
+built the first time it is needed and maintained incrementally after
+that, for selecting ranges of keys in order.
+
+A BlockMap is the SamplableMap that a trace keeps for each scope, from
+block ids to the sets of nodes in the blocks.  It additionally keeps
+every (block, node) pair of the scope in one contiguous array, so that
+it can also sample blocks in proportion to their sizes in constant
+time.
+"""
+
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
 from collections import OrderedDict
+import math
+
+from venture.lite.orderedset import OrderedSet
 
 class SamplableMap(object):
   def __init__(self):
-    self.d = OrderedDict()
-    self.a = []
+    self.d = OrderedDict() # key -> index of its entry in a
+    self.a = [] # [(key, value)]
+    self.sorted_keys = None # Sorted list of the keys, once needed
 
   def __getitem__(self,k):
     return self.a[self.d[k]][1]
 
-
   def __setitem__(self,k,v):
     assert k not in self.d
     self.d[k] = len(self.a)
     self.a.append((k,v))
+    if self.sorted_keys is not None:
+      insort(self.sorted_keys, k)
 
   def __delitem__(self,k):
     assert k in self.d
@@ -43,6 +66,16 @@ class SamplableMap(object):
     self.a.pop()
     del self.d[k]
     assert len(self.d) == len(self.a)
+    if self.sorted_keys is not None:
+      self._unsort(k)
+
+  def _unsort(self, k):
+    # Distinct keys may compare equal (e.g., 1 and 1.0), so look for
+    # this one among those
+    i = bisect_left(self.sorted_keys, k)
+    while self.sorted_keys[i] is not k and self.sorted_keys[i] != k:
+      i += 1
+    del self.sorted_keys[i]
 
   def __contains__(self,k): return k in self.d
   def __len__(self): return len(self.a)
@@ -53,10 +86,70 @@ class SamplableMap(object):
   def _as_dict(self):
     return OrderedDict((k, self[k]) for k in self.d)
 
-  def sample(self,py_rng): return py_rng.sample(self.a,1)[0]
+  def sample(self,py_rng):
+    # Chooses the same entry as py_rng.sample(self.a, 1)[0], without
+    # copying the array
+    if not self.a:
+      raise ValueError("Cannot sample from an empty map")
+    return self.a[int(py_rng.random() * len(self.a))]
 
   def keys(self): return self.d.keys()
 
   def values(self): return [v for (_,v) in self.a]
 
   def iteritems(self): return self.a
+
+  def sortedKeys(self, lo=None, hi=None):
+    """The keys in sorted order; if lo and hi are given, only those
+    between them, inclusive."""
+    if self.sorted_keys is None:
+      self.sorted_keys = sorted(self.d.iterkeys())
+    if lo is None:
+      return list(self.sorted_keys)
+    start = bisect_left(self.sorted_keys, lo)
+    end = bisect_right(self.sorted_keys, hi)
+    return self.sorted_keys[start:end]
+
+class BlockMap(SamplableMap):
+  """A SamplableMap from block ids to OrderedSets of nodes.  Add and
+  remove nodes with addNode and removeNode, which create and delete
+  the blocks as needed."""
+
+  def __init__(self):
+    super(BlockMap, self).__init__()
+    self.members = [] # [(block, node)] over all the blocks
+    self.positions = {} # (block, node) -> index in members
+
+  def addNode(self, block, node):
+    if block not in self.d: self[block] = OrderedSet()
+    nodes = self[block]
+    assert node not in nodes
+    nodes.add(node)
+    self.positions[(block, node)] = len(self.members)
+    self.members.append((block, node))
+
+  def removeNode(self, block, node):
+    nodes = self[block]
+    nodes.remove(node)
+    index = self.positions.pop((block, node))
+    last = self.members.pop()
+    if index < len(self.members):
+      self.members[index] = last
+      self.positions[last] = index
+    if len(nodes) == 0: del self[block]
+
+  def numNodes(self): return len(self.members)
+
+  def sampleBySize(self, py_rng):
+    """Sample an entry with probability proportional to the number of
+    nodes in the block."""
+    if not self.members:
+      raise ValueError("Cannot sample from an empty map")
+    (block, _) = self.members[int(py_rng.random() * len(self.members))]
+    return (block, self[block])
+
+  def logDensityBySize(self, block):
+    if block not in self.d:
+      # E.g., the block went away with the proposal that chose it
+      return float("-inf")
+    return math.log(len(self[block])) - math.log(len(self.members))
@@ -16,11 +16,14 @@
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import OrderedDict
+import functools
 
 from venture.lite.exception import VentureError
 from venture.lite.psp import PSP
+from venture.lite.types import NumberType
 from venture.lite.types import VentureType
 from venture.lite.value import VentureNil
+from venture.lite.value import VentureNumber
 from venture.lite.value import VentureValue
 from venture.lite.value import registerVentureType
 import venture.value.dicts as v
@@ -132,6 +135,73 @@ class VentureSPRecord(VentureValue):
 
 registerVentureType(VentureSPRecord)
 
+def _unwrap_number(vthing):
+  # The direct path for the commonest case, bypassing the type object
+  if type(vthing) is VentureNumber:
+    return vthing.number
+  elif vthing is None:
+    return None
+  else:
+    return vthing.getNumber()
+
+def _unwrapper(tp):
+  """A function converting a Venture value of type tp (or None) to
+  Python, equivalent to tp.asPythonNoneable."""
+  if type(tp) is NumberType:
+    return _unwrap_number
+  asPython = tp.asPython
+  def unwrap(vthing):
+    if vthing is None:
+      return None
+    return asPython(vthing)
+  return unwrap
+
+def _wrapper(tp):
+  """A function converting a Python value to a Venture value of type
+  tp, equivalent to tp.asVentureValue."""
+  if type(tp) is NumberType:
+    return VentureNumber
+  return tp.asVentureValue
+
+def _compile_unwrap_arg_list(sp_type):
+  """Specialize SPType.unwrap_arg_list to the signature sp_type: the
+  converter for each argument position is chosen once, here, rather
+  than on every application, and all-number signatures convert by a
+  direct loop over VentureNumbers."""
+  if not sp_type.variadic:
+    min_args = sp_type.min_req_args
+    max_args = len(sp_type.args_types)
+  else:
+    min_args = len(sp_type.args_types) - 1
+    max_args = None
+  def check_arity(lst):
+    if len(lst) < min_args:
+      raise VentureError("Too few arguments: SP requires at least %d args, "
+        "got only %d." % (min_args, len(lst)))
+    if max_args is not None and len(lst) > max_args:
+      raise VentureError("Too many arguments: SP takes at most %d args, "
+        "got %d." % (max_args, len(lst)))
+  if all(type(tp) is NumberType for tp in sp_type.args_types):
+    def unwrap_numbers(lst):
+      check_arity(lst)
+      return [v.number if type(v) is VentureNumber else _unwrap_number(v)
+              for v in lst]
+    return unwrap_numbers
+  unwrappers = [_unwrapper(tp) for tp in sp_type.args_types]
+  if not sp_type.variadic:
+    def unwrap(lst):
+      check_arity(lst)
+      # v could be None when computing log density bounds for a torus
+      return [f(v) for (f, v) in zip(unwrappers, lst)]
+  else:
+    first = unwrappers[:-1]
+    rest = unwrappers[-1]
+    def unwrap(lst):
+      check_arity(lst)
+      return [f(v) for (f, v) in zip(first, lst)] + \
+        [rest(v) for v in lst[min_args:]]
+  return unwrap
+
 class SPType(VentureType):
   """An object representing a Venture function type.  It knows
   the types expected for the arguments and the return, and thus knows
@@ -150,6 +220,13 @@ class SPType(VentureType):
   def __contains__(self, vthing):
     return isinstance(vthing, VentureSPRecord)
 
+  # The marshalling functions specialized to this signature, compiled
+  # on first use (see _compile)
+  _unwrap_list = None
+  _unwrap_args = None
+  _wrap_ret = None
+  _unwrap_ret = None
+
   def __init__(self, args_types, return_type, variadic=False, min_req_args=None):
     """args_types is expected to be a Python list of instances of
     venture.lite.sp.VentureType, and return_type is expected to be one instance
@@ -160,9 +237,24 @@ class SPType(VentureType):
     self.variadic = variadic
     self.min_req_args = len(args_types) if min_req_args is None else min_req_args
 
+  def __getstate__(self):
+    # The compiled functions are closures, which do not pickle
+    state = dict(self.__dict__)
+    for name in ["_unwrap_list", "_unwrap_args", "_wrap_ret", "_unwrap_ret"]:
+      state.pop(name, None)
+    return state
+
+  def _compile(self):
+    from venture.lite.sp_use import RemappingArgs
+    self._unwrap_list = _compile_unwrap_arg_list(self)
+    self._unwrap_args = functools.partial(RemappingArgs, self._unwrap_list)
+    self._wrap_ret = _wrapper(self.return_type)
+    self._unwrap_ret = _unwrapper(self.return_type)
+
   def wrap_return(self, value):
+    if self._wrap_ret is None: self._compile()
     try:
-      return self.return_type.asVentureValue(value)
+      return self._wrap_ret(value)
     except VentureError as e:
       e.message = "Wrong return type: " + e.message
       raise e
@@ -172,13 +264,12 @@ class SPType(VentureType):
     # by e.g. pgibbs, to actually be a simulation kernel; also when
     # computing log density bounds over a torus for rejection
     # sampling.
-    return self.return_type.asPythonNoneable(value)
+    if self._unwrap_ret is None: self._compile()
+    return self._unwrap_ret(value)
 
   def unwrap_args(self, args):
-    from venture.lite.sp_use import RemappingArgs
-    def remap(values):
-      return self.unwrap_arg_list(values)
-    return RemappingArgs(remap, args)
+    if self._unwrap_args is None: self._compile()
+    return self._unwrap_args(args)
 
   def args_match(self, args):
     vals = args.operandValues()
@@ -197,26 +288,8 @@ class SPType(VentureType):
       return first_args and rest_args
 
   def unwrap_arg_list(self, lst):
-    if not self.variadic:
-      if len(lst) < self.min_req_args:
-        raise VentureError("Too few arguments: SP requires at least %d args, "
-          "got only %d." % (self.min_req_args, len(lst)))
-      if len(lst) > len(self.args_types):
-        raise VentureError("Too many arguments: SP takes at most %d args, "
-          "got %d." % (len(self.args_types), len(lst)))
-      # v could be None when computing log density bounds for a torus
-      return [self.args_types[i].asPythonNoneable(val) for (i,val)
-          in enumerate(lst)]
-    else:
-      min_req_args = len(self.args_types) - 1
-      if len(lst) < min_req_args:
-        raise VentureError("Too few arguments: SP requires at least %d args, "
-          "got only %d." % (min_req_args, len(lst)))
-      first_args = [self.args_types[i].asPythonNoneable(val) for (i,val) in
-          enumerate(lst[:min_req_args])]
-      rest_args = [self.args_types[-1].asPythonNoneable(val) for val in
-          lst[min_req_args:]]
-      return first_args + rest_args
+    if self._unwrap_list is None: self._compile()
+    return self._unwrap_list(lst)
 
   def wrap_arg_list(self, lst):
     if not self.variadic:
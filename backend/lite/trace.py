@@ -34,16 +34,20 @@ from venture.lite.env import VentureEnvironment
 from venture.lite.exception import VentureError
 from venture.lite.infer import BlockScaffoldIndexer
 from venture.lite.lkernel import DeterministicLKernel
+from venture.lite.node import BuiltinNode
 from venture.lite.node import ConstantNode
 from venture.lite.node import LookupNode
 from venture.lite.node import OutputNode
 from venture.lite.node import RequestNode
+from venture.lite.node import isBuiltinNode
 from venture.lite.node import isConstantNode
 from venture.lite.node import isLookupNode
 from venture.lite.node import isOutputNode
 from venture.lite.node import TraceNodeArgs
 from venture.lite.omegadb import OmegaDB
 from venture.lite.orderedset import OrderedSet
+from venture.lite.peek import PeekUnsupported
+from venture.lite.peek import peek
 from venture.lite.psp import ESRRefOutputPSP
 from venture.lite.regen import constrain
 from venture.lite.regen import evalFamily
@@ -51,10 +55,12 @@ from venture.lite.regen import processMadeSP
 from venture.lite.regen import regenAndAttach
 from venture.lite.regen import restore
 from venture.lite.scaffold import Scaffold
+from venture.lite.scaffold import ScaffoldCache
 from venture.lite.scaffold import constructScaffold
 from venture.lite.scope import isTagExcludeOutputPSP
 from venture.lite.scope import isTagOutputPSP
 from venture.lite.serialize import OrderedOmegaDB
+from venture.lite.smap import BlockMap
 from venture.lite.smap import SamplableMap
 from venture.lite.sp import SPFamilies
 from venture.lite.sp import VentureSPRecord
@@ -66,15 +72,36 @@ from venture.lite.value import VentureValue
 import venture.lite.address as addr
 import venture.lite.infer as infer
 
-class Trace(object):
-  def __init__(self, seed):
+_builtin_frame = None
 
-    self.globalEnv = VentureEnvironment()
+def builtInFrame():
+  """The environment frame binding the builtin values and procedures,
+  made once per process and shared by all Lite traces."""
+  global _builtin_frame
+  if _builtin_frame is None:
+    frame = VentureEnvironment()
     for name, val in builtInValues().iteritems():
-      self.bindPrimitiveName(name, val)
+      frame.addBinding(name, BuiltinNode(addr.builtin_address(name), val))
     for name, sp in builtInSPsIter():
-      self.bindPrimitiveSP(name, sp)
-    self.sealEnvironment() # New frame so users can shadow globals
+      frame.addBinding(name, BuiltinNode(addr.builtin_address(name), None, sp))
+    _builtin_frame = frame
+  return _builtin_frame
+
+class Trace(object):
+  # Particles do not run __init__, and never cache scaffolds, keep
+  # HMC adaptation state, or have stale subsampled MH sections.
+  scaffold_cache = None
+  hmc_adaptations = None
+  stale_sections = None
+  # Set while evaluating a new directive, whose lookups and requests
+  # read existing values that may be in stale sections
+  refreshing_reads = False
+
+  def __init__(self, seed):
+
+    # New frame so users can shadow globals
+    self.globalEnv = VentureEnvironment(builtInFrame())
+    self.builtin_sp_records = {} # BuiltinNode -> VentureSPRecord
 
     self.rcs = OrderedSet()
     self.ccs = OrderedSet()
@@ -85,6 +112,11 @@ class Trace(object):
 
     self.profiling_enabled = False
     self.stats = []
+    self.scaffold_cache = None
+    # (scope, block, steps) -> HMCAdaptation
+    self.hmc_adaptations = {}
+    # Created by subsampled MH once it leaves anything stale
+    self.stale_sections = None
 
     assert seed is not None
     rng = random.Random(seed)
@@ -120,10 +152,8 @@ class Trace(object):
 
   def registerRandomChoiceInScope(self, scope, block, node, unboxed=False):
     if not unboxed: (scope, block) = self._normalizeEvaluatedScopeAndBlock(scope, block)
-    if scope not in self.scopes: self.scopes[scope] = SamplableMap()
-    if block not in self.scopes[scope]: self.scopes[scope][block] = OrderedSet()
-    assert node not in self.scopes[scope][block]
-    self.scopes[scope][block].add(node)
+    if scope not in self.scopes: self.scopes[scope] = BlockMap()
+    self.scopes[scope].addNode(block, node)
     assert scope != "default" or len(self.scopes[scope][block]) == 1
 
   def unregisterRandomChoice(self, node):
@@ -133,15 +163,14 @@ class Trace(object):
 
   def unregisterRandomChoiceInScope(self, scope, block, node):
     (scope, block) = self._normalizeEvaluatedScopeAndBlock(scope, block)
-    self.scopes[scope][block].remove(node)
+    self.scopes[scope].removeNode(block, node)
     if scope == "default":
-      assert len(self.scopes[scope][block]) == 0
-    if len(self.scopes[scope][block]) == 0: del self.scopes[scope][block]
+      assert block not in self.scopes[scope]
     if len(self.scopes[scope]) == 0 and (scope != "default"): del self.scopes[scope]
 
   def _normalizeEvaluatedScopeOrBlock(self, val):
     if isinstance(val, VentureSymbol):
-      if val.getSymbol() in ["default", "none", "one", "all", "each", "each_reverse", "ordered"]:
+      if val.getSymbol() in ["default", "none", "one", "one_by_size", "all", "each", "each_reverse", "ordered"]:
         return val.getSymbol()
     elif isinstance(val, VenturePair):
       if isinstance(val.first, VentureSymbol) and \
@@ -172,14 +201,19 @@ class Trace(object):
       raise VentureException("evaluation", "Cannot constrain the same random choice twice.", address = node.address)
     self.ccs.add(node)
     self.unregisterRandomChoice(node)
+    # Constrained choices drop out of dynamic extents
+    self.noteStructureChangeAt(node)
 
   def unregisterConstrainedChoice(self, node):
     assert node in self.ccs
     self.ccs.remove(node)
     if self.pspAt(node).isRandom(): self.registerRandomChoice(node)
+    self.noteStructureChangeAt(node)
 
   def createConstantNode(self, address, val): return ConstantNode(address, val)
   def createLookupNode(self, address, sourceNode):
+    if self.refreshing_reads:
+      self.refreshStaleSections([sourceNode])
     lookupNode = LookupNode(address, sourceNode)
     self.setValueAt(lookupNode, self.valueAt(sourceNode))
     self.addChildAt(sourceNode, lookupNode)
@@ -197,6 +231,8 @@ class Trace(object):
     return (requestNode, outputNode)
 
   def addESREdge(self, esrParent, outputNode):
+    if self.refreshing_reads:
+      self.refreshStaleSections([esrParent])
     self.incRequestsAt(esrParent)
     self.addChildAt(esrParent, outputNode)
     self.appendEsrParentAt(outputNode, esrParent)
@@ -244,16 +280,34 @@ class Trace(object):
   def setValueAt(self, node, value):
     assert node.isAppropriateValue(value)
     node.value = value
+    if self.scaffold_cache is not None and isinstance(value, SPRef):
+      # May change which procedure the node's applications apply
+      self.scaffold_cache.noteStructureChange(node)
 
   def hasMadeSPRecordAt(self, node):
-    return node.madeSPRecord is not None
+    return node.madeSPRecord is not None or \
+      (isBuiltinNode(node) and node.sp is not None)
 
   def madeSPRecordAt(self, node):
-    assert node.madeSPRecord is not None
-    return node.madeSPRecord
+    record = node.madeSPRecord
+    if record is None:
+      record = self.builtinSPRecordAt(node)
+    return record
+
+  def builtinSPRecordAt(self, node):
+    """This trace's record of the builtin procedure at node, made on
+    first use."""
+    record = self.builtin_sp_records.get(node)
+    if record is None:
+      assert isBuiltinNode(node) and node.sp is not None
+      record = VentureSPRecord(node.sp)
+      if node.sp.hasAEKernel(): self.registerAEKernel(node)
+      self.builtin_sp_records[node] = record
+    return record
 
   def setMadeSPRecordAt(self, node, spRecord):
     node.madeSPRecord = spRecord
+    self.noteStructureChangeAt(node)
 
   def madeSPAt(self, node): return self.madeSPRecordAt(node).sp
   def setMadeSPAt(self, node, sp):
@@ -279,15 +333,30 @@ class Trace(object):
   def parentsAt(self, node): return node.parents()
   def definiteParentsAt(self, node): return node.definiteParents()
 
-  def esrParentsAt(self, node): return node.esrParents
-  def setEsrParentsAt(self, node, parents): node.esrParents = parents
-  def appendEsrParentAt(self, node, parent): node.esrParents.append(parent)
-  def popEsrParentAt(self, node): return node.esrParents.pop()
+  def esrParentsAt(self, node): return node.esrParents or []
+  def setEsrParentsAt(self, node, parents):
+    node.esrParents = parents
+    self.noteStructureChangeAt(node)
+  def appendEsrParentAt(self, node, parent):
+    if node.esrParents:
+      node.esrParents.append(parent)
+    else:
+      node.esrParents = [parent]
+    self.noteStructureChangeAt(node)
+  def popEsrParentAt(self, node):
+    self.noteStructureChangeAt(node)
+    return node.esrParents.pop()
 
   def childrenAt(self, node): return node.children
-  def setChildrenAt(self, node, children): node.children = children
-  def addChildAt(self, node, child): node.children.add(child)
-  def removeChildAt(self, node, child): node.children.remove(child)
+  def setChildrenAt(self, node, children):
+    node.children = children
+    self.noteStructureChangeAt(node)
+  def addChildAt(self, node, child):
+    node.addChild(child)
+    self.noteStructureChangeAt(node)
+  def removeChildAt(self, node, child):
+    node.removeChild(child)
+    self.noteStructureChangeAt(node)
 
   def registerFamilyAt(self, node, esrId, esrParent): self.spFamiliesAt(node).registerFamily(esrId, esrParent)
   def unregisterFamilyAt(self, node, esrId): self.spFamiliesAt(node).unregisterFamily(esrId)
@@ -299,9 +368,19 @@ class Trace(object):
   def clearMadeSPFamiliesAt(self, node): self.setMadeSPFamiliesAt(node, None)
 
   def numRequestsAt(self, node): return node.numRequests
-  def setNumRequestsAt(self, node, num): node.numRequests = num
-  def incRequestsAt(self, node): node.numRequests += 1
-  def decRequestsAt(self, node): node.numRequests -= 1
+  def setNumRequestsAt(self, node, num):
+    node.numRequests = num
+    self.noteStructureChangeAt(node)
+  def incRequestsAt(self, node):
+    node.numRequests += 1
+    self.noteStructureChangeAt(node)
+  def decRequestsAt(self, node):
+    node.numRequests -= 1
+    self.noteStructureChangeAt(node)
+
+  def noteStructureChangeAt(self, node):
+    if self.scaffold_cache is not None:
+      self.scaffold_cache.noteStructureChange(node)
 
   def regenCountAt(self, scaffold, node): return scaffold.regenCounts[node]
   def incRegenCountAt(self, scaffold, node): scaffold.regenCounts[node] += 1
@@ -315,12 +394,16 @@ class Trace(object):
     if scope in self.scopes:
       return self.scopes[scope]
     else:
-      return SamplableMap()
+      return BlockMap()
 
   def sampleBlock(self, scope): return self.getScope(scope).sample(self.py_rng)[0]
   def logDensityOfBlock(self, scope): return -1 * math.log(self.numBlocksInScope(scope))
+  def sampleBlockBySize(self, scope):
+    return self.getScope(scope).sampleBySize(self.py_rng)[0]
+  def logDensityOfBlockBySize(self, scope, block):
+    return self.getScope(scope).logDensityBySize(block)
   def blocksInScope(self, scope): return self.getScope(scope).keys()
-  def numBlocksInScope(self, scope): return len(self.getScope(scope).keys())
+  def numBlocksInScope(self, scope): return len(self.getScope(scope))
 
   def getAllNodesInScope(self, scope):
     blocks = [self.getNodesInBlock(scope, block) for block in self.getScope(scope).keys()]
@@ -331,10 +414,10 @@ class Trace(object):
 
   def getOrderedSetsInScope(self, scope, interval=None):
     if interval is None:
-      return [self.getNodesInBlock(scope, block) for block in sorted(self.getScope(scope).keys())]
+      blocks = self.getScope(scope).sortedKeys()
     else:
-      blocks = [b for b in self.getScope(scope).keys() if b >= interval[0] if b <= interval[1]]
-      return [self.getNodesInBlock(scope, block) for block in sorted(blocks)]
+      blocks = self.getScope(scope).sortedKeys(interval[0], interval[1])
+    return [self.getNodesInBlock(scope, block) for block in blocks]
 
   def numNodesInBlock(self, scope, block): return len(self.getNodesInBlock(scope, block, do_copy=False))
 
@@ -352,15 +435,19 @@ class Trace(object):
     else:
       return self.randomChoicesInExtent(nodes, scope, block)
 
-  def randomChoicesInExtent(self, nodes, scope, block):
+  def randomChoicesInExtent(self, nodes, scope, block, visited=None):
     # The scope and block, if present, limit the computed dynamic
     # extent to everything that is not explicitly excluded from them.
+    # If given, visited collects every node the walk looked at.
     pnodes = OrderedSet()
-    for node in nodes: self.addRandomChoicesInExtent(node, scope, block, pnodes)
+    for node in nodes:
+      self.addRandomChoicesInExtent(node, scope, block, pnodes, visited)
     return pnodes
 
-  def addRandomChoicesInExtent(self, node, scope, block, pnodes):
+  def addRandomChoicesInExtent(self, node, scope, block, pnodes, visited=None):
+    if visited is not None: visited.add(node)
     if not isOutputNode(node): return
+    if visited is not None: visited.add(node.requestNode)
 
     if self.pspAt(node).isRandom() and node not in self.ccs: pnodes.add(node)
 
@@ -368,21 +455,21 @@ class Trace(object):
     if self.pspAt(requestNode).isRandom() and requestNode not in self.ccs: pnodes.add(requestNode)
 
     for esr in self.valueAt(node.requestNode).esrs:
-      self.addRandomChoicesInExtent(self.spFamilyAt(requestNode, esr.id), scope, block, pnodes)
+      self.addRandomChoicesInExtent(self.spFamilyAt(requestNode, esr.id), scope, block, pnodes, visited)
 
-    self.addRandomChoicesInExtent(node.operatorNode, scope, block, pnodes)
+    self.addRandomChoicesInExtent(node.operatorNode, scope, block, pnodes, visited)
 
     for i, operandNode in enumerate(node.operandNodes):
       if i == 2 and isTagOutputPSP(self.pspAt(node)):
         (new_scope, new_block, _) = [self.valueAt(randNode) for randNode in node.operandNodes]
         (new_scope, new_block) = self._normalizeEvaluatedScopeAndBlock(new_scope, new_block)
-        if scope != new_scope or block == new_block: self.addRandomChoicesInExtent(operandNode, scope, block, pnodes)
+        if scope != new_scope or block == new_block: self.addRandomChoicesInExtent(operandNode, scope, block, pnodes, visited)
       elif i == 1 and isTagExcludeOutputPSP(self.pspAt(node)):
         (excluded_scope, _) = [self.valueAt(randNode) for randNode in node.operandNodes]
         excluded_scope = self._normalizeEvaluatedScope(excluded_scope)
-        if scope != excluded_scope: self.addRandomChoicesInExtent(operandNode, scope, block, pnodes)
+        if scope != excluded_scope: self.addRandomChoicesInExtent(operandNode, scope, block, pnodes, visited)
       else:
-        self.addRandomChoicesInExtent(operandNode, scope, block, pnodes)
+        self.addRandomChoicesInExtent(operandNode, scope, block, pnodes, visited)
 
 
   def scopeHasEntropy(self, scope):
@@ -396,9 +483,13 @@ class Trace(object):
   #### External interface to engine.py
   def eval(self, id, exp):
     assert id not in self.families
-    (_, self.families[id]) = evalFamily(
-      self, addr.directive_address(id), self.unboxExpression(exp), self.globalEnv,
-      Scaffold(), False, OmegaDB(), OrderedDict())
+    self.refreshing_reads = True
+    try:
+      (_, self.families[id]) = evalFamily(
+        self, addr.directive_address(id), self.unboxExpression(exp), self.globalEnv,
+        Scaffold(), False, OmegaDB(), OrderedDict())
+    finally:
+      self.refreshing_reads = False
 
   def bindInGlobalEnv(self, sym, id):
     try:
@@ -411,9 +502,37 @@ class Trace(object):
 
   def boundInGlobalEnv(self, sym): return self.globalEnv.symbolBound(sym)
 
-  def extractValue(self, id): return self.boxValue(self.valueAt(self.families[id]))
+  def peek(self, id, exp):
+    """The value exp would have as the directive id, computed without
+    changing the trace, or None if that is not possible."""
+    try:
+      value = peek(self, addr.directive_address(id), self.unboxExpression(exp),
+                   self.globalEnv)
+    except PeekUnsupported:
+      return None
+    return self.boxValue(value)
+
+  def extractValue(self, id): return self.boxValue(self.extractRaw(id))
+
+  def extractRaw(self, id):
+    node = self.families[id]
+    self.refreshStaleSections([node])
+    return self.valueAt(node)
+
+  def refreshStaleSections(self, nodes=None):
+    """Bring up to date the local sections left stale by subsampled MH
+    that any of the given nodes is in or depends on, or all of them."""
+    if self.stale_sections is not None:
+      if nodes is None:
+        self.stale_sections.refreshAll(self)
+      else:
+        self.stale_sections.refreshAbove(self, nodes)
 
-  def extractRaw(self, id): return self.valueAt(self.families[id])
+  def refreshStaleSectionsResampledBy(self, scaffold):
+    """Bring up to date the local sections left stale by subsampled MH
+    under any global border the scaffold resamples."""
+    if self.stale_sections is not None:
+      self.stale_sections.refreshResampled(self, scaffold)
 
   def observe(self, id, val):
     node = self.families[id]
@@ -424,6 +543,13 @@ class Trace(object):
     for node, val in self.unpropagatedObservations.iteritems():
       appNode = self.getConstrainableNode(node)
 #      print "PROPAGATE", node, appNode
+      if not self.childrenAt(appNode):
+        # The scaffold would be just appNode, whose regeneration
+        # under the deterministic kernel is what constrain does
+        # anyway.  Fresh observations usually look like this.
+        node.observe(val)
+        weight += constrain(self, appNode, node.observedValue)
+        continue
       scaffold = constructScaffold(self, [OrderedSet([appNode])])
       rhoWeight, _ = detachAndExtract(self, scaffold)
       scaffold.lkernels[appNode] = DeterministicLKernel(self.pspAt(appNode), val)
@@ -544,6 +670,7 @@ class Trace(object):
       # so we fake it by dropping the components and marking it frozen.
       node.isFrozen = True
       self.setValueAt(node, value)
+      self.noteStructureChangeAt(node)
       node.requestNode = None
       node.operandNodes = None
       node.operatorNode = None
@@ -694,9 +821,13 @@ the scaffold determined by the given expression."""
 
   def evalAndRestore(self, id, exp, db):
     assert id not in self.families
-    (_, self.families[id]) = evalFamily(
-      self, addr.directive_address(id), self.unboxExpression(exp), self.globalEnv,
-      Scaffold(), True, db, OrderedDict())
+    self.refreshing_reads = True
+    try:
+      (_, self.families[id]) = evalFamily(
+        self, addr.directive_address(id), self.unboxExpression(exp), self.globalEnv,
+        Scaffold(), True, db, OrderedDict())
+    finally:
+      self.refreshing_reads = False
 
   def has_own_prng(self): return True
   def set_seed(self, seed):
@@ -719,11 +850,12 @@ the scaffold determined by the given expression."""
 
   def addNewMadeSPFamilies(self, node, newMadeSPFamilies):
     for id, root in newMadeSPFamilies.iteritems():
-      node.madeSPRecord.spFamilies.registerFamily(id, root)
+      self.madeSPFamiliesAt(node).registerFamily(id, root)
 
   def addNewChildren(self, node, newChildren):
     for child in newChildren:
-      node.children.add(child)
+      node.addChild(child)
+    self.noteStructureChangeAt(node)
 
   #### Configuration
 
@@ -732,3 +864,16 @@ the scaffold determined by the given expression."""
 
   def clear_profiling(self):
     self.stats = []
+
+  def set_scaffold_cache(self, enabled=True):
+    """Turn on (or off, discarding it) memoization of the scaffolds
+    that block-selecting inference kernels construct."""
+    if not enabled:
+      self.scaffold_cache = None
+    elif self.scaffold_cache is None:
+      self.scaffold_cache = ScaffoldCache()
+
+  def scaffold_cache_stats(self):
+    if self.scaffold_cache is None:
+      return None
+    return self.scaffold_cache.stats()
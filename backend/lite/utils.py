@@ -51,7 +51,9 @@ def np_seterr(**kwargs):
 
 def ensure_python_float(thing):
   """Return the given object as a Python float, or raise an exception."""
-  if isinstance(thing, Number) or (isinstance(thing, np.ndarray) and thing.size == 1):
+  if type(thing) is float:
+    return thing # The common case, without the abstract isinstance check
+  elif isinstance(thing, Number) or (isinstance(thing, np.ndarray) and thing.size == 1):
     return float(thing)
   else:
     raise VentureTypeError(
@@ -179,6 +181,66 @@ def sampleLogCategorical(logs, np_rng, os=None):
     # impossible.
     return simulateCategorical([0 for _ in logs], np_rng, os=os)
 
+RESAMPLING_SCHEMES = ["multinomial", "systematic", "stratified", "residual"]
+
+def resampleLogCategorical(logs, n, np_rng, scheme="multinomial"):
+  """Draw n indices into an unnormalized categorical distribution
+  given in logspace, each distributed in proportion to its weight.
+
+  The multinomial scheme draws them independently.  The others draw
+  fewer copies of each index at random, which lowers the variance of
+  the resampled particle set: the systematic scheme inverts the CDF
+  at n evenly spaced points with one uniform offset (so each index
+  gets within one of its expected number of copies, n times its
+  probability), the stratified scheme draws one point per stratum of
+  [0, 1), and the residual scheme takes the integer part of the
+  expected number deterministically and draws the rest
+  multinomially.  Those three produce their indices in a systematic
+  order, so they shuffle them, so that each position (in particular
+  the first, which becomes the distinguished particle) is itself
+  distributed in proportion to the weights.  All take O(n +
+  len(logs) log n) time."""
+  if scheme not in RESAMPLING_SCHEMES:
+    raise ValueError("Unknown resampling scheme %r, expected one of %s" %
+                     (scheme, RESAMPLING_SCHEMES))
+  ps = np.array(logWeightsToNormalizedDirect(logs))
+  if not ps.any():
+    # Treat all impossible options as equally impossible.
+    ps = np.ones(len(logs)) / len(logs)
+  if scheme == "residual":
+    expected = ps * n
+    copies = np.floor(expected).astype(int)
+    rest = n - copies.sum()
+    ans = np.repeat(np.arange(len(ps)), copies)
+    if rest > 0:
+      residuals = (expected - copies) / rest
+      ans = np.concatenate([ans, _invert_cdf(residuals, np_rng.uniform(size=rest))])
+    return np_rng.permutation(ans).tolist()
+  if scheme == "multinomial":
+    us = np_rng.uniform(size=n)
+    return _invert_cdf(ps, us).tolist()
+  elif scheme == "systematic":
+    us = (np_rng.uniform() + np.arange(n)) / n
+  else:
+    us = (np_rng.uniform(size=n) + np.arange(n)) / n
+  return np_rng.permutation(_invert_cdf(ps, us)).tolist()
+
+def _invert_cdf(ps, us):
+  cdf = np.cumsum(ps)
+  cdf /= cdf[-1]
+  return np.minimum(np.searchsorted(cdf, us, side="right"), len(ps) - 1)
+
+def effectiveSampleSize(logs):
+  """The effective sample size of particles with the given log weights:
+  the number of equally weighted particles whose estimates would have
+  the same variance."""
+  ps = logWeightsToNormalizedDirect(logs)
+  total = sum(p * p for p in ps)
+  if total == 0:
+    # All the particles are impossible, hence alike
+    return len(ps)
+  return 1.0 / total
+
 def logDensityLogCategorical(val,log_ps,os=None):
   if os is None: os = range(len(log_ps))
   return logsumexp([log_pi for (log_pi, oi) in zip(log_ps, os) if oi == val]) - logsumexp(log_ps)
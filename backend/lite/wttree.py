@@ -41,20 +41,43 @@ def identity(x):
   return x
 
 class EmptyNode(object): #pylint: disable=W0232
+  __slots__ = ()
   def size(self): return 0
   def isEmpty(self): return True
 
+  # No state, but pickled alike with Node (see there); an unpickled
+  # empty tree is equivalent to the shared one.
+  def __getstate__(self): return ()
+  def __setstate__(self, _state): pass
+
+# Empty trees are all alike, so share one
+_EMPTY = EmptyNode()
+
 class Node(object):
+  __slots__ = ('left', 'key', 'value', 'right', 'ct', 'total')
   def __init__(self, left, key, value, right):
     self.left = left
     self.key = key
     self.value = value
     self.right = right
     self.ct = left.size() + right.size() + 1
+    # Sum of the values in the subtree, computed on demand by
+    # node_total; only meaningful for maps with numeric values.
+    self.total = None
 
   def size(self): return self.ct
   def isEmpty(self): return False
 
+  # Classes with __slots__ pickle under protocols 0 and 1 only with
+  # these
+  def __getstate__(self):
+    return (self.left, self.key, self.value, self.right, self.ct,
+            self.total)
+
+  def __setstate__(self, state):
+    (self.left, self.key, self.value, self.right, self.ct,
+     self.total) = state
+
 # TODO Manually inline this?
 def node_weight(node):
   return node.size() + 1
@@ -124,7 +147,7 @@ def node_lookup(node, key_, keyfn):
 
 def node_insert(node, key, key_, keyfn, value):
   if node.isEmpty():
-    return Node(EmptyNode(), key, value, EmptyNode())
+    return Node(_EMPTY, key, value, _EMPTY)
   node_key_ = keyfn(node.key)
   if key_ < node_key_:
     return t_join(node_insert(node.left, key, key_, keyfn, value),
@@ -170,6 +193,29 @@ def node_delete(node, key_, keyfn):
       [min_r_k, min_r_v, new_r] = node_popmin(node.right)
       return t_join(node.left, min_r_k, min_r_v, new_r)
 
+def node_total(node):
+  # Nodes are immutable, so the sum is cached; a tree that shares
+  # structure with one whose sums are known only sums its new path.
+  if node.isEmpty():
+    return 0
+  if node.total is None:
+    node.total = node_total(node.left) + node.value + node_total(node.right)
+  return node.total
+
+def node_key_at_weight(node, x, discount):
+  while True:
+    left = node.left
+    left_w = node_total(left) - discount * left.size()
+    if x < left_w:
+      node = left
+      continue
+    x -= left_w
+    w = node.value - discount
+    if x < w or node.right.isEmpty():
+      return node.key
+    x -= w
+    node = node.right
+
 def node_traverse_in_order(node):
   if not node.isEmpty():
     for pair in node_traverse_in_order(node.left): yield pair
@@ -191,7 +237,7 @@ class PMap(object):
     if keyfn is None:
       keyfn = identity
     self._keyfn = keyfn
-    self.root = root if root is not None else EmptyNode()
+    self.root = root if root is not None else _EMPTY
   def lookup(self, key):
     keyfn = self._keyfn
     return node_lookup(self.root, keyfn(key), keyfn)
@@ -216,6 +262,20 @@ class PMap(object):
     keyfn = self._keyfn
     return PMap(keyfn, node_delete(self.root, keyfn(key), keyfn))
 
+  def total(self):
+    """Sum of the values, which must be numbers.
+
+    Amortized O(log n) after an insert, adjust, or delete."""
+    return node_total(self.root)
+  def keyAtWeight(self, x, discount=0):
+    """Return the key whose interval contains x, laying the entries
+    out in key order as intervals of length value - discount.
+
+    For sampling a key with probability proportional to its value
+    minus discount, in O(log n): pass x drawn uniformly from
+    [0, total() - discount * len(self)).  Must not be empty."""
+    return node_key_at_weight(self.root, x, discount)
+
   def __len__(self): return self.root.size()
   def __iter__(self):
     return node_traverse_keys_in_order(self.root)
@@ -232,7 +292,7 @@ class PSet(object):
     if keyfn is None:
       keyfn = identity
     self._keyfn = keyfn
-    self.root = root if root is not None else EmptyNode()
+    self.root = root if root is not None else _EMPTY
   def __contains__(self, key):
     keyfn = self._keyfn
     return node_lookup(self.root, keyfn(key), keyfn) is not None
@@ -135,6 +135,11 @@ class Trace(object):
 
   def clear_profiling(self): pass
 
+  def set_scaffold_cache(self, _enabled):
+    pass # Puma does not cache scaffolds
+
+  def scaffold_cache_stats(self): return None
+
 def _unwrapVentureValue(val):
   if isinstance(val, VentureValue):
     return val.asStackDict(None)["value"]
@@ -16,16 +16,25 @@
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
 import random
+import sys
+import weakref
+
 import numpy.random as npr
 
 from venture.exception import VentureException
 from venture.lite import exp as e
+from venture.lite import types as t
 from venture.lite import value as vv
+from venture.lite.csp import CSPRequestPSP
+from venture.lite.env import VentureEnvironment
 from venture.lite.exception import VentureError
 from venture.lite.exception import VentureNestedRiplMethodError
+from venture.lite.psp import ESRRefOutputPSP
 from venture.lite.psp import IArgs
 from venture.lite.psp import PSP
+from venture.lite.sp import SP
 from venture.lite.sp import VentureSPRecord
+from venture.lite.sp_registry import builtInSPs
 import venture.lite.address as addr
 import venture.untraced.node as node
 
@@ -76,6 +85,10 @@ def apply(address, nodes, env, rng):
   spr = nodes[0].value
   if not isinstance(spr, VentureSPRecord):
     raise VentureException("evaluation", "Cannot apply a non-procedure", address=address)
+  if _compiled_bodies and type(spr.sp.requestPSP) is CSPRequestPSP: # pylint:disable=unidiomatic-typecheck
+    code = _compiled_bodies.get(spr.sp.requestPSP)
+    if code is not None:
+      return applyCompiledCSP(address, spr.sp.requestPSP, code, nodes[1:], rng)
   req_args = RequestArgs(address, nodes[1:], env, rng.randint(1, 2**31 - 1))
   requests = applyPSP(spr.sp.requestPSP, req_args)
   req_nodes = [evalRequest(req_args, spr, r, rng) for r in requests.esrs]
@@ -155,3 +168,141 @@ def nonRepeatableRequestID(req_args, id):
   # Conservatively detect patterns or request ids indicating intention
   # not to collide, so they do not need to be stored.
   return id == req_args.node or (isinstance(id, tuple) and id[0] == req_args.node)
+
+## Compilation
+
+# A desugared expression can instead be compiled, once, into nested
+# Python closures of (address, env, rng), which evaluate it exactly as
+# eval would, consuming the same random numbers, but without
+# re-dispatching on the syntax, re-normalizing constants, or searching
+# the environment for variables bound by enclosing lambdas: those are
+# resolved at compile time to a frame depth.
+#
+# Lambdas in compiled code make ordinary compound procedures, whose
+# compiled bodies are kept in _compiled_bodies.  Applying such a
+# procedure, from compiled or interpreted code, skips building the
+# request and evaluates the body directly.  A compound procedure made
+# by interpreted code has its body compiled the first time compiled
+# code applies it.
+
+# CSPRequestPSP -> compiled body
+_compiled_bodies = weakref.WeakKeyDictionary()
+
+def compile(exp, scope=()): # pylint:disable=redefined-builtin
+  """Compile exp, to be evaluated in an environment whose innermost
+  frames bind the names in scope (a tuple of tuples of names,
+  innermost first), into a function of (address, env, rng)."""
+  try:
+    if e.isVariable(exp):
+      return _compile_variable(exp, scope)
+    elif e.isSelfEvaluating(exp):
+      return _compile_constant(node.normalize(exp))
+    elif e.isQuotation(exp):
+      return _compile_constant(node.normalize(e.textOfQuotation(exp)))
+    elif e.isLambda(exp):
+      return _compile_lambda(exp, scope)
+    else:
+      return _compile_application(exp, scope)
+  except Exception: # pylint:disable=broad-except
+    # Malformed; leave it to eval to complain if it is ever evaluated
+    return lambda address, env, rng: eval(address, exp, env, rng)
+
+def _compile_constant(value):
+  return lambda _address, _env, _rng: value
+
+def _compile_variable(sym, scope):
+  for (depth, frame) in enumerate(scope):
+    if sym in frame:
+      if depth == 0:
+        return lambda _address, env, _rng: env.frame[sym].value
+      def lookup(_address, env, _rng):
+        for _ in xrange(depth):
+          env = env.outerEnv
+        return env.frame[sym].value
+      return lookup
+  skip = len(scope)
+  def lookup_free(address, env, _rng):
+    for _ in xrange(skip):
+      env = env.outerEnv
+    try:
+      return env.findSymbol(sym).value
+    except VentureError as err:
+      info = sys.exc_info()
+      raise VentureException("evaluation", err.message, address=address), \
+        None, info[2]
+  return lookup_free
+
+def _compile_application(exp, scope):
+  codes = [compile(subexp, scope) for subexp in exp]
+  def application(address, env, rng):
+    nodes = []
+    for (index, code) in enumerate(codes):
+      addr2 = addr.extend(address, index)
+      nodes.append(node.Node(addr2, code(addr2, env, rng)))
+    try:
+      return _apply_compiled(address, nodes, env, rng)
+    except VentureNestedRiplMethodError as err:
+      # See the corresponding clause in eval
+      info = sys.exc_info()
+      raise VentureException("evaluation", err.message, address=err.addr, cause=err), None, info[2]
+    except VentureException:
+      raise # Avoid rewrapping with the below
+    except Exception as err:
+      info = sys.exc_info()
+      raise VentureException("evaluation", err.message, address=address, cause=err), None, info[2]
+  return application
+
+def _compile_lambda(exp, scope):
+  assert len(exp) == 3
+  ids = t.HomogeneousArrayType(t.SymbolType()).asPython(
+    node.normalize(e.textOfQuotation(exp[1])))
+  body = t.ExpressionType().asPython(node.normalize(e.textOfQuotation(exp[2])))
+  body_code = compile(body, (tuple(ids),) + scope)
+  generic = _compile_application(exp, scope)
+  operator = _compile_variable(exp[0], scope)
+  make_csp = _make_csp_sp()
+  def make_lambda(address, env, rng):
+    spr = operator(addr.extend(address, 0), env, rng)
+    if not isinstance(spr, VentureSPRecord) or spr.sp is not make_csp:
+      return generic(address, env, rng) # make_csp is shadowed
+    # Draw the seeds apply would, to stay in step with eval
+    rng.randint(1, 2**31 - 1)
+    rng.randint(1, 2**31 - 1)
+    # As in venture.lite.csp.MakeCSPOutputPSP
+    source_loc = addr.append(addr.top_frame(addr.extend(address, 2)), 1)
+    psp = CSPRequestPSP(ids, body, source_loc, env)
+    _compiled_bodies[psp] = body_code
+    return VentureSPRecord(SP(psp, ESRRefOutputPSP()))
+  return make_lambda
+
+_the_make_csp_sp = None
+
+def _make_csp_sp():
+  global _the_make_csp_sp # pylint:disable=global-statement
+  if _the_make_csp_sp is None:
+    _the_make_csp_sp = builtInSPs()["make_csp"]
+  return _the_make_csp_sp
+
+def _apply_compiled(address, nodes, env, rng):
+  spr = nodes[0].value
+  if isinstance(spr, VentureSPRecord):
+    psp = spr.sp.requestPSP
+    if type(psp) is CSPRequestPSP and \
+       type(spr.sp.outputPSP) is ESRRefOutputPSP: # pylint:disable=unidiomatic-typecheck
+      code = _compiled_bodies.get(psp)
+      if code is None:
+        code = compile(psp.exp, (tuple(psp.ids),))
+        _compiled_bodies[psp] = code
+      return applyCompiledCSP(address, psp, code, nodes[1:], rng)
+  return apply(address, nodes, env, rng)
+
+def applyCompiledCSP(address, psp, code, operandNodes, rng):
+  """Apply the compound procedure psp, whose body compiles to code,
+  as apply would, without building the request."""
+  rng.randint(1, 2**31 - 1) # The request seed
+  if len(psp.ids) != len(operandNodes):
+    raise VentureError("Wrong number of arguments: compound takes exactly %d arguments, got %d." % (len(psp.ids), len(operandNodes)))
+  extendedEnv = VentureEnvironment(psp.env, psp.ids, operandNodes)
+  value = code(addr.request(address, psp.loc), extendedEnv, rng)
+  rng.randint(1, 2**31 - 1) # The output seed
+  return node.normalize(value)
@@ -29,22 +29,47 @@ from venture.lite.sp import VentureSPRecord
 import venture.untraced.evaluator as evaluator
 import venture.untraced.node as node
 
-class Trace(object):
+_builtin_frame = None
 
-  def __init__(self, seed):
-    self.results = {}
-    self.env = env.VentureEnvironment()
+def builtInFrame():
+  """The environment frame binding the builtin values and procedures,
+  made once per process and shared by all untraced traces.
+
+  Sharing the SP records is safe because the untraced evaluator only
+  stores request families under repeatable ids, which no builtin
+  procedure makes."""
+  global _builtin_frame
+  if _builtin_frame is None:
+    frame = env.VentureEnvironment()
     for name, val in builtin.builtInValues().iteritems():
-      self.bindPrimitiveName(name, val)
+      frame.addBinding(name, node.Node(None, val))
     for name, sp in builtin.builtInSPs().iteritems():
-      self.bindPrimitiveSP(name, sp)
-    self.sealEnvironment() # New frame so users can shadow globals
+      frame.addBinding(name, node.Node(None, VentureSPRecord(sp)))
+    _builtin_frame = frame
+  return _builtin_frame
+
+class Trace(object):
+
+  def __init__(self, seed, base_env=None):
+    """base_env, if given, is a (shared) environment to layer this
+    trace's global frame on, in place of the builtin frame."""
+    self.results = {}
+    if base_env is None:
+      base_env = builtInFrame()
+    # New frame so users can shadow globals
+    self.env = env.VentureEnvironment(base_env)
+    self.compiling = False
 
     assert seed is not None
     rng = random.Random(seed)
     self.np_rng = npr.RandomState(rng.randint(1, 2**31 - 1))
     self.py_rng = random.Random(rng.randint(1, 2**31 - 1))
 
+  def set_compiling(self, enabled=True):
+    """Turn on (or off) compiling directives to closures before
+    evaluating them; see venture.untraced.evaluator.compile."""
+    self.compiling = enabled
+
   def sealEnvironment(self):
     self.env = env.VentureEnvironment(self.env)
 
@@ -58,7 +83,10 @@ class Trace(object):
     assert id not in self.results
     py_exp = t.ExpressionType().asPython(vv.VentureValue.fromStackDict(exp))
     rng = self.py_rng
-    val = evaluator.eval(addr.directive_address(id), py_exp, self.env, rng)
+    if self.compiling:
+      val = evaluator.compile(py_exp)(addr.directive_address(id), self.env, rng)
+    else:
+      val = evaluator.eval(addr.directive_address(id), py_exp, self.env, rng)
     assert isinstance(val, vv.VentureValue)
     self.results[id] = val
 
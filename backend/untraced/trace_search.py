@@ -85,58 +85,124 @@ class TraceSearchIndexer(object):
     # confusing, and this is too new.
     # TODO Also not supporting delta kernels, for a similar reason.
     self.prog = prog
+    self.random = is_random(prog)
+    self.path = None
+    self.pending = None # (index, weight) of the last sampleIndex
 
   def sampleIndex(self, trace):
-    (scaffold, _weight) = interpret(self.prog, trace)
+    if self.random:
+      self.path = PathRecorder()
+    (scaffold, weight) = interpret(self.prog, trace, self.path)
     assert isinstance(scaffold, Scaffold)
+    self.pending = (scaffold, weight)
     return scaffold
 
-  def logDensityOfIndex(self, trace, _):
-    # Two things:
-    #
-    # - The marginal probability of producing the same result is
-    #   actually intractable, so this is computing the probability of
-    #   following the same path (which may not actually yield the same
-    #   result, per Issue #576 (scope membership reversibility)).
-    #
-    # - In cases with only one random choice, the probability of
-    #   following the same path is independent of the path.  To handle
-    #   the more general case, I need to change the interface of
-    #   Indexers to be able to return a trace of the path they
-    #   followed so it can be replayed in the new context.
-    #   - Interestingly, this may also lead to a solution to #576, at
-    #     least in the form of rejecting transitions that are not
-    #     reversible.
-    #
-    # Until then, just return the weight and hope.
-    (scaffold, weight) = interpret(self.prog, trace)
-    assert isinstance(scaffold, Scaffold)
+  def logDensityOfIndex(self, trace, index):
+    # The marginal probability of producing the same result is
+    # actually intractable, so this is the probability of following
+    # the same path.  That path may not actually yield the same
+    # result in the new trace, per Issue #576 (scope membership
+    # reversibility), but if any of its random choices is no longer
+    # available there, the transition is not reversible, and its
+    # density is zero.
+    if not self.random:
+      return 0
+    if self.pending is not None and self.pending[0] is index:
+      # First call after sampling, in the trace the index came from
+      (_, weight) = self.pending
+      self.pending = None
+      return weight
+    assert self.path is not None, "Density of a trace search index that was not sampled"
+    try:
+      (_, weight) = interpret(self.prog, trace, PathReplayer(self.path.choices))
+    except PathNotAvailable:
+      return float("-inf")
     return weight
 
+class PathNotAvailable(Exception):
+  """Raised when replaying a search path in a trace that does not
+  offer one of its choices."""
+
+class PathRecorder(object):
+  """Makes the random choices of an interpretation, and remembers
+  them in order."""
+  builds_scaffolds = True
+
+  def __init__(self):
+    self.choices = []
+
+  def choose(self, thing, trace):
+    (key, ans) = sample_one_keyed(thing, trace.py_rng)
+    self.choices.append(key)
+    return ans
+
+class PathReplayer(object):
+  """Makes the recorded choices of another interpretation, in order.
+  Only the weight of a replay is wanted, so it does not build the
+  scaffold at the end."""
+  builds_scaffolds = False
+
+  def __init__(self, choices):
+    self.choices = iter(choices)
+
+  def choose(self, thing, _trace):
+    key = next(self.choices)
+    if key not in thing:
+      raise PathNotAvailable()
+    if isinstance(thing, SamplableMap):
+      return thing[key]
+    else:
+      return key
+
+def is_random(prog):
+  """Whether interpreting the given program makes any random choices.
+  If not, every path has density 1."""
+  if isinstance(prog, Random1):
+    return True
+  elif isinstance(prog, Intersect):
+    return is_random(prog.source1) or is_random(prog.source2)
+  elif isinstance(prog, Lookup):
+    return is_random(prog.dictionary)
+  elif isinstance(prog, Edge):
+    return is_random(prog.source) or \
+      (prog.edge in t.ForeignBlobType() and is_random(prog.edge.datum))
+  elif isinstance(prog, Extent) or isinstance(prog, MinimalSubproblem):
+    return is_random(prog.source)
+  elif isinstance(prog, Union):
+    return any(is_random(source) for source in prog.sources)
+  else:
+    return False
+
 # The return value of interpret is expected to be one of
 # - A single node
 # - An OrderedSet or OrderedFrozenSet of nodes
 # - A SamplableMap from keys to nodes
 # - A Scaffold
 # - The Top() object (serving as a special token denoting the top of the trace)
-def interpret(prog, trace):
+#
+# If given, the path (a PathRecorder or PathReplayer) makes the random
+# choices.
+def interpret(prog, trace, path=None):
   if isinstance(prog, Intersect):
-    (s1, w1) = interpret(prog.source1, trace)
-    (s2, w2) = interpret(prog.source2, trace)
+    (s1, w1) = interpret(prog.source1, trace, path)
+    (s2, w2) = interpret(prog.source2, trace, path)
     return (intersect(s1, s2), w1 + w2)
   elif isinstance(prog, Lookup):
-    (d, w) = interpret(prog.dictionary, trace)
+    (d, w) = interpret(prog.dictionary, trace, path)
     return (d[prog.key], w)
   elif isinstance(prog, Random1):
-    (thing, wt) = interpret(prog.source, trace)
-    ans = sample_one(thing, trace.py_rng)
+    (thing, wt) = interpret(prog.source, trace, path)
+    if path is None:
+      ans = sample_one(thing, trace.py_rng)
+    else:
+      ans = path.choose(thing, trace)
     wt2 = -1 * math.log(len(thing))
     return (ans, wt + wt2)
   elif isinstance(prog, Edge):
-    (thing, wt) = interpret(prog.source, trace)
+    (thing, wt) = interpret(prog.source, trace, path)
     if prog.edge in t.ForeignBlobType() and \
        (isinstance(prog.edge.datum, FetchTag) or isinstance(prog.edge.datum, Lookup)):
-      (thing2, wt2) = interpret(Extent(prog.edge.datum), trace)
+      (thing2, wt2) = interpret(Extent(prog.edge.datum), trace, path)
       return (intersect(extent(thing, trace), thing2), wt + wt2)
     elif prog.edge in t.ForeignBlobType() and \
          isinstance(prog.edge.datum, Star):
@@ -144,26 +210,40 @@ def interpret(prog, trace):
     else:
       return (follow_edge(thing, prog.edge, trace), wt)
   elif isinstance(prog, Extent):
-    (thing, wt) = interpret(prog.source, trace)
+    (thing, wt) = interpret(prog.source, trace, path)
     return (extent(thing, trace), wt)
   # elif isinstance(prog, UnionDict):
   elif isinstance(prog, Union):
-    (sources, weights) = zip(*[interpret(source, trace) for source in prog.sources])
+    (sources, weights) = zip(*[interpret(source, trace, path) for source in prog.sources])
     return (reduce(union, sources), sum(weights))
   elif isinstance(prog, FetchTag):
     return (trace.scopes[prog.name], 0)
   elif isinstance(prog, Top):
     return (Top(), 0) # Hack: Top as a node set is also a special token, reusing the same token
   elif isinstance(prog, MinimalSubproblem):
-    (nodes, wt) = interpret(prog.source, trace)
+    (nodes, wt) = interpret(prog.source, trace, path)
     node_set = as_set(nodes)
     assert _is_set(node_set)
     for node in node_set:
       assert isinstance(node, n.Node), node
-    return (constructScaffold(trace, [_canonicalize_to_ordered_frozen_set(node_set)]), wt)
+    if path is not None and not path.builds_scaffolds:
+      return (None, wt)
+    return (minimal_subproblem(prog, node_set, trace), wt)
   else:
     raise Exception("Unknown trace search term %s" % (prog,))
 
+def minimal_subproblem(prog, node_set, trace):
+  setsOfPNodes = [_canonicalize_to_ordered_frozen_set(node_set)]
+  if trace.scaffold_cache is not None:
+    key = (MinimalSubproblem, prog, frozenset(node_set))
+    try:
+      hash(key)
+    except TypeError:
+      key = None
+    if key is not None:
+      return trace.scaffold_cache.construct(trace, key, setsOfPNodes)
+  return constructScaffold(trace, setsOfPNodes)
+
 def intersect(thing1, thing2):
   return set_fmap2(thing1, thing2, lambda nodes1, nodes2: nodes1.intersection(nodes2))
 
@@ -171,10 +251,15 @@ def union(thing1, thing2):
   return set_fmap2(thing1, thing2, lambda nodes1, nodes2: nodes1.union(nodes2))
 
 def sample_one(thing, prng):
+  return sample_one_keyed(thing, prng)[1]
+
+def sample_one_keyed(thing, prng):
+  "Sample one element of a collection, returning its key and the element."
   if isinstance(thing, SamplableMap):
-    return thing.sample(prng)[1]
+    return thing.sample(prng)
   elif _is_set(thing):
-    return prng.sample(list(thing),1)[0]
+    ans = prng.sample(list(thing),1)[0]
+    return (ans, ans)
   else:
     raise Exception("Can only sample one element of a collection, not %s" % (thing,))
 
@@ -233,6 +318,9 @@ def follow_func(edge, trace):
 def extent(thing, trace):
   if isinstance(thing, Top):
     return trace.rcs
+  if trace.scaffold_cache is not None:
+    return set_fmap(thing, lambda nodes:
+                    trace.scaffold_cache.randomChoicesInExtent(trace, nodes))
   return set_fmap(thing, lambda nodes: trace.randomChoicesInExtent(nodes, None, None))
 
 def as_set(thing):
@@ -18,10 +18,14 @@
 from contextlib import contextmanager
 import cPickle
 import cStringIO as StringIO
+import itertools
 import random
 import threading
 import time
 
+import numpy as np
+
+from venture.engine import snapshot
 from venture.engine.inference import Infer
 from venture.engine.trace_set import TraceSet
 from venture.exception import VentureException
@@ -32,16 +36,23 @@ import venture.value.dicts as v
 
 class Engine(object):
 
+  # How many items of a bulk observation to evaluate at a time
+  bulk_chunk_size = 1000
+
   def __init__(self, backend, seed, persistent_inference_trace=True):
     assert seed is not None
     self._py_rng = random.Random(seed)
     self.model = self.new_model(backend)
     self.directiveCounter = 0
+    # Directive id of each bulk observation -> the range of ids
+    # reserved for its members
+    self.bulk_ids = {}
     self.inferrer = None
     self.foreign_sps = {}
     self.inference_sps = dict(inf.inferenceSPsList)
     self.callbacks = {}
     self.persistent_inference_trace = persistent_inference_trace
+    self.compile_inference = False
     if self.persistent_inference_trace:
       self.infer_trace = self.init_inference_trace()
     self.ripl = None
@@ -119,12 +130,63 @@ class Engine(object):
       weight_increments = self.incorporate()
     return (baseAddr, weight_increments)
 
+  def bulk_observe(self, datum, data, apply=False):
+    return self._bulk_observe(None, datum, data, apply)
+
+  def labeled_bulk_observe(self, label, datum, data, apply=False):
+    return self._bulk_observe(label, datum, data, apply)
+
+  def _bulk_observe(self, label, datum, data, apply):
+    # The data is streamed into the model a chunk at a time, under one
+    # directive.
+    baseAddr = self.nextBaseAddr()
+    self.bulk_ids[baseAddr] = (baseAddr + 1, baseAddr + 1)
+    chunks = _chunks(data, self.bulk_chunk_size)
+    try:
+      chunk = self._reserve_bulk_ids(baseAddr, next(chunks))
+      if label is None:
+        self.model.bulk_observe(baseAddr, datum, chunk, baseAddr + 1, apply)
+      else:
+        self.model.labeled_bulk_observe(label, baseAddr, datum, chunk,
+                                        baseAddr + 1, apply)
+    except:
+      del self.bulk_ids[baseAddr]
+      raise
+    weight_increments = self.incorporate()
+    try:
+      for chunk in chunks:
+        self.model.extend_bulk_observe(
+          baseAddr, self._reserve_bulk_ids(baseAddr, chunk))
+        weight_increments = [w + dw for (w, dw)
+                             in zip(weight_increments, self.incorporate())]
+    except:
+      # Forgotten as a unit, so also failed as one
+      self.forget(baseAddr)
+      raise
+    return (baseAddr, weight_increments)
+
+  def _reserve_bulk_ids(self, baseAddr, chunk):
+    # The members of a bulk observation are evaluated under the ids
+    # following its own, so that every backend sees ordinary ids.
+    self.directiveCounter += len(chunk)
+    (first, _) = self.bulk_ids[baseAddr]
+    self.bulk_ids[baseAddr] = (first, self.directiveCounter + 1)
+    return chunk
+
+  def is_bulk_member(self, did):
+    """Whether did is one of the ids reserved for the members of a bulk
+    observation."""
+    return any(first <= did < end for (first, end) in self.bulk_ids.values())
+
   def forget(self,directiveId):
     weight_increments = self.model.forget(directiveId)
+    self.bulk_ids.pop(directiveId, None)
     return weight_increments
 
   def labeled_forget(self, label):
+    directiveId = self.model.get_directive_id(label)
     weight_increments = self.model.labeled_forget(label)
+    self.bulk_ids.pop(directiveId, None)
     return weight_increments
 
   def get_directive_id(self, label):
@@ -143,19 +205,20 @@ class Engine(object):
     return weight_increments
 
   def sample(self,datum):
-    # TODO Officially this is taken care of by the Venture SIVM level,
-    # but I want it here because it is used in the interpretation of
-    # the "collect" infer command.  Design clarification time?
-    # TODO With this definition of "sample", "collect" will pump the
-    # directive counter of the engine.  That is likely to make us at
-    # least somewhat sad.
-    (did, value) = self.predict(datum)
-    self.forget(did)
+    # Evaluated as the next directive would be, so that errors point
+    # at it, but without taking its id.
+    value = self.model.peek_distinguished(self.predictNextDirectiveId(), datum)
+    if value is None:
+      # The backend cannot evaluate without recording a directive
+      (did, value) = self.predict(datum)
+      self.forget(did)
     return value
 
   def sample_all(self, datum):
-    (did, values) = self.predict_all(datum)
-    self.forget(did)
+    values = self.model.peek(self.predictNextDirectiveId(), datum)
+    if values is None:
+      (did, values) = self.predict_all(datum)
+      self.forget(did)
     return values
 
   def freeze(self,directiveId):
@@ -185,6 +248,7 @@ class Engine(object):
   def clear(self):
     self.model.clear()
     self.directiveCounter = 0
+    self.bulk_ids = {}
     if self.persistent_inference_trace:
       self.infer_trace = self.init_inference_trace()
     # TODO The clear operation appears to be bit-rotten.  Problems include:
@@ -308,13 +372,14 @@ class Engine(object):
 
   def init_inference_trace(self):
     import venture.untraced.trace as trace
-    ans = trace.Trace(self._py_rng.randint(1, 2**31 - 1))
+    ans = trace.Trace(self._py_rng.randint(1, 2**31 - 1),
+                      _inference_primitives_frame())
     for name,sp in self.inferenceSPsList():
-      ans.bindPrimitiveSP(name, sp)
-    for word in inf.inferenceKeywords:
-      if not ans.boundInGlobalEnv(word):
-        ans.bindPrimitiveName(word, vv.VentureSymbol(word))
+      if the_inference_primitives.get(name) is not sp:
+        # Foreign, so not in the shared frame
+        ans.bindPrimitiveSP(name, sp)
     ans.bindPrimitiveName("__the_inferrer__", vv.VentureForeignBlob(Infer(self)))
+    ans.set_compiling(self.compile_inference)
     self.install_inference_prelude(ans)
     return ans
 
@@ -374,27 +439,43 @@ class Engine(object):
       return inferrer_obj.inference_thread_id == threading.currentThread().ident
 
 
-  def save_io(self, stream, extra=None):
-    data = self.model.saveable()
+  def save_io(self, stream, extra=None, version=None):
+    """Save the model to the stream.
+
+    By default, writes a binary snapshot (see venture.engine.snapshot);
+    pass version='0.2' for the older pickle format.  load_io reads
+    either."""
+    data = self.model.saveable(lazy=version is None)
     data['directiveCounter'] = self.directiveCounter
+    data['bulk_ids'] = self.bulk_ids
     data['extra'] = extra
-    version = '0.2'
-    cPickle.dump((data, version), stream)
+    if version is None:
+      traces = data.pop('traces')
+      snapshot.save(stream, data, traces)
+    else:
+      assert version == '0.2', "Unknown save format version %r" % (version,)
+      cPickle.dump((data, version), stream)
 
   def load_io(self, stream):
-    (data, version) = cPickle.load(stream)
-    assert version == '0.2', "Incompatible version or unrecognized object"
+    head = stream.read(len(snapshot.MAGIC))
+    if snapshot.is_snapshot(head):
+      (data, traces) = snapshot.load(stream, head)
+      data['traces'] = traces
+    else:
+      (data, version) = cPickle.loads(head + stream.read())
+      assert version == '0.2', "Incompatible version or unrecognized object"
     self.directiveCounter = data['directiveCounter']
+    self.bulk_ids = data.get('bulk_ids', {})
     self.model.load(data)
     return data['extra']
 
-  def save(self, fname, extra=None):
+  def save(self, fname, extra=None, version=None):
     with open(fname, 'w') as fp:
-      self.save_io(fp, extra=extra)
+      self.save_io(fp, extra=extra, version=version)
 
-  def saves(self, extra=None):
+  def saves(self, extra=None, version=None):
     ans = StringIO.StringIO()
-    self.save_io(ans, extra=extra)
+    self.save_io(ans, extra=extra, version=version)
     return ans.getvalue()
 
   def load(self, fname):
@@ -420,6 +501,21 @@ class Engine(object):
   def set_profiling(self, enabled=True): self.model.set_profiling(enabled)
   def clear_profiling(self): self.model.clear_profiling()
 
+  def set_inference_compilation(self, enabled=True):
+    """Turn on (or off) compiling inference programs to closures
+    before running them.  Prelude procedures get compiled the first
+    time compiled code calls them."""
+    self.compile_inference = enabled
+    if self.persistent_inference_trace:
+      self.infer_trace.set_compiling(enabled)
+
+  def set_scaffold_cache(self, enabled=True):
+    self.model.set_scaffold_cache(enabled)
+  def scaffold_cache_stats(self): return self.model.scaffold_cache_stats()
+
+  def set_resampling(self, scheme, ess_threshold=None):
+    self.model.set_resampling(scheme, ess_threshold)
+
   def profile_data(self):
     rows = []
     for (pid, trace) in enumerate([t for t in self.model.retrieve_traces()
@@ -434,6 +530,22 @@ class Engine(object):
       backend = self.model.backend
     return TraceSet(self, backend, self._py_rng.randint(1, 2**31 - 1))
 
+def _chunks(data, size):
+  """The data in successive chunks of at most size items, and at
+  least one chunk even if it is empty.  Arrays and lists are sliced;
+  other iterables are consumed as they go."""
+  if isinstance(data, (list, np.ndarray)):
+    for start in xrange(0, max(len(data), 1), size):
+      yield data[start:start + size]
+  else:
+    items = iter(data)
+    chunk = list(itertools.islice(items, size))
+    yield chunk
+    while len(chunk) == size:
+      chunk = list(itertools.islice(items, size))
+      if chunk:
+        yield chunk
+
 # Support for continuous inference
 
 class ContinuousInferrer(object):
@@ -474,14 +586,84 @@ class ContinuousInferrer(object):
 
 # Inference prelude
 
+the_inference_primitives_frame = None
+the_inference_primitives = {} # name -> SP bound in that frame
+
+def _inference_primitives_frame():
+  """The environment frame binding the standard inference SPs and
+  keywords on top of the builtins, shared by all inference traces.
+
+  The inference prelude itself cannot be shared: its procedures
+  close over __the_inferrer__, which is per-engine."""
+  global the_inference_primitives_frame # pylint:disable=global-statement
+  if the_inference_primitives_frame is None:
+    from venture.lite.env import VentureEnvironment
+    from venture.lite.sp import VentureSPRecord
+    import venture.untraced.node as node
+    import venture.untraced.trace as trace
+    frame = VentureEnvironment(trace.builtInFrame())
+    for name, sp in inf.inferenceSPsList:
+      frame.addBinding(name, node.Node(None, VentureSPRecord(sp)))
+      the_inference_primitives[name] = sp
+    for word in inf.inferenceKeywords:
+      if not frame.symbolBound(word):
+        frame.addBinding(word, node.Node(None, vv.VentureSymbol(word)))
+    the_inference_primitives_frame = frame
+  return the_inference_primitives_frame
+
 the_prelude = None
 
 def _inference_prelude():
   global the_prelude # Yes, I do mean to use a global variable. pylint:disable=global-statement
   if the_prelude is None:
-    the_prelude = _compute_inference_prelude()
+    the_prelude = _load_inference_prelude()
   return the_prelude
 
+def _inference_prelude_path():
+  """Where the parsed and desugared inference prelude is cached on
+  disk, or None if it should not be.
+
+  The cache is opt-in: it lives in $VENTURE_CACHE_DIR if that is set
+  and not empty, in a file named for this version of Venture and of
+  the prelude, so stale snapshots are never read."""
+  import hashlib
+  import os
+  import venture
+  import venture.engine.inference_prelude as inference_prelude
+  cache_dir = os.environ.get("VENTURE_CACHE_DIR")
+  if not cache_dir:
+    return None
+  key = hashlib.sha1(repr((venture.__version__, inference_prelude.prelude)))
+  return os.path.join(cache_dir,
+                      "inference-prelude-%s.pkl" % (key.hexdigest(),))
+
+def _load_inference_prelude():
+  import os
+  import tempfile
+  path = _inference_prelude_path()
+  if path is not None:
+    try:
+      with open(path, "rb") as f:
+        return cPickle.load(f)
+    except Exception: # pylint:disable=broad-except
+      pass # Missing or unreadable; recompute it
+  ans = _compute_inference_prelude()
+  if path is not None:
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(path))
+      try:
+        with os.fdopen(fd, "wb") as f:
+          cPickle.dump(ans, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path) # Atomic, so concurrent readers are safe
+      except:
+        os.unlink(tmp)
+        raise
+    except Exception: # pylint:disable=broad-except
+      pass # Caching is only an optimization
+  return ans
+
 def _compute_inference_prelude():
   ans = []
   import venture.engine.inference_prelude as inference_prelude
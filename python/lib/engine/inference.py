@@ -131,6 +131,9 @@ class Infer(object):
   def resample_thread_ser(self, ct): self.engine.resample(ct, 'thread_ser')
   def resample_multiprocess(self, ct, process_cap = None):
     self.engine.resample(ct, 'multiprocess', process_cap)
+  def resample_forking(self, ct): self.engine.resample(ct, 'forking')
+  def set_resampling(self, scheme, ess_threshold = None):
+    self.engine.set_resampling(scheme, ess_threshold)
 
   def likelihood_weight(self): self.engine.likelihood_weight()
   def log_likelihood_at(self, scope, block):
@@ -0,0 +1,343 @@
+# Copyright (c) 2015 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Binary snapshots of a model, for Engine.save_io and load_io.
+
+The values of a dumped trace are one stack dict per random choice,
+which the original '0.2' format pickles along with everything else;
+that is slow and memory-hungry for large models.  A snapshot instead
+stores the values column-wise:
+
+- The file starts with MAGIC and a little-endian uint32 format
+  version, followed by a pickled header blob holding everything
+  except the traces (mode, weights, labels, directive counter, and
+  the caller's extra data, which are all small).
+
+- Then one section per trace, in order.  A pickled blob gives the
+  trace's directive ids, any directives not seen in an earlier trace
+  (the directive table is shared, since particles nearly always have
+  the same directives), and the names of the bound foreign SPs.  Then
+  come the value columns: a uint8 kind per value, a float64 column of
+  numbers, an int64 column of integers, atoms, booleans, and indexes
+  into the section's string table (for symbols and strings), an int64
+  column describing numeric arrays (kind name, subtype, and shape, in
+  ARRAY_META_WIDTH slots each), and the float64 buffer of their
+  elements.  A final pickled blob holds the string table, the array
+  subtypes, and any values of other types.
+
+Every blob and array is preceded by its uint64 length and padded to a
+multiple of 8 bytes.  Sections are written as the traces are dumped,
+and read back one at a time; a snapshot in a real file is read through
+a memory map rather than copied into memory.
+"""
+
+import cPickle as pickle
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = "VNTRSNAP"
+FORMAT_VERSION = 1
+
+# Kinds of values
+NUMBER = 0
+INTEGER = 1
+ATOM = 2
+BOOLEAN = 3
+SYMBOL = 4
+STRING = 5
+NUMERIC_ARRAY = 6
+OTHER = 7
+
+ARRAY_META_WIDTH = 5 # kind name, subtype or -1, ndim, and up to 2 dims
+
+_ARRAY_KINDS = ["vector", "simplex", "matrix", "symmetric_matrix",
+                "array_unboxed"]
+
+def save(stream, header, dumps):
+  """Write a snapshot of a header dict and an iterable of trace dumps
+  (as made by venture.engine.trace.Trace.dump) to the stream."""
+  writer = _Writer(stream)
+  writer.write_bytes(MAGIC)
+  writer.write_bytes(struct.pack("<I", FORMAT_VERSION))
+  writer.write_blob(header)
+  directive_table = {} # pickled directive -> index in the shared table
+  for (values, directives, foreign_sp_names) in dumps:
+    writer.write_blob(_directive_record(directives, foreign_sp_names,
+                                        directive_table))
+    _write_values(writer, values)
+  writer.write_blob(None) # End of traces
+
+def load(stream, head=None):
+  """Read a snapshot from the stream, returning its header and an
+  iterator over its trace dumps.  The iterator reads the stream, so
+  must be exhausted before the stream is used for anything else.
+
+  If the caller has already consumed the magic number from the
+  stream, it passes it back as head."""
+  reader = _reader(stream, head)
+  magic = reader.read_bytes(len(MAGIC))
+  assert magic == MAGIC, "Not a Venture snapshot"
+  (version,) = struct.unpack("<I", reader.read_bytes(4))
+  assert version == FORMAT_VERSION, \
+    "Incompatible snapshot format version %d" % version
+  header = reader.read_blob()
+  return (header, _read_dumps(reader))
+
+def is_snapshot(head):
+  return head == MAGIC
+
+def _directive_record(directives, foreign_sp_names, directive_table):
+  dids = []
+  new = []
+  for (did, directive) in sorted(directives.items()):
+    key = pickle.dumps((did, directive), pickle.HIGHEST_PROTOCOL)
+    if key not in directive_table:
+      directive_table[key] = len(directive_table)
+      new.append((did, directive))
+    dids.append(directive_table[key])
+  return {"new_directives": new, "directives": dids,
+          "foreign_sp_names": foreign_sp_names}
+
+def _read_dumps(reader):
+  directive_table = []
+  while True:
+    record = reader.read_blob()
+    if record is None:
+      break
+    directive_table.extend(record["new_directives"])
+    directives = dict(directive_table[i] for i in record["directives"])
+    values = _read_values(reader)
+    yield (values, directives, record["foreign_sp_names"])
+  reader.finish()
+
+######################################################################
+# Value columns
+######################################################################
+
+def _write_values(writer, values):
+  kinds = []
+  numbers = []
+  integers = []
+  array_meta = []
+  array_data = []
+  strings = {} # string -> index in the string table
+  subtypes = [] # In order of first appearance
+  others = []
+  def intern(s):
+    if s not in strings:
+      strings[s] = len(strings)
+    return strings[s]
+  for value in values:
+    tp = value["type"] if isinstance(value, dict) else None
+    payload = value.get("value") if tp is not None else None
+    if tp == "number" and isinstance(payload, (float, int, long)):
+      kinds.append(NUMBER)
+      numbers.append(payload)
+    elif tp in ("integer", "atom") and isinstance(payload, (int, long)) and \
+         -2**63 <= payload < 2**63:
+      kinds.append(INTEGER if tp == "integer" else ATOM)
+      integers.append(payload)
+    elif tp == "boolean" and isinstance(payload, bool):
+      kinds.append(BOOLEAN)
+      integers.append(int(payload))
+    elif tp in ("symbol", "string") and isinstance(payload, basestring):
+      kinds.append(SYMBOL if tp == "symbol" else STRING)
+      integers.append(intern(payload))
+    elif tp in _ARRAY_KINDS and _is_float_array(payload) and \
+         set(value.keys()) <= set(["type", "value", "subtype"]):
+      kinds.append(NUMERIC_ARRAY)
+      subtype = -1
+      if "subtype" in value:
+        try:
+          subtype = subtypes.index(value["subtype"])
+        except ValueError:
+          subtype = len(subtypes)
+          subtypes.append(value["subtype"])
+      shape = list(payload.shape) + [0] * (2 - payload.ndim)
+      array_meta.extend([intern(tp), subtype, payload.ndim] + shape)
+      array_data.append(payload.ravel())
+    else:
+      kinds.append(OTHER)
+      others.append(value)
+  writer.write_array(np.array(kinds, dtype=np.uint8))
+  writer.write_array(np.array(numbers, dtype=np.float64))
+  writer.write_array(np.array(integers, dtype=np.int64))
+  writer.write_array(np.array(array_meta, dtype=np.int64))
+  if array_data:
+    writer.write_array(np.concatenate(array_data).astype(np.float64))
+  else:
+    writer.write_array(np.zeros(0, dtype=np.float64))
+  table = sorted(strings, key=strings.get)
+  writer.write_blob({"strings": table, "subtypes": subtypes,
+                     "others": others})
+
+def _is_float_array(payload):
+  return isinstance(payload, np.ndarray) and payload.ndim in (1, 2) and \
+    payload.dtype == np.float64
+
+def _read_values(reader):
+  kinds = reader.read_array(np.uint8)
+  numbers = reader.read_array(np.float64)
+  integers = reader.read_array(np.int64)
+  array_meta = reader.read_array(np.int64)
+  array_data = reader.read_array(np.float64)
+  tables = reader.read_blob()
+  strings = tables["strings"]
+  subtypes = tables["subtypes"]
+
+  # Fill in the values kind by kind, which keeps the per-value work
+  # down to building its stack dict
+  values = [None] * len(kinds)
+  for (i, x) in zip(np.flatnonzero(kinds == NUMBER).tolist(),
+                    numbers.tolist()):
+    values[i] = {"type": "number", "value": x}
+  int_kinds = (kinds == INTEGER) | (kinds == ATOM) | (kinds == BOOLEAN) | \
+              (kinds == SYMBOL) | (kinds == STRING)
+  for (i, k) in zip(np.flatnonzero(int_kinds).tolist(),
+                    integers.tolist()):
+    kind = kinds[i]
+    if kind == INTEGER:
+      values[i] = {"type": "integer", "value": k}
+    elif kind == ATOM:
+      values[i] = {"type": "atom", "value": k}
+    elif kind == BOOLEAN:
+      values[i] = {"type": "boolean", "value": bool(k)}
+    elif kind == SYMBOL:
+      values[i] = {"type": "symbol", "value": strings[k]}
+    else:
+      values[i] = {"type": "string", "value": strings[k]}
+  start = 0
+  meta = array_meta.reshape(-1, ARRAY_META_WIDTH).tolist()
+  for (i, (tp, subtype, ndim, d0, d1)) in \
+      zip(np.flatnonzero(kinds == NUMERIC_ARRAY).tolist(), meta):
+    shape = (d0, d1)[:ndim]
+    size = int(np.prod(shape))
+    # Copy, so that the value does not hold on to the memory map
+    payload = np.array(array_data[start:start+size]).reshape(shape)
+    start += size
+    values[i] = {"type": strings[tp], "value": payload}
+    if subtype >= 0:
+      values[i]["subtype"] = subtypes[subtype]
+  for (i, value) in zip(np.flatnonzero(kinds == OTHER).tolist(),
+                        tables["others"]):
+    values[i] = value
+  return values
+
+######################################################################
+# Framing
+######################################################################
+
+def _padding(n):
+  return -n % 8
+
+class _Writer(object):
+  def __init__(self, stream):
+    self.stream = stream
+    self.pos = 0
+
+  def write_bytes(self, data):
+    self.stream.write(data)
+    self.pos += len(data)
+
+  def _pad(self):
+    self.write_bytes("\0" * _padding(self.pos))
+
+  def write_blob(self, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    self.write_bytes(struct.pack("<Q", len(data)))
+    self.write_bytes(data)
+    self._pad()
+
+  def write_array(self, array):
+    self.write_bytes(struct.pack("<Q", len(array)))
+    self._pad()
+    self.write_bytes(array.astype(array.dtype.newbyteorder("<")).tobytes())
+    self._pad()
+
+def _reader(stream, head):
+  try:
+    start = stream.tell() - len(head or "")
+    return _MappedReader(stream, stream.fileno(), start)
+  except (AttributeError, IOError, ValueError, mmap.error):
+    # Not a file that can be mapped
+    return _StreamReader(stream, head)
+
+class _StreamReader(object):
+  def __init__(self, stream, head=None):
+    self.stream = stream
+    self.buffered = head or ""
+    self.pos = 0
+
+  def read_bytes(self, n):
+    if self.buffered:
+      (data, self.buffered) = (self.buffered[:n], self.buffered[n:])
+      data += self.stream.read(n - len(data))
+    else:
+      data = self.stream.read(n)
+    assert len(data) == n, "Truncated snapshot"
+    self.pos += n
+    return data
+
+  def _skip_padding(self):
+    self.read_bytes(_padding(self.pos))
+
+  def read_blob(self):
+    (n,) = struct.unpack("<Q", self.read_bytes(8))
+    obj = pickle.loads(self.read_bytes(n))
+    self._skip_padding()
+    return obj
+
+  def read_array(self, dtype):
+    (n,) = struct.unpack("<Q", self.read_bytes(8))
+    self._skip_padding()
+    dtype = np.dtype(dtype).newbyteorder("<")
+    ans = np.frombuffer(self.read_bytes(n * dtype.itemsize), dtype=dtype)
+    self._skip_padding()
+    return ans
+
+  def finish(self):
+    pass
+
+class _MappedReader(_StreamReader):
+  """Reads a snapshot in a file through a memory map, leaving the file
+  positioned after it when done."""
+
+  def __init__(self, stream, fileno, start):
+    super(_MappedReader, self).__init__(stream)
+    self.map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    self.start = start
+
+  def read_bytes(self, n):
+    offset = self.start + self.pos
+    assert offset + n <= len(self.map), "Truncated snapshot"
+    self.pos += n
+    return self.map[offset:offset+n]
+
+  def read_array(self, dtype):
+    (n,) = struct.unpack("<Q", self.read_bytes(8))
+    self._skip_padding()
+    dtype = np.dtype(dtype).newbyteorder("<")
+    ans = np.frombuffer(self.map, dtype=dtype, count=n,
+                        offset=self.start + self.pos)
+    self.pos += n * dtype.itemsize
+    self._skip_padding()
+    return ans
+
+  def finish(self):
+    self.stream.seek(self.start + self.pos)
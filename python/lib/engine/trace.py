@@ -16,6 +16,9 @@
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import numbers
+
+import numpy as np
 
 import venture.value.dicts as v
 from venture.exception import VentureException
@@ -63,18 +66,72 @@ class Trace(object):
     self.directives[baseAddr] = ["evaluate", exp]
     return self.trace.extractValue(baseAddr)
 
+  def peek(self, baseAddr, exp):
+    """The value exp would have if evaluated as the directive baseAddr,
+computed without changing the trace, or None if the backend cannot
+do that."""
+    peek = getattr(self.trace, "peek", None)
+    if peek is None:
+      return None
+    return peek(baseAddr, exp)
+
   def observe(self, baseAddr, exp, val):
     assert baseAddr not in self.directives
     self.trace.eval(baseAddr, exp)
     self.trace.observe(baseAddr,val)
     self.directives[baseAddr] = ["observe", exp, val]
 
+  def bulk_observe(self, baseAddr, exp, data, first, apply):
+    """Observe many evaluations of exp as one directive.
+
+The members are evaluated under the consecutive ids starting at
+first, which the Engine reserves.  If apply is true, exp is a
+procedure and each item of data gives the arguments to apply it to
+followed by the value to observe; otherwise each item is a value of
+exp to observe.  More data can be added by extend_bulk_observe."""
+    assert baseAddr not in self.directives
+    self._observe_members(exp, data, first, apply)
+    self.directives[baseAddr] = ["bulk_observe", exp, [data], first, apply]
+
+  def extend_bulk_observe(self, baseAddr, data):
+    """Observe the next chunk of the data of the bulk observation
+at baseAddr, under the ids following its members'."""
+    (_, exp, chunks, first, apply) = self.directives[baseAddr]
+    self._observe_members(exp, data, _bulk_end(chunks, first), apply)
+    # A new record, since copies of this trace may share the old one
+    self.directives[baseAddr] = \
+      ["bulk_observe", exp, chunks + [data], first, apply]
+
+  def _observe_members(self, exp, data, first, apply):
+    done = []
+    try:
+      for (id, member_exp, val) in _bulk_members(exp, [data], first, apply):
+        self.trace.eval(id, member_exp)
+        try:
+          self.trace.observe(id, val)
+        except:
+          self.trace.uneval(id)
+          raise
+        done.append(id)
+    except:
+      # Leave the trace as it was, rather than with part of the data
+      for id in reversed(done):
+        self.trace.unobserve(id)
+        self.trace.uneval(id)
+      raise
+
   def forget(self, directiveId):
     if directiveId not in self.directives:
       raise VentureException("invalid_argument", "Cannot forget a non-existent directive id.  Valid options are %s" % self.directives.keys(),
                              argument="directive_id", directive_id=directiveId)
     weight = 0
     directive = self.directives[directiveId]
+    if directive[0] == "bulk_observe":
+      for (id, _, _) in reversed(list(_bulk_members(*directive[1:]))):
+        weight += self.trace.unobserve(id)
+        self.trace.uneval(id)
+      del self.directives[directiveId]
+      return weight
     if directive[0] == "observe":
       weight += self.trace.unobserve(directiveId)
     self.trace.uneval(directiveId)
@@ -90,6 +147,9 @@ class Trace(object):
     if directiveId not in self.directives:
       raise VentureException("invalid_argument", "Cannot freeze a non-existent directive id.  Valid options are %s" % self.directives.keys(),
                              argument="directive_id", directive_id=directiveId)
+    if self.directives[directiveId][0] == "bulk_observe":
+      raise VentureException("invalid_argument", "Cannot freeze a bulk observation",
+                             argument="directive_id", directive_id=directiveId)
     self.trace.freeze(directiveId)
     self._record_directive_frozen(directiveId)
 
@@ -110,6 +170,9 @@ class Trace(object):
     if directiveId not in self.directives:
       raise VentureException("invalid_argument", "Cannot report a non-existent directive id",
                              argument=directiveId)
+    directive = self.directives[directiveId]
+    if directive[0] == "bulk_observe":
+      return v.list([self.trace.extractValue(id) for id in _bulk_ids(*directive[1:])])
     return self.trace.extractValue(directiveId)
 
   def report_raw(self,directiveId):
@@ -117,6 +180,9 @@ class Trace(object):
       raise VentureException("invalid_argument",
                              "Cannot report raw value of a non-existent directive id",
                              argument=directiveId)
+    directive = self.directives[directiveId]
+    if directive[0] == "bulk_observe":
+      return [self.trace.extractRaw(id) for id in _bulk_ids(*directive[1:])]
     return self.trace.extractRaw(directiveId)
 
   def bind_foreign_sp(self, name, sp):
@@ -180,7 +246,7 @@ inference.)
 def _dump_trace(trace, directives, skipStackDictConversion=False):
   # This block mutates the trace
   db = trace.makeSerializationDB()
-  for did, directive in sorted(directives.items(), reverse=True):
+  for did, directive in reversed(list(_trace_directives(directives))):
     if directive[0] == "observe":
       trace.unobserve(did)
     trace.unevalAndExtract(did, db)
@@ -188,7 +254,7 @@ def _dump_trace(trace, directives, skipStackDictConversion=False):
   # This block undoes the mutation on the trace done by the previous block; but
   # it does not destroy the value stack because the actual OmegaDB (superclass
   # of OrderedOmegaDB) has the values.
-  for did, directive in sorted(directives.items()):
+  for did, directive in _trace_directives(directives):
     trace.restore(did, db)
     if directive[0] == "observe":
       trace.observe(did, directive[2])
@@ -209,7 +275,7 @@ def _restore_trace(trace, directives, values, foreign_sp_names, foreign_sps, ski
 
   db = trace.makeSerializationDB(values, skipStackDictConversion)
 
-  for did, directive in sorted(directives.items()):
+  for did, directive in _trace_directives(directives):
     if directive[0] == "define":
       name, datum = directive[1], directive[2]
       trace.evalAndRestore(did, datum, db)
@@ -230,3 +296,48 @@ def _restore_trace(trace, directives, values, foreign_sp_names, foreign_sps, ski
   trace.registerConstraints()
 
   return trace
+
+######################################################################
+# Members of bulk observations
+######################################################################
+
+def _trace_directives(directives):
+  """The directives in order, as the backend trace sees them: each bulk
+  observation stands for an observe directive per member."""
+  for (did, directive) in sorted(directives.items()):
+    if directive[0] == "bulk_observe":
+      for (id, exp, val) in _bulk_members(*directive[1:]):
+        yield (id, ["observe", exp, val])
+    else:
+      yield (did, directive)
+
+# The data of a bulk observation is recorded as the list of chunks it
+# was observed in.
+
+def _bulk_end(chunks, first):
+  return first + sum(len(chunk) for chunk in chunks)
+
+def _bulk_ids(_exp, chunks, first, _apply):
+  return xrange(first, _bulk_end(chunks, first))
+
+def _bulk_members(exp, chunks, first, apply):
+  items = (item for chunk in chunks for item in chunk)
+  for (i, item) in enumerate(items):
+    if apply:
+      args = [v.quote(_stack_dict(a)) for a in item[:-1]]
+      yield (first + i, [exp] + args, _stack_dict(item[-1]))
+    else:
+      yield (first + i, exp, _stack_dict(item))
+
+def _stack_dict(item):
+  # Items come as stack dicts, or as the numbers in a numpy array
+  if isinstance(item, dict):
+    return item
+  elif isinstance(item, (bool, np.bool_)):
+    return v.boolean(bool(item))
+  elif isinstance(item, numbers.Number):
+    return v.number(float(item))
+  else:
+    raise VentureException("invalid_argument",
+                           "Invalid item %r in bulk observation" % (item,),
+                           argument="data")
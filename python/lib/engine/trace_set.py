@@ -22,14 +22,18 @@ import random
 
 import numpy.random as npr
 
+from ..multiprocess import ForkingMaster
 from ..multiprocess import MultiprocessingMaster
 from ..multiprocess import SynchronousMaster
 from ..multiprocess import SynchronousSerializingMaster
 from ..multiprocess import ThreadedMaster
 from ..multiprocess import ThreadedSerializingMaster
 from venture.exception import VentureException
+from venture.lite.utils import RESAMPLING_SCHEMES
+from venture.lite.utils import effectiveSampleSize
 from venture.lite.utils import log_domain_even_out
 from venture.lite.utils import logsumexp
+from venture.lite.utils import resampleLogCategorical
 from venture.lite.utils import sampleLogCategorical
 import venture.engine.trace as tr
 
@@ -41,6 +45,8 @@ class TraceSet(object):
     self.mode = 'sequential'
     self.process_cap = None
     self.traces = None
+    self.resampling_scheme = 'multinomial'
+    self.resampling_ess_threshold = None
     assert seed is not None
     self._py_rng = random.Random(seed)
     seed = self._py_rng.randint(1, 2**31 - 1)
@@ -52,6 +58,8 @@ class TraceSet(object):
   def _trace_master(self, mode):
     if mode == 'multiprocess':
       return MultiprocessingMaster
+    elif mode == 'forking':
+      return ForkingMaster
     elif mode == 'thread_ser':
       return ThreadedSerializingMaster
     elif mode == 'threaded':
@@ -122,6 +130,10 @@ class TraceSet(object):
     with self._putting_label(label, baseAddr):
       self.observe(baseAddr, exp, val)
 
+  def labeled_bulk_observe(self, label, baseAddr, exp, data, first, apply):
+    with self._putting_label(label, baseAddr):
+      self.bulk_observe(baseAddr, exp, data, first, apply)
+
   def labeled_evaluate(self, label, baseAddr, exp):
     with self._putting_label(label, baseAddr):
       return self.evaluate(baseAddr, exp)
@@ -151,9 +163,24 @@ class TraceSet(object):
   def evaluate(self, baseAddr, datum):
     return self.traces.map('evaluate', baseAddr, datum)
 
+  def peek(self, baseAddr, datum):
+    values = self.traces.map('peek', baseAddr, datum)
+    if any(value is None for value in values):
+      return None
+    return values
+
+  def peek_distinguished(self, baseAddr, datum):
+    return self.traces.at_distinguished('peek', baseAddr, datum)
+
   def observe(self, baseAddr, datum, val):
     self.traces.map('observe', baseAddr, datum, val)
 
+  def bulk_observe(self, baseAddr, datum, data, first, apply):
+    self.traces.map('bulk_observe', baseAddr, datum, data, first, apply)
+
+  def extend_bulk_observe(self, baseAddr, data):
+    self.traces.map('extend_bulk_observe', baseAddr, data)
+
   def forget(self, directiveId):
     weight_increments = self.traces.map('forget', directiveId)
     if directiveId in self._did_to_label:
@@ -199,24 +226,74 @@ if freeze has been used.
     self.log_weights = [0 for _ in range(num_particles)]
     self.traces.map('reset_to_prior')
 
+  def set_resampling(self, scheme, ess_threshold=None):
+    if scheme not in RESAMPLING_SCHEMES:
+      raise VentureException("invalid_argument",
+        "Unknown resampling scheme %r, expected one of %s" %
+        (scheme, RESAMPLING_SCHEMES), argument="scheme")
+    self.resampling_scheme = scheme
+    self.resampling_ess_threshold = ess_threshold
+
   def resample(self, P, mode = 'sequential', process_cap = None):
-    self.mode = mode
-    self.process_cap = process_cap
-    newTraces = self._resample_traces(P)
-    self.create_trace_pool(newTraces, log_domain_even_out(self.log_weights, P))
+    if self._resampling_unneeded(P, mode, process_cap):
+      # Copying particles is the expensive part, and would only add
+      # variance here.
+      pass
+    elif mode == 'forking' and self.mode == 'forking':
+      # The workers fork the survivors in place, so no trace passes
+      # through this process.
+      ancestors = self._resample_ancestors(P)
+      seed = self._py_rng.randint(1, 2**31 - 1)
+      self.traces = self.traces.fork(ancestors, seed)
+      self.log_weights = log_domain_even_out(self.log_weights, P)
+    elif self._can_reuse_pool(P, mode, process_cap):
+      # Keep the workers, which copy or exchange the survivors among
+      # themselves.
+      ancestors = self._resample_ancestors(P)
+      copier = TraceCopier(self.backend, self.engine.foreign_sps,
+                           self._py_rng.randint(1, 2**31 - 1))
+      seed = self._py_rng.randint(1, 2**31 - 1)
+      self.traces.reassign(ancestors, copier, seed)
+      self.log_weights = log_domain_even_out(self.log_weights, P)
+    else:
+      self.mode = mode
+      self.process_cap = process_cap
+      newTraces = self._resample_traces(P)
+      self.create_trace_pool(newTraces, log_domain_even_out(self.log_weights, P))
     self.incorporate()
 
-  def _resample_traces(self, P):
+  def _resampling_unneeded(self, P, mode, process_cap):
+    if self.resampling_ess_threshold is None:
+      return False
+    if int(P) != len(self.log_weights) or mode != self.mode or \
+       process_cap != self.process_cap:
+      return False
+    ess = effectiveSampleSize(self.log_weights)
+    return ess >= self.resampling_ess_threshold * len(self.log_weights)
+
+  def _can_reuse_pool(self, P, mode, process_cap):
+    if mode != self.mode or process_cap != self.process_cap:
+      return False
+    if mode not in ['multiprocess', 'serializing', 'threaded', 'thread_ser']:
+      # Making a new sequential pool is cheap, and forking pools are
+      # resampled by forking
+      return False
+    if mode == 'multiprocess' and not is_picklable(self.engine.foreign_sps):
+      # The copier, which must reach the workers, could not
+      return False
+    return self.traces.can_reassign(int(P))
+
+  def _resample_ancestors(self, P):
     P = int(P)
-    newTraces = [None for p in range(P)]
-    used_parents = {}
     seed = self._py_rng.randint(1, 2**31 - 1)
     np_rng = npr.RandomState(seed)
-    for p in range(P):
-      parent = sampleLogCategorical(self.log_weights, np_rng) # will need to include or rewrite
-      newTrace = self._use_parent(used_parents, parent)
-      newTraces[p] = newTrace
-    return newTraces
+    return resampleLogCategorical(self.log_weights, P, np_rng,
+                                  self.resampling_scheme)
+
+  def _resample_traces(self, P):
+    used_parents = {}
+    return [self._use_parent(used_parents, parent)
+            for parent in self._resample_ancestors(P)]
 
   def _use_parent(self, used_parents, index):
     # All traces returned from calling this function with the same
@@ -227,7 +304,12 @@ if freeze has been used.
     # currently always expensive, and retrieval can be if it involves
     # serialization).  Invariant: never need to retrieve a trace more
     # than once.
+    #
+    # A forking pool needs no copies at all, because every worker
+    # process gets its own.
     if index in used_parents:
+      if self.mode == 'forking':
+        return used_parents[index]
       return self.copy_trace(used_parents[index])
     else:
       parent = self.retrieve_trace(index)
@@ -374,10 +456,15 @@ if freeze has been used.
       values = trace.dump(skipStackDictConversion=True)
       return self.restore_trace(values, skipStackDictConversion=True)
 
-  def saveable(self):
+  def saveable(self, lazy=False):
     data = {}
     data['mode'] = self.mode
-    data['traces'] = self.retrieve_dumps()
+    if lazy:
+      # Dump the traces one at a time, as the consumer gets to them
+      data['traces'] = (self.retrieve_dump(i)
+                        for i in range(len(self.log_weights)))
+    else:
+      data['traces'] = self.retrieve_dumps()
     data['log_weights'] = self.log_weights
     data['label_dict'] = self._label_to_did
     data['did_dict'] = self._did_to_label
@@ -403,6 +490,38 @@ if freeze has been used.
   def clear_profiling(self):
     self.traces.map('clear_profiling')
 
+  def set_scaffold_cache(self, enabled=True):
+    self.traces.map('set_scaffold_cache', enabled)
+
+  def scaffold_cache_stats(self):
+    return self.traces.map('scaffold_cache_stats')
+
+class TraceCopier(object):
+  """Copies, dumps, and restores traces inside the workers of a trace
+  pool, which have neither the engine nor the backend at hand."""
+
+  def __init__(self, backend, foreign_sps, seed):
+    self.backend = backend
+    self.foreign_sps = foreign_sps
+    self.py_rng = random.Random(seed)
+
+  def _mktrace(self):
+    return self.backend.trace_constructor()(self.py_rng.randint(1, 2**31 - 1))
+
+  def dump(self, trace):
+    return trace.dump()
+
+  def restore(self, values, skipStackDictConversion=False):
+    return tr.Trace.restore(self._mktrace, values, self.foreign_sps,
+                            skipStackDictConversion)
+
+  def copy(self, trace):
+    if trace.short_circuit_copyable():
+      return trace.stop_and_copy()
+    else:
+      values = trace.dump(skipStackDictConversion=True)
+      return self.restore(values, skipStackDictConversion=True)
+
 def is_picklable(obj):
   try:
     pickle.dumps(obj)
@@ -66,14 +66,25 @@ an object defines a "has_own_prng" method, and that method returns
 "set_seed" method.  If not, the Worker will assume the object relies
 on the process-global Python PRNG available in each child process.
 
+The ForkingMaster additionally supports replacing its objects by
+copies of some of them without moving any object between processes:
+each worker forks once per copy of its object, and the forked
+processes connect back to the Master over fresh connections.  The
+copies therefore share memory with their ancestors copy-on-write.
+
 For more information on the Master class hierarchy, see the docstrings
 below.
 
 '''
 
+import errno
 import multiprocessing as mp
 from multiprocessing import dummy as mpd
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+import os
 from sys import exc_info
+import threading
 from traceback import format_exc
 import random
 import numpy as np
@@ -159,35 +170,140 @@ class MasterBase(object):
 
   def _create_processes(self, objects):
     Pipe, Worker = self._pipe_and_process_types()
+    bounds = self._chunk_bounds(len(objects))
+    for (chunk_start, chunk_end) in bounds:
+      parent, child = Pipe()
+      process = Worker(objects[chunk_start:chunk_end], child)
+      process.start()
+      self.pipes.append(parent)
+      self.processes.append(process)
+    self._set_chunks(bounds)
+
+  def _chunk_bounds(self, n):
+    """The (start, end) indexes of the chunks of n objects that the
+    processes would hold."""
     if self.process_cap is None:
       base_size = 1
       extras = 0
-      chunk_ct = len(objects)
+      chunk_ct = n
     else:
-      (base_size, extras) = divmod(len(objects), self.process_cap)
-      chunk_ct = min(self.process_cap, len(objects))
+      (base_size, extras) = divmod(n, self.process_cap)
+      chunk_ct = min(self.process_cap, n)
+    bounds = []
     for chunk in range(chunk_ct):
-      parent, child = Pipe()
       if chunk < extras:
         chunk_start = chunk * (base_size + 1)
         chunk_end = chunk_start + base_size + 1
       else:
         chunk_start = extras + chunk * base_size
         chunk_end = chunk_start + base_size
-      assert chunk_end <= len(objects) # I think I wrote this code to ensure this
-      process = Worker(objects[chunk_start:chunk_end], child)
-      process.start()
-      self.pipes.append(parent)
-      self.processes.append(process)
+      assert chunk_end <= n # I think I wrote this code to ensure this
+      bounds.append((chunk_start, chunk_end))
+    return bounds
+
+  def _set_chunks(self, bounds):
+    self.chunk_sizes = []
+    self.chunk_indexes = []
+    self.chunk_offsets = []
+    for (chunk, (chunk_start, chunk_end)) in enumerate(bounds):
       self.chunk_sizes.append(chunk_end - chunk_start)
       for i in range (chunk_end - chunk_start):
         self.chunk_indexes.append(chunk)
         self.chunk_offsets.append(i)
 
+  def can_reassign(self, n):
+    """Whether the existing workers would hold n objects."""
+    return len(self._chunk_bounds(n)) == len(self.pipes)
+
+  def reassign(self, ancestors, copier, seed):
+    '''Replace the objects with copies of the objects at the given
+    indexes, keeping the workers.
+
+    Each worker first keeps as many copies of its own objects as it
+    has room for, made with copier.copy.  Only the objects whose
+    remaining copies do not fit where they are cross the pipes, once
+    each, serialized by copier.dump and rebuilt by copier.restore in
+    the workers with room.  The copier travels with the commands, so
+    must be picklable under multiprocessing.
+
+    The first new object is a copy of the object at ancestors[0], so
+    that it is distributed as that draw is (it becomes the
+    distinguished particle).  The rest are grouped by worker, so are
+    not in the order of ancestors.
+
+    '''
+    bounds = self._chunk_bounds(len(ancestors))
+    assert len(bounds) == len(self.pipes)
+    room = [end - start for (start, end) in bounds]
+    # Reserve the first slot of the first worker for ancestors[0]
+    first = ancestors[0]
+    room[0] -= 1
+    counts = {}
+    for ancestor in ancestors[1:]:
+      counts[ancestor] = counts.get(ancestor, 0) + 1
+    kept = [[] for _ in self.pipes] # [(ancestor, count)] per worker
+    surplus = [] # [(ancestor, count)]
+    for (ancestor, ct) in sorted(counts.items()):
+      chunk = self.chunk_indexes[ancestor]
+      keep = min(ct, room[chunk])
+      if keep > 0:
+        kept[chunk].append((ancestor, keep))
+        room[chunk] -= keep
+      if ct > keep:
+        surplus.append((ancestor, ct - keep))
+    moved = [[] for _ in self.pipes] # [(ancestor, count)] per worker
+    chunk = 0
+    for (ancestor, ct) in surplus:
+      while ct > 0:
+        while room[chunk] == 0: chunk += 1
+        take = min(ct, room[chunk])
+        moved[chunk].append((ancestor, take))
+        room[chunk] -= take
+        ct -= take
+    # Put the first copy in front, with any others of the same object
+    # the first worker holds
+    if self.chunk_indexes[first] == 0:
+      sources = kept[0]
+    else:
+      sources = moved[0]
+      if first not in [ancestor for (ancestor, _) in surplus]:
+        surplus.append((first, 0))
+    others = sum(ct for (ancestor, ct) in sources if ancestor == first)
+    sources[:] = [(first, others + 1)] + \
+      [(ancestor, ct) for (ancestor, ct) in sources if ancestor != first]
+
+    exports = [[] for _ in self.pipes]
+    for (ancestor, _) in surplus:
+      exports[self.chunk_indexes[ancestor]].append(ancestor)
+    dumps = {}
+    for (pipe, ixs) in zip(self.pipes, exports):
+      if ixs:
+        offsets = [self.chunk_offsets[ix] for ix in ixs]
+        pipe.send(('export_objects', (offsets, copier), {}, None))
+    for (pipe, ixs) in zip(self.pipes, exports):
+      if ixs:
+        dumps.update(zip(ixs, self.handle_one_result(pipe.recv())))
+
+    for (chunk, pipe) in enumerate(self.pipes):
+      keep = [('kept', self.chunk_offsets[ancestor], ct)
+              for (ancestor, ct) in kept[chunk]]
+      imported = [('imported', dumps[ancestor], ct)
+                  for (ancestor, ct) in moved[chunk]]
+      if chunk == 0 and self.chunk_indexes[first] != 0:
+        plan = imported[:1] + keep + imported[1:]
+      else:
+        plan = keep + imported
+      pipe.send(('reassign_objects', (plan, copier), {}, None))
+    res = [pipe.recv() for pipe in self.pipes]
+    for ans in res:
+      self.handle_one_result(ans)
+    self._set_chunks(bounds)
+    self.reset_seeds(seed)
+
   def reset_seeds(self, seed):
     assert seed is not None
     rng = random.Random(seed)
-    for i in range(len(self.processes)):
+    for i in range(len(self.pipes)):
       seeds = [rng.randint(1, 2**31 - 1) for _ in range(self.chunk_sizes[i])]
       self.map_chunk(i, 'set_seeds', seeds)
 
@@ -282,6 +398,94 @@ class MultiprocessingMaster(MasterBase):
   def _pipe_and_process_types():
     return mp.Pipe, MultiprocessingWorker
 
+class ForkingMaster(MultiprocessingMaster):
+  '''Controls ForkingWorkers, one object per process.  Like
+  MultiprocessingMaster, but can also replace its objects with copies
+  of some of them (as in resampling) by having the workers that hold
+  them fork, so the copies are inherited copy-on-write rather than
+  serialized.
+
+  '''
+  @staticmethod
+  def _pipe_and_process_types():
+    return mp.Pipe, ForkingWorker
+
+  def __init__(self, objects, _process_cap, seed, pipes=None):
+    if pipes is None:
+      # One object per process, so that each can be forked alone
+      super(ForkingMaster, self).__init__(objects, None, seed)
+    else:
+      # Adopting workers forked by another ForkingMaster's workers;
+      # they are not child processes of this one.
+      self.process_cap = None
+      self.processes = []
+      self.pipes = pipes
+      self.chunk_sizes = [1 for _ in pipes]
+      self.chunk_indexes = range(len(pipes))
+      self.chunk_offsets = [0 for _ in pipes]
+      self.reset_seeds(seed)
+
+  # Seconds to wait for the copies made by fork to report in
+  fork_timeout = 60
+
+  def fork(self, ancestors, seed):
+    '''Return a new ForkingMaster whose i-th object is a copy of
+    object ancestors[i] of this one.
+
+    Only the indexes travel over the pipes: each copy is a fork of the
+    worker process holding its ancestor, which reports to the new
+    master over a fresh connection.  The old workers remain until this
+    master is stopped.
+
+    '''
+    authkey = os.urandom(20)
+    listener = Listener(family='AF_UNIX', backlog=len(ancestors),
+                        authkey=authkey)
+    # Listener.accept has no timeout; past the deadline, wake it with a
+    # connection that reports no copy.
+    timer = threading.Timer(self.fork_timeout, _wake_listener,
+                            (listener.address, authkey))
+    timer.daemon = True
+    pipes = [None for _ in ancestors]
+    try:
+      children = [[] for _ in self.pipes]
+      for (i, ancestor) in enumerate(ancestors):
+        children[self.chunk_indexes[ancestor]].append(i)
+      for (pipe, indexes) in zip(self.pipes, children):
+        pipe.send(('fork_object', (listener.address, authkey, indexes), {},
+                   None))
+      for pipe in self.pipes:
+        self.handle_one_result(pipe.recv())
+      timer.start()
+      for _ in ancestors:
+        conn = listener.accept()
+        index = conn.recv()
+        if index is None:
+          conn.close()
+          missing = sum(1 for p in pipes if p is None)
+          raise VentureException("fatal",
+            "Timed out waiting for %d of %d forked workers" %
+            (missing, len(ancestors)))
+        pipes[index] = conn
+    except:
+      for conn in pipes:
+        if conn is not None:
+          conn.close()
+      raise
+    finally:
+      timer.cancel()
+      listener.close()
+    return ForkingMaster(None, None, seed, pipes=pipes)
+
+def _wake_listener(address, authkey):
+  try:
+    conn = Client(address, family='AF_UNIX', authkey=authkey)
+    conn.send(None)
+    conn.close()
+  except (EnvironmentError, EOFError):
+    # The listener closed in the meantime
+    pass
+
 class ThreadedSerializingMaster(MasterBase):
   '''Controls ThreadedSerializingWorkers. Communicates with
   workers via multiprocessing.dummy.Pipe. Do not use for actual
@@ -356,8 +560,10 @@ class WorkerBase(object):
   synchronously (using Safely objects to catch exceptions).
 
   '''
+  wrapper = Safely
+
   def __init__(self, objs, pipe):
-    self.objs = [Safely(o) for o in objs]
+    self.objs = [self.wrapper(o) for o in objs]
     self.pipe = pipe
     self._initialize()
 
@@ -397,6 +603,25 @@ class WorkerBase(object):
         did_set_global_prng = True
     return [None for _ in self.objs]
 
+  @safely
+  def export_objects(self, _index, offsets, copier):
+    return [copier.dump(self.objs[i].obj) for i in offsets]
+
+  @safely
+  def reassign_objects(self, _index, plan, copier):
+    # The plan lists ('kept', offset, count) or ('imported', dump,
+    # count), in the order the copies are to go in.
+    objs = []
+    for (kind, source, ct) in plan:
+      if kind == 'kept':
+        obj = self.objs[source].obj
+      else:
+        obj = copier.restore(source)
+      objs.append(obj)
+      objs.extend([copier.copy(obj) for _ in range(ct - 1)])
+    self.objs = [self.wrapper(o) for o in objs]
+    return None
+
   # Except in the true multiprocessing case (which overrides this
   # method), a Worker can just inherit the ambient PRNG from the
   # controlling Python process.
@@ -462,6 +687,63 @@ class MultiprocessingWorker(WorkerBase, MultiprocessBase):
   # of the process running it.
   def should_set_global_prng(self): return True
 
+class ForkingWorker(MultiprocessingWorker):
+  '''A MultiprocessingWorker holding one object, which can fork
+  copies of itself on behalf of ForkingMaster.fork.
+
+  '''
+  def __init__(self, objs, pipe):
+    super(ForkingWorker, self).__init__(objs, pipe)
+    self.copies = set() # Pids of the processes forked by fork_object
+
+  def run(self):
+    try:
+      super(ForkingWorker, self).run()
+    except EOFError:
+      # The master exited without stopping us, as it does not
+      # terminate workers that are not its own children.
+      pass
+
+  def poll(self):
+    done = super(ForkingWorker, self).poll()
+    self._reap_copies()
+    return done
+
+  @safely
+  def fork_object(self, _index, address, authkey, indexes):
+    self._reap_copies()
+    for index in indexes:
+      pid = os.fork()
+      if pid == 0:
+        self._serve_as_copy(address, authkey, index)
+      self.copies.add(pid)
+    return None
+
+  def _reap_copies(self):
+    # Copies that have exited would otherwise remain zombies for as
+    # long as this process runs.
+    for pid in list(self.copies):
+      try:
+        (done, _) = os.waitpid(pid, os.WNOHANG)
+      except OSError as e:
+        if e.errno != errno.ECHILD:
+          raise
+        done = pid
+      if done:
+        self.copies.remove(pid)
+
+  def _serve_as_copy(self, address, authkey, index):
+    # Runs in the forked process, and never returns into the stack of
+    # the parent's command loop.
+    try:
+      self.copies = set() # The parent's
+      self.pipe.close() # The parent's
+      self.pipe = Client(address, family='AF_UNIX', authkey=authkey)
+      self.pipe.send(index)
+      self.run()
+    finally:
+      os._exit(0)
+
 class ThreadedSerializingWorker(WorkerBase, ThreadingBase):
   '''Emulates MultiprocessingWorker by forbidding the short-cut
   around serializing the managed objects, but is implemented with
@@ -493,11 +775,9 @@ class SynchronousWorker(SharedMemoryWorkerBase, SynchronousBase):
   serialization. Controlled by SynchronousMaster.
 
   '''
-  def _initialize(self):
-    super(SynchronousWorker, self)._initialize()
-    # Re-wrap the trace objects not to capture exceptions, but to
-    # propagate them into the master.
-    self.objs = [Confidently(o.obj) for o in self.objs]
+  # Wrap the trace objects not to capture exceptions, but to propagate
+  # them into the master.
+  wrapper = Confidently
 
 ######################################################################
 # Code to handle exceptions in worker processes
@@ -743,6 +743,11 @@ class VentureScriptParser(object):
         return value_to_string(value)
     def unparse_json(self, obj):
         return json.dumps(obj)
+    def unparse_data(self, data):
+        # Bulk observations have no surface syntax; just summarize
+        if hasattr(data, '__len__'):
+            return '<%d items>' % (len(data),)
+        return '<items>'
 
     # XXX The one useful property the old parser had is that this
     # table was written once, in one place, for the parser and
@@ -755,6 +760,8 @@ class VentureScriptParser(object):
         'labeled_assume': [('symbol', unparse_symbol), ('expression', unparse_expression)],
         'observe': [('expression', unparse_expression), ('value', unparse_value)],
         'labeled_observe': [('expression', unparse_expression), ('value', unparse_value)],
+        'bulk_observe': [('expression', unparse_expression), ('data', unparse_data)],
+        'labeled_bulk_observe': [('expression', unparse_expression), ('data', unparse_data)],
         'predict': [('expression', unparse_expression)],
         'labeled_predict': [('expression', unparse_expression)],
         'forget': [('directive_id', unparse_integer)],
@@ -276,8 +276,9 @@ class Ripl():
     def _execute_parsed_instruction(self, parsed_instruction,
             stringable_instruction):
         if parsed_instruction['instruction'] in [
-                'assume', 'observe', 'predict', 'define',
-                'labeled_assume','labeled_observe','labeled_predict']:
+                'assume', 'observe', 'predict', 'define', 'bulk_observe',
+                'labeled_assume','labeled_observe','labeled_predict',
+                'labeled_bulk_observe']:
             did = self.sivm.core_sivm.engine.predictNextDirectiveId()
             self.directive_id_to_stringable_instruction[did] = (
                 stringable_instruction)
@@ -347,7 +348,12 @@ class Ripl():
         # refers to the argument's location in the string
         if e.exception == 'invalid_argument':
             # calculate the positions of the arguments
-            _, arg_ranges = p.split_instruction(instruction_string, languages)
+            try:
+                _, arg_ranges = p.split_instruction(instruction_string, languages)
+            except VentureException:
+                # The instruction has no surface syntax (as bulk
+                # observations do not); can't refine the text index.
+                arg_ranges = {}
             arg = e.data['argument']
             if arg in arg_ranges:
                 # Instruction unparses and reparses to structured
@@ -434,9 +440,10 @@ class Ripl():
                 return self._ensure_parsed_expression(value)
             elif key in ['directive_id', 'seed']:
                 return self._ensure_parsed_number(value)
-            elif key in ['options', 'params']:
+            elif key in ['options', 'params', 'data', 'apply']:
                 # Do not support partially parsed options or param
-                # hashes, since they have too many possible key types
+                # hashes, since they have too many possible key types;
+                # bulk observation data is parsed by the caller.
                 return value
             elif key in ['symbol', 'label', 'file']:
                 return value
@@ -681,7 +688,7 @@ value to be returned as a dict annotating its Venture type.
         weights = self.execute_instruction(i)['value']
         return v.vector(weights) if type else weights
 
-    def bulk_observe(self, exp, items, label=None):
+    def bulk_observe(self, exp, items, label=None, type=False):
         """Observe many evaluations of an expression.
 
 Syntax:
@@ -693,18 +700,14 @@ Operationally equivalent to::
   for x in iterable:
     ripl.observe("<expr>", x)
 
-but appreciably faster.  See also open considerations and details of
-the semantics in `observe_dataset`.
+but appreciably faster, and recorded as one directive.  See also the
+details of the semantics in `observe_dataset`.
 
 """
-        ret_vals = []
-        parsed = self._ensure_parsed_expression(exp)
-        for i, val in enumerate(items):
-          lab = label+"_"+str(i) if label is not None else None
-          ret_vals.append(self.observe(parsed, val, lab))
-        return ret_vals
+        return self._bulk_observe(exp, items, False, label, type)
 
-    def observe_dataset(self, proc_expression, iterable, label=None):
+    def observe_dataset(self, proc_expression, iterable, label=None,
+                        type=False):
         """Observe a general dataset.
 
 Syntax:
@@ -715,7 +718,10 @@ ripl.observe_dataset("<expr>", <iterable>)
   recent assume.
 
 - The `<iterable>` is a Python iterable each of whose elements must be a
-  nonempty list of valid Venture values.
+  nonempty list of valid Venture values, or a two-dimensional numpy
+  array of numbers whose rows are such lists.  It is consumed in
+  chunks, each evaluated and incorporated before the next is read, so
+  it may be a generator.
 
 - There is no Venture syntax for this; it is accessible only when
   using Venture as a library.
@@ -729,36 +735,51 @@ Semantics:
   the iterable give the arguments to the procedure given by `<expr>`,
   and the last element gives the value to observe.
 
-- The ripl method returns a list of directive ids, which correspond to
-  the individual observes thus generated.
+- The whole dataset is one directive, with one directive id and
+  label, which list_directives reports as a `bulk_observe`
+  instruction, and which is forgotten as a unit.  If any chunk fails
+  to evaluate, the whole dataset is forgotten.  Reporting it gives
+  the list of the observed values.
 
-Open issues:
+- The ripl method returns the weights of the observation, like
+  `observe`.
 
-- If the `<expr>` is itself stochastic, it is unspecified whether we
-  notionally evaluate it once per bulk_observe or once per data item.
+- The expression is evaluated once per data item, and the items are
+  not passed through the macro expander; only the expression is.
+
+Open issues:
 
 - This is not the same as directly observing sufficient statistics
   only.
 
-- It is currently not possible to forget the whole bulk_observe at
-  once.
-
-- Currently, list_directives will not respect the nesting structure of
-  observations implied by `bulk_observe`.  How can we improve this? Do
-  we represent the bulk_observe as one directive? If so, we can hardly
-  return a useful representation of the iterable representing the data
-  set. If not, we will hardly win anything because list_directives
-  will generate all those silly per-datapoint observes (every time
-  it's called!)
+- The members of the dataset are evaluated under directive ids of
+  their own, following the dataset's directive id, which are
+  therefore skipped in the numbering of subsequent directives.
 
         """
-        ret_vals = []
-        parsed = self._ensure_parsed_expression(proc_expression)
-        for i, args_val in enumerate(iterable):
-          expr = [parsed] + [v.quote(a) for a in args_val[:-1]]
-          lab = label+"_"+str(i) if label is not None else None
-          ret_vals.append(self.observe(expr, args_val[-1], lab))
-        return ret_vals
+        return self._bulk_observe(proc_expression, iterable, True, label,
+                                  type)
+
+    def _bulk_observe(self, exp, items, apply, label, type):
+        parsed = self._ensure_parsed_expression(exp)
+        if isinstance(items, np.ndarray) and items.dtype.kind in 'biuf':
+            # Kept as is, and converted item by item during evaluation
+            data = items
+        elif apply:
+            # Parsed as the Engine consumes them, a chunk at a time
+            data = ([self._ensure_parsed_expression(a) for a in item]
+                    for item in items)
+        else:
+            data = (self._ensure_parsed_expression(item) for item in items)
+        if label is None:
+            i = {'instruction':'bulk_observe', 'expression':parsed,
+                 'data':data, 'apply':apply}
+        else:
+            label = _symbolize(label)
+            i = {'instruction':'labeled_bulk_observe', 'expression':parsed,
+                 'data':data, 'apply':apply, 'label':label}
+        weights = self.execute_instruction(i)['value']
+        return v.vector(weights) if type else weights
 
     ############################################
     # Core
@@ -872,7 +893,7 @@ Open issues:
 
         if dir_type == "assume":
             print "%d: %s:\t%s" % (dir_id, dir_text, dir_val)
-        elif dir_type == "observe":
+        elif dir_type in ["observe", "bulk_observe"]:
             print "%d: %s" % (dir_id, dir_text)
         elif dir_type == "predict":
             print "%d: %s:\t %s" % (dir_id, dir_text, dir_val)
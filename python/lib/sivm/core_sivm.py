@@ -36,6 +36,7 @@ class CoreSivm(object):
 
     _implemented_instructions = {
         'assume',
+        'bulk_observe',
         'clear',
         'continuous_inference_status',
         'define',
@@ -44,6 +45,7 @@ class CoreSivm(object):
         'freeze',
         'infer',
         'labeled_assume',
+        'labeled_bulk_observe',
         'labeled_forget',
         'labeled_freeze',
         'labeled_observe',
@@ -53,6 +55,8 @@ class CoreSivm(object):
         'predict',
         'predict_all',
         'report',
+        'sample',
+        'sample_all',
         'start_continuous_inference',
         'stop_continuous_inference',
     }
@@ -138,6 +142,27 @@ class CoreSivm(object):
         did, weights = self.engine.labeled_observe(label, exp, val)
         return {'directive_id': did, 'value': weights}
 
+    def _do_bulk_observe(self, instruction):
+        exp = utils.validate_arg(instruction, 'expression',
+                utils.validate_expression, modifier=_modify_expression,
+                wrap_exception=False)
+        data = utils.validate_arg(instruction, 'data', utils.validate_data)
+        apply = utils.validate_arg(instruction, 'apply',
+                utils.validate_boolean, required=False) or False
+        did, weights = self.engine.bulk_observe(exp, data, apply)
+        return {'directive_id': did, 'value': weights}
+
+    def _do_labeled_bulk_observe(self, instruction):
+        exp = utils.validate_arg(instruction, 'expression',
+                utils.validate_expression, modifier=_modify_expression,
+                wrap_exception=False)
+        data = utils.validate_arg(instruction, 'data', utils.validate_data)
+        apply = utils.validate_arg(instruction, 'apply',
+                utils.validate_boolean, required=False) or False
+        label = utils.validate_arg(instruction, 'label', utils.validate_symbol)
+        did, weights = self.engine.labeled_bulk_observe(label, exp, data, apply)
+        return {'directive_id': did, 'value': weights}
+
     def _do_predict(self,instruction):
         exp = utils.validate_arg(instruction,'expression',
                 utils.validate_expression,modifier=_modify_expression, wrap_exception=False)
@@ -158,6 +183,18 @@ class CoreSivm(object):
         did, val = self.engine.predict_all(exp)
         return {"directive_id":did, "value":val}
 
+    def _do_sample(self,instruction):
+        exp = utils.validate_arg(instruction,'expression',
+                utils.validate_expression,modifier=_modify_expression, wrap_exception=False)
+        val = self.engine.sample(exp)
+        return {"value":val}
+
+    def _do_sample_all(self,instruction):
+        exp = utils.validate_arg(instruction,'expression',
+                utils.validate_expression,modifier=_modify_expression, wrap_exception=False)
+        val = self.engine.sample_all(exp)
+        return {"value":val}
+
     def _do_forget(self,instruction):
         did = utils.validate_arg(instruction,'directive_id',
                 utils.validate_nonnegative_integer)
@@ -118,6 +118,15 @@ def validate_boolean(b):
                 expression_index=[])
     return b
 
+def validate_data(data):
+    # An iterable of the items of a bulk observation, such as a list,
+    # a numpy array, or a generator, which is consumed in chunks
+    if not hasattr(data,'__iter__') or isinstance(data,(basestring,dict)):
+        raise VentureException('parse',
+                'Invalid data set.',
+                expression_index=[])
+    return data
+
 def validate_arg(instruction,arg,validator,modifier=lambda x: x,required=True,wrap_exception=True):
     if not arg in instruction:
         if required:
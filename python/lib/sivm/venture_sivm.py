@@ -21,6 +21,8 @@ import contextlib
 import copy
 import cStringIO as StringIO
 
+import numpy as np
+
 from venture.exception import VentureException
 from venture.sivm import utils, macro, macro_system
 import venture.value.dicts as v
@@ -40,11 +42,10 @@ class VentureSivm(object):
     # list of all instructions supported by venture sivm
     _extra_instructions = {
         'force',
-        'sample',
-        'sample_all',
     }
     _core_instructions = {
         'assume',
+        'bulk_observe',
         'clear',
         'continuous_inference_status',
         'define',
@@ -53,6 +54,7 @@ class VentureSivm(object):
         'freeze',
         'infer',
         'labeled_assume',
+        'labeled_bulk_observe',
         'labeled_forget',
         'labeled_freeze',
         'labeled_observe',
@@ -62,6 +64,8 @@ class VentureSivm(object):
         'predict',
         'predict_all',
         'report',
+        'sample',
+        'sample_all',
         'start_continuous_inference',
         'stop_continuous_inference',
     }
@@ -165,15 +169,19 @@ class VentureSivm(object):
         # desugar the expression
         if instruction_type in [
                 'assume',
+                'bulk_observe',
                 'define',
                 'evaluate',
                 'infer',
                 'labeled_assume',
+                'labeled_bulk_observe',
                 'labeled_observe',
                 'labeled_predict',
                 'observe',
                 'predict',
                 'predict_all',
+                'sample',
+                'sample_all',
         ]:
             exp = utils.validate_arg(instruction,'expression',
                     utils.validate_expression, wrap_exception=False)
@@ -205,7 +213,8 @@ class VentureSivm(object):
                 raise e, None, info[2]
             finally:
                 if instruction_type in ['define','assume','observe',
-                        'predict','predict_all','evaluate','infer']:
+                        'predict','predict_all','evaluate','infer',
+                        'sample','sample_all']:
                     # After annotation completes, clear the syntax
                     # dictionary, because the instruction was
                     # (presumably!) not recorded in the underlying
@@ -291,6 +300,10 @@ class VentureSivm(object):
             # not routed through here but can appear in stack traces.
             print "Warning: skipping annotating did %s, assumed to be synthesized by in_model" % did
             return None
+        if self._hack_skip_bulk_member(did):
+            # The members of a bulk observation are evaluated under
+            # ids of their own, which have no syntax records.
+            return None
         exp, syntax = self._get_syntax_record(did)
         index = index[1:]
 
@@ -314,13 +327,17 @@ class VentureSivm(object):
         did = index[0]
         return did not in self.syntax_dict and len(index) == 1
 
+    def _hack_skip_bulk_member(self, did):
+        return self.core_sivm.engine.is_bulk_member(did)
+
     def _register_executed_instruction(self, instruction, predicted_did,
             forgotten_did, response):
         if response is not None and 'directive_id' in response:
             if response['directive_id'] != predicted_did:
                 warning = "Warning: Instruction %s was pre-assigned did %s but actually assigned did %s"
                 print warning % (instruction, predicted_did, response['directive_id'])
-        elif predicted_did is not None:
+        elif predicted_did is not None and \
+             instruction['instruction'] not in ['sample', 'sample_all']:
             warning = "Warning: Instruction %s was pre-assigned did %s but not actually assigned any did"
             print warning % (instruction, predicted_did)
         instruction_type = instruction['instruction']
@@ -335,6 +352,11 @@ class VentureSivm(object):
                 # XXX Presume that this is a fork-model directive id
                 # collision as reported in Issue #586.
                 pass
+        if instruction_type in ['sample', 'sample_all']:
+            # "sample" evaluates as the next directive would, without
+            # becoming one
+            if predicted_did in self.syntax_dict:
+                del self.syntax_dict[predicted_did]
         if instruction_type in ['evaluate', 'infer']:
             # "evaluate" and "infer" are forgotten by the Engine;
             # forget them here, too.
@@ -410,6 +432,12 @@ class VentureSivm(object):
             ans = { 'instruction' : 'predict',
                     'expression' : directive[1]
                 }
+        elif directive[0] == 'bulk_observe':
+            ans = { 'instruction' : 'bulk_observe',
+                    'expression' : directive[1],
+                    'data' : _bulk_data(directive[2]),
+                    'apply' : directive[4]
+                }
         else:
             assert directive[0] == 'observe'
             ans = { 'instruction' : 'observe',
@@ -431,7 +459,8 @@ class VentureSivm(object):
             dids = self.core_sivm.engine.model.traces.at_distinguished('dids')
             candidates = [self._get_directive(did) for did in sorted(dids)]
             return [c for c in candidates
-                    if c['instruction'] in ['assume', 'observe', 'predict', 'predict_all']]
+                    if c['instruction'] in ['assume', 'observe', 'bulk_observe',
+                                            'predict', 'predict_all']]
 
     def labeled_get_directive(self, label):
         label = utils.validate_symbol(label)
@@ -459,37 +488,6 @@ class VentureSivm(object):
         self._call_core_sivm_instruction(inst3)
         return {"value": o1["value"]}
 
-    def _do_sample(self, instruction):
-        exp = utils.validate_arg(instruction,'expression',
-                utils.validate_expression, wrap_exception=False)
-        inst1 = {
-                'instruction' : 'predict',
-                'expression' : exp,
-                }
-        o1 = self._call_core_sivm_instruction(inst1)
-        inst2 = {
-                'instruction' : 'forget',
-                'directive_id' : o1['directive_id'],
-                }
-        self._call_core_sivm_instruction(inst2)
-        return {'value':o1['value']}
-
-    def _do_sample_all(self, instruction):
-        exp = utils.validate_arg(instruction,'expression',
-                utils.validate_expression, wrap_exception=False)
-        inst1 = {
-                'instruction' : 'predict_all',
-                'expression' : exp,
-                }
-        o1 = self._call_core_sivm_instruction(inst1)
-        inst2 = {
-                'instruction' : 'forget',
-                'directive_id' : o1['directive_id'],
-                }
-        self._call_core_sivm_instruction(inst2)
-        return {'value':o1['value']}
-
-
     ###############################
     # Convenience wrappers some popular core instructions
     # Currently supported wrappers:
@@ -550,3 +548,10 @@ class VentureSivm(object):
     def sample(self, expression):
         d = {'instruction':'sample','expression':expression}
         return self.execute_instruction(d)
+
+def _bulk_data(chunks):
+    # Bulk observations record their data in the chunks it was
+    # observed in
+    if chunks and all(isinstance(chunk, np.ndarray) for chunk in chunks):
+        return np.concatenate(chunks)
+    return [item for chunk in chunks for item in chunk]
@@ -16,15 +16,21 @@
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
 from nose import SkipTest
+from nose.tools import eq_
+import numpy as np
+import numpy.random as npr
 
+from venture.lite.sp_use import MockArgs
 from venture.test.config import backend_name
 from venture.test.config import collectSamples
 from venture.test.config import get_ripl
+from venture.test.config import in_backend
 from venture.test.config import on_inf_prim
 from venture.test.config import skipWhenRejectionSampling
 from venture.test.config import stochasticTest
 from venture.test.stats import reportKnownMean
 from venture.test.stats import statisticalTest
+import venture.lite.cmvn as cmvn
 
 @on_inf_prim("none")
 @stochasticTest
@@ -101,3 +107,64 @@ def testCMVN2D_AAA(seed):
   # print "(0," + str(Sigma12) + ")"
   # print "(0," + str(Sigma21) + ")"
   # print "(1.81," + str(Sigma22) + ")"
+
+@in_backend('none')
+@on_inf_prim('none') # Gets run in the misc build
+def testIncrementalPosterior():
+  # The posterior maintained incrementally in the aux should agree with
+  # recomputing it from the sufficient statistics.
+  np_rng = npr.RandomState(0)
+  d = 4
+  psp = cmvn.CMVNOutputPSP(d, np.mat(np_rng.randn(d)).T, 1.5, d + 2.,
+                           2 * np.eye(d))
+  aux = cmvn.CMVNSPAux(d)
+  args = MockArgs([], aux, np_rng=np_rng)
+
+  def check():
+    x = np_rng.randn(d)
+    posterior = aux.cachedPosterior(psp)
+    expected = cmvn.CMVNPosterior.compute(psp, aux)
+    np.testing.assert_allclose(posterior.mN, expected.mN)
+    np.testing.assert_allclose(posterior.L, expected.L)
+    (mu, Sigma, v) = psp.getMVTParams(aux)
+    np.testing.assert_allclose(
+      psp.logDensity(x, args),
+      float(cmvn.mvtLogDensity(np.mat(x).T, mu, Sigma, v)))
+
+  xs = [np_rng.randn(d) for _ in range(6)]
+  check()
+  for x in xs:
+    psp.incorporate(x, args)
+  check()
+  copied = aux.copy()
+  for x in xs[:3]:
+    psp.unincorporate(x, args)
+  check()
+  eq_(6, copied.N)
+  aux = copied
+  args = MockArgs([], aux, np_rng=np_rng)
+  check()
+
+@in_backend('none')
+@on_inf_prim('none') # Gets run in the misc build
+def testIncrementalPosteriorRefactors():
+  # Rank-one updates give way to refactoring every d of them, and
+  # after a downdate that cancels most of a pivot.
+  np_rng = npr.RandomState(0)
+  d = 3
+  psp = cmvn.CMVNOutputPSP(d, np.mat(np.zeros(d)).T, 1.0, d + 2.,
+                           np.eye(d))
+  aux = cmvn.CMVNSPAux(d)
+  args = MockArgs([], aux, np_rng=np_rng)
+  for _ in range(20):
+    psp.incorporate(np_rng.randn(d), args)
+    posterior = aux.cachedPosterior(psp)
+    assert posterior.updates < d
+    np.testing.assert_allclose(
+      posterior.L, cmvn.CMVNPosterior.compute(psp, aux).L)
+
+  posterior = cmvn.CMVNPosterior(None, np.zeros(2), 2, 5., np.eye(2))
+  # Removing x downdates by sqrt(2) x, leaving a first pivot of
+  # sqrt(1 - 2 x_0^2)
+  assert posterior.unincorporate(np.array([0.5, 0])) is not None
+  eq_(None, posterior.unincorporate(np.array([(1 - 1e-7) / np.sqrt(2), 0])))
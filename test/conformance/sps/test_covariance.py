@@ -225,3 +225,43 @@ def test_sum_se_bump():
               assert_allclose(k[0][0], f())
               return dk
             check_ddtheta(f, df_dtheta, theta)
+
+def test_sqeuclidean_cache():
+  import scipy.spatial.distance
+  cov.clear_r2_cache()
+  np_rng = np.random.RandomState(0)
+  X = np_rng.randn(7, 2)
+  Y = np_rng.randn(4, 2)
+  for (A, B) in [(X, Y), (Y, X), (X, X), (X[:1], X[:1])]:
+    r2 = cov._sqeuclidean(A, B)
+    assert_allclose(r2, scipy.spatial.distance.cdist(A, B, 'sqeuclidean'))
+    assert not r2.flags.writeable
+    # Equal inputs reuse the same distances
+    assert np.may_share_memory(cov._sqeuclidean(A.copy(), B.copy()), r2)
+  # The transposed pair shares its entry
+  assert cov._r2_cache_elements == 7*4 + 7*7 + 1
+  # New kernel parameters at the same inputs agree with fresh distances
+  for l2 in [.1, 1, 10]:
+    k, _ = cov.se(l2).df_theta(X, Y)
+    assert_allclose(k, cov.se(l2).f(X, Y))
+    assert_allclose(
+      k, np.exp(-0.5*scipy.spatial.distance.cdist(X, Y, 'sqeuclidean')/l2))
+  cov.clear_r2_cache()
+  assert cov._r2_cache_elements == 0
+  assert not cov._r2_cache
+
+def test_sqeuclidean_cache_bound():
+  cov.clear_r2_cache()
+  bound = cov._r2_cache_bound
+  try:
+    cov.set_r2_cache_bound(60)
+    np_rng = np.random.RandomState(0)
+    for _ in range(5):
+      X = np_rng.randn(7, 2)
+      cov._sqeuclidean(X, X)
+      assert cov._r2_cache_elements <= 60
+    # Only the most recent survives
+    assert cov._r2_cache_elements == 49
+  finally:
+    cov.set_r2_cache_bound(bound)
+    cov.clear_r2_cache()
@@ -21,9 +21,12 @@ from nose.tools import eq_
 from nose.tools import assert_almost_equal
 import numpy.random as npr
 
+from venture.lite.crp import CRPOutputPSP
+from venture.lite.crp import CRPSPAux
 from venture.lite.crp import log_prob_num_tables
 from venture.lite.crp import log_density_crp_joint
 from venture.lite.crp import sample_num_tables
+from venture.lite.sp_use import MockArgs
 from venture.test.config import collectSamples
 from venture.test.config import get_ripl
 from venture.test.config import gen_in_backend
@@ -102,6 +105,54 @@ def check_number_of_tables(alpha, seed):
 def test_crp_logdensity_joint_smoke():
   eq_(-6.666193142143909, log_density_crp_joint((1, 1, 2, 3, 4), 0.4))
 
+@in_backend('none')
+def test_crp_aux_copies_are_independent():
+  class Customer(object): pass
+  psp = CRPOutputPSP(1.0, 0)
+  aux = CRPSPAux()
+  args = MockArgs([], aux)
+  for table in [1, 1, 2, 3]:
+    psp.incorporate(table, args)
+  aux2 = aux.copy()
+  args2 = MockArgs([], aux2)
+  args2.node = Customer()
+  psp.unincorporate(2, args2)
+  psp.unincorporate(1, args2)
+  psp.incorporate(4, args2)
+  eq_([(1, 2), (2, 1), (3, 1)], list(aux.tableCounts.iteritems()))
+  eq_([], list(aux.freeTables))
+  eq_([(1, 1), (3, 1), (4, 1)], list(aux2.tableCounts.iteritems()))
+  eq_([2], list(aux2.freeTables))
+  eq_((3, 4), (aux.numTables, aux.numCustomers))
+  eq_((3, 3), (aux2.numTables, aux2.numCustomers))
+
+@in_backend('none')
+def test_crp_incremental_log_density_of_data():
+  # The maintained log density of the seating agrees with the sum of
+  # the predictive densities, under removals and a change of discount.
+  class Customer(object): pass
+  aux = CRPSPAux()
+  args = MockArgs([], aux)
+  args.node = Customer()
+  psp = CRPOutputPSP(1.5, 0.3)
+  logp = 0
+  for table in [1, 1, 2, 1, 3, 2, 4]:
+    logp += psp.logDensity(table, args)
+    psp.incorporate(table, args)
+  assert_almost_equal(logp, psp.logDensityOfData(aux))
+  for table in [1, 4]:
+    psp.unincorporate(table, args)
+    logp -= psp.logDensity(table, args)
+  assert_almost_equal(logp, psp.logDensityOfData(aux))
+  psp2 = CRPOutputPSP(1.5, 0.5)
+  aux2 = CRPSPAux()
+  args2 = MockArgs([], aux2)
+  logp2 = 0
+  for table in [1, 1, 2, 3, 2]:
+    logp2 += psp2.logDensity(table, args2)
+    psp2.incorporate(table, args2)
+  assert_almost_equal(logp2, psp2.logDensityOfData(aux))
+
 @gen_on_inf_prim("none")
 def testLogDensityOfData():
   # Ensures that the logDensityOfData of the CRP (represented by the
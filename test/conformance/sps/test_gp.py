@@ -456,3 +456,35 @@ def test_linear_gradient_2d(seed):
   ripl.observe('(normal baz 1)', -7)
   ripl.infer('(gradient_ascent default one 0.01 5 5)')
   ripl.sample('(gp (array (array 2 3) (array 5 7)))')
+
+@in_backend('none')
+@on_inf_prim('none') # Gets run in the misc build
+def testIncrementalCovarianceFactor():
+  # The covariance factor maintained incrementally in the GP's aux
+  # should agree with factoring the covariance matrix afresh.
+  np_rng = npr.RandomState(0)
+  covariance = cov.sum(cov.scale(2.1**2, cov.se(1.8**2)), cov.delta(1e-8))
+  aux = gp.GPSPAux(OrderedDict())
+
+  def check():
+    xs = np.array(aux.samples.keys())
+    sigma = covariance.f(xs, xs)
+    covf = aux.covariance_factor(covariance)
+    y = np_rng.randn(len(xs))
+    np.testing.assert_allclose(covf.solve(y), np.linalg.solve(sigma, y))
+    np.testing.assert_allclose(
+      covf.logsqrtdet(), np.linalg.slogdet(sigma)[1]/2)
+
+  aux.incorporate(covariance, np_rng.randn(5), np_rng.randn(5))
+  check()
+  aux.incorporate(covariance, np_rng.randn(3), np_rng.randn(3))
+  check()
+  copied = aux.copy()
+  aux.unincorporate(covariance, aux.samples.keys()[2:4])
+  check()
+  aux.unincorporate(covariance, aux.samples.keys()[-1:])
+  aux.incorporate(covariance, [17.], [1.])
+  check()
+  eq_(8, len(copied.samples))
+  aux = copied
+  check()
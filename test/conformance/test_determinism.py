@@ -77,6 +77,8 @@ def testDeterminismSmoke():
                "(do (resample_thread_ser 3) (sample_all (normal 0 1)))",
                "(do (resample_multiprocess 3) (sample_all (normal 0 1)))",
                "(do (resample_multiprocess 3 2) (sample_all (normal 0 1)))",
+               "(do (resample_forking 3) (sample_all (normal 0 1)))",
+               "(do (resample_forking 3) (resample_forking 3) (sample_all (normal 0 1)))",
                ]:
     yield checkDeterminismSmoke, prog, False, 1, list
 
@@ -0,0 +1,76 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+from nose.tools import eq_
+
+from venture.test.config import broken_in
+from venture.test.config import default_num_samples
+from venture.test.config import get_ripl
+from venture.test.config import on_inf_prim
+from venture.test.stats import reportKnownDiscrete
+from venture.test.stats import statisticalTest
+
+@on_inf_prim("none")
+@broken_in("puma", "Puma samples by predicting and forgetting.")
+def testSampleLeavesModelAlone():
+  ripl = get_ripl()
+  ripl.assume("crp", "(make_crp 1)")
+  ripl.assume("f", "(mem (lambda (i) (normal i 1)))")
+  ripl.observe("(crp)", "atom<1>")
+  ripl.predict("(f 1)")
+  engine = ripl.sivm.core_sivm.engine
+  counter = engine.directiveCounter
+  choices = engine.getDistinguishedTrace().numRandomChoices()
+  ripl.sample("(list (crp) (crp) (f 1) (f 2) (f 3))")
+  ripl.sample_all("(f 4)")
+  eq_(counter, engine.directiveCounter)
+  ripl.infer("(collect (crp) (f 5))")
+  eq_(choices, engine.getDistinguishedTrace().numRandomChoices())
+  eq_({1: 1}, dict(ripl.sample("crp")["counts"]))
+
+@on_inf_prim("none")
+def testSampleReusesFamilies():
+  ripl = get_ripl()
+  ripl.assume("f", "(mem (lambda (i) (normal i 1)))")
+  ripl.predict("(f 1)", label="pid")
+  eq_(ripl.report("pid"), ripl.sample("(f 1)"))
+  [a, b] = ripl.sample("(list (f 2) (f 2))")
+  eq_(a, b)
+
+@statisticalTest
+@on_inf_prim("none")
+def testSampleSeesItsOwnDraws(seed):
+  # The second draw of a collapsed procedure in one sample is
+  # conditioned on the first, as it would be in a predict.
+  ripl = get_ripl(seed=seed)
+  ripl.assume("c", "(make_beta_bernoulli 1 1)")
+  ripl.observe("(c)", True)
+  def draw():
+    return tuple(ripl.sample("(list (c) (c))"))
+  predictions = [draw() for _ in range(default_num_samples())]
+  return reportKnownDiscrete([((True, True), 1/2.0),
+                              ((True, False), 1/6.0),
+                              ((False, True), 1/6.0),
+                              ((False, False), 1/6.0)], predictions)
+
+@on_inf_prim("none")
+def testSampleFallsBackOnLatents():
+  ripl = get_ripl()
+  ripl.assume("h",
+    "(make_lazy_hmm (simplex 0.5 0.5) (id_matrix 2) (id_matrix 2))")
+  # The hmm's states are latent, so sample has to predict and forget
+  assert ripl.sample("(h 3)") in [0, 1]
+  eq_(1, len(ripl.list_directives()))
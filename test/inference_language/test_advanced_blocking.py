@@ -254,3 +254,31 @@ assume datum    = mem((i, d) ~> {{                   // Per-datapoint:
     /?row==integer<3>/?clustering,
     /?row==integer<4>/?clustering)));
   get_current_values(s)}"""))
+
+@broken_in("puma", "Puma does not implement subproblem selection")
+def testTraceSearchReplaysPath():
+  # The density of a search path is that of replaying its choices,
+  # which is zero once one of them no longer exists
+  import math
+  from venture.untraced.trace_search import Extent
+  from venture.untraced.trace_search import MinimalSubproblem
+  from venture.untraced.trace_search import Random1
+  from venture.untraced.trace_search import Top
+  from venture.untraced.trace_search import TraceSearchIndexer
+  r = get_ripl()
+  r.assume("c", "(flip)")
+  r.assume("x", "(if c (normal 0 1) (normal 5 1))")
+  trace = r.sivm.core_sivm.engine.getDistinguishedTrace()
+  c_node = trace.families.values()[0]
+  indexer = TraceSearchIndexer(MinimalSubproblem(Random1(Extent(Top()))))
+  for _ in range(50):
+    index = indexer.sampleIndex(trace)
+    eq_(math.log(0.5), indexer.logDensityOfIndex(trace, index))
+    eq_(math.log(0.5), indexer.logDensityOfIndex(trace, index))
+    [chosen] = index.getPrincipalNodes()
+    if chosen is not c_node:
+      break
+  else:
+    assert False, "Never chose the branch"
+  r.force("c", not r.sample("c"))
+  eq_(float("-inf"), indexer.logDensityOfIndex(trace, index))
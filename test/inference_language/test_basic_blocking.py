@@ -137,6 +137,21 @@ def testBlockingExample5(seed):
     assert olda != newa
     assert oldb != newb
 
+@statisticalTest
+@broken_in("puma", "Puma does not support the 'one_by_size' block keyword (yet).")
+@on_inf_prim("mh")
+def testBlockingBySize(seed):
+  # Blocks of different sizes, chosen in proportion to their sizes,
+  # must still leave the posterior invariant
+  ripl = get_ripl(seed=seed)
+  ripl.assume("a", "(tag 0 0 (normal 0.0 1.0))", label="pid")
+  ripl.assume("b", "(tag 0 1 (normal 0.0 1.0))")
+  ripl.assume("c", "(tag 0 1 (normal 0.0 1.0))")
+  ripl.observe("(normal (+ a b c) 1.0)", 3.0)
+  predictions = collectSamples(ripl, "pid",
+                               infer="(resimulation_mh 0 one_by_size 20)")
+  return reportKnownGaussian(0.75, math.sqrt(0.75), predictions)
+
 @statisticalTest
 @broken_in('puma', "rejection is not implemented in Puma")
 @on_inf_prim("rejection")
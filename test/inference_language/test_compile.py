@@ -0,0 +1,48 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+from nose.tools import eq_
+
+from venture.test.config import get_ripl
+from venture.test.config import on_inf_prim
+
+def run_program(compiled, program):
+  ripl = get_ripl(seed=4, persistent_inference_trace=True)
+  ripl.sivm.core_sivm.engine.set_inference_compilation(compiled)
+  ripl.assume("x", "(normal 0 1)")
+  return ripl.infer(program)
+
+@on_inf_prim("mh")
+def testCompiledMatchesInterpreted():
+  # Compilation consumes the same random numbers as interpretation,
+  # so the answers agree exactly.
+  program = """
+(do (xs <- (mapM (lambda (i) (return (normal 0 i))) (list 1 2 3)))
+    (repeat 3 (mh default one 1))
+    (let ((f (lambda (y) (if (< y 0) (- 0 y) y))))
+      (do (y <- (sample x))
+          (return (pair (f y) xs)))))"""
+  eq_(run_program(False, program), run_program(True, program))
+
+@on_inf_prim("none")
+def testCompiledShadowing():
+  program = """
+(let ((x 1))
+  (let ((f (lambda (x) (lambda (y) (+ x y))))
+        (make_csp (lambda (ids body) 7)))
+    (return (pair ((f 2) x) (lambda (z) z)))))"""
+  eq_(run_program(False, program), run_program(True, program))
@@ -203,3 +203,35 @@ def testSubproblemSelection():
   get_ripl(init_mode='venture_script').execute_program('''
 assume x = normal(0, 1) #hyper:0;
 infer hmc(minimal_subproblem(/?hyper==0), 0.01, 1, 1)''')
+
+@broken_in('puma', "HMC only implemented in Lite.  Issue: https://app.asana.com/0/11192551635048/9277449877754")
+@statisticalTest
+@on_inf_prim("adaptive_hmc")
+def testAdaptiveNormalWithObserve(seed):
+  # Same posterior as testNormalWithObserve1, with a badly scaled
+  # prior for the adaptation to correct.
+  ripl = get_ripl(seed=seed)
+  ripl.assume("a", "(* 100 (normal 0.1 0.01))", label="pid")
+  ripl.observe("(normal a 1.0)", 14.0)
+  predictions = collectSamples(ripl, "pid",
+                               infer="(adaptive_hmc default one 10 40 50)")
+  return reportKnownGaussian(12, math.sqrt(0.5), predictions)
+
+@broken_in('puma', "HMC only implemented in Lite.  Issue: https://app.asana.com/0/11192551635048/9277449877754")
+@on_inf_prim("adaptive_hmc")
+def testAdaptationPersists():
+  ripl = get_ripl()
+  ripl.assume("x", "(tag 'param 0 (normal 0 10))")
+  ripl.assume("y", "(tag 'param 1 (normal 0 0.1))")
+  ripl.observe("(normal x 1)", 3)
+  ripl.infer("(adaptive_hmc 'param all 5 60 40)")
+  trace = ripl.sivm.core_sivm.engine.getDistinguishedTrace()
+  [adaptation] = trace.hmc_adaptations.values()
+  assert adaptation.count == 40
+  assert adaptation.adapting()
+  ripl.infer("(adaptive_hmc 'param all 5 60 40)")
+  assert adaptation is trace.hmc_adaptations.values()[0]
+  assert adaptation.count == 60
+  assert not adaptation.adapting()
+  # The mass matrix reflects the very different scales of x and y
+  assert adaptation.inv_mass[0] > 10 * adaptation.inv_mass[1]
@@ -0,0 +1,180 @@
+# Copyright (c) 2015 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+import scipy.integrate as integrate
+import scipy.stats as stats
+
+from venture.lite.infer.batch_mh import _batchPlan
+from venture.lite.infer.batch_mh import _batchPlans
+from venture.lite.value import VentureSymbol
+from venture.test.config import broken_in
+from venture.test.config import collectSamples
+from venture.test.config import default_num_transitions_per_sample
+from venture.test.config import get_ripl
+from venture.test.config import on_inf_prim
+from venture.test.stats import reportKnownContinuous
+from venture.test.stats import reportKnownDiscrete
+from venture.test.stats import reportKnownGaussian
+from venture.test.stats import reportKnownMean
+from venture.test.stats import statisticalTest
+
+def batchInfer():
+  return "(mh_batch 'latent each %d)" % default_num_transitions_per_sample()
+
+def batchedBlocks(ripl):
+  """The blocks of the latent scope that a batch MH sweep would
+  transition together, and those it would leave to scalar MH."""
+  trace = ripl.sivm.core_sivm.engine.getDistinguishedTrace()
+  scope = VentureSymbol("latent")
+  (plans, scalar) = _batchPlans(trace, scope, trace.getScope(scope).keys())
+  return ([plan.block for plan in plans], scalar)
+
+def assertAllBatched(ripl, n):
+  (batched, scalar) = batchedBlocks(ripl)
+  assert len(batched) == n
+  assert scalar == []
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchGaussians(seed):
+  # Many independent conjugate pairs, all batched together.  Each
+  # posterior is normal with mean 12, precision 2.
+  ripl = get_ripl(seed=seed)
+  for i in range(20):
+    ripl.assume("x%d" % i, "(tag 'latent %d (normal 10.0 1.0))" % i)
+    ripl.observe("(normal x%d 1.0)" % i, 14.0)
+  ripl.predict("x7", label="pid")
+  assertAllBatched(ripl, 20)
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  return reportKnownGaussian(12, math.sqrt(0.5), predictions)
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchGammaPoisson(seed):
+  # Posterior on each rate is gamma with shape 5 and rate 2.
+  ripl = get_ripl(seed=seed)
+  for i in range(20):
+    ripl.assume("r%d" % i, "(tag 'latent %d (gamma 2.0 1.0))" % i)
+    ripl.observe("(poisson r%d)" % i, 3)
+  ripl.predict("r4", label="pid")
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  cdf = stats.gamma(5, scale=0.5).cdf
+  return reportKnownContinuous(cdf, predictions, "gamma(5, 2)")
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchFlips(seed):
+  # Each flip reaches its child through an if, which is not a
+  # passthrough, so no block here can be batched: this checks that
+  # every block falls back to an ordinary scalar transition.
+  # Posterior on each flip is 0.9 True.
+  ripl = get_ripl(seed=seed)
+  for i in range(10):
+    ripl.assume("z%d" % i, "(tag 'latent %d (flip 0.5))" % i)
+    ripl.observe("(flip (if z%d 0.9 0.1))" % i, True)
+  ripl.predict("z3", label="pid")
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  return reportKnownDiscrete([[True, 0.9], [False, 0.1]], predictions)
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchBernoulliLatents(seed):
+  # Latent bernoullis observed through normals.  Posterior on each is
+  # 1 with probability 0.3 N(1.5; 1, 1) / (that + 0.7 N(1.5; 0, 1)).
+  ripl = get_ripl(seed=seed)
+  for i in range(10):
+    ripl.assume("z%d" % i, "(tag 'latent %d (bernoulli 0.3))" % i)
+    ripl.observe("(normal z%d 1.0)" % i, 1.5)
+  ripl.predict("z3", label="pid")
+  assertAllBatched(ripl, 10)
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  on = 0.3 * stats.norm.pdf(1.5, loc=1)
+  off = 0.7 * stats.norm.pdf(1.5, loc=0)
+  return reportKnownDiscrete([[1, on / (on + off)], [0, off / (on + off)]],
+                             predictions)
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchBernoulliChildren(seed):
+  # Uniform weights of observed flips.  Posterior on each is beta(2, 1).
+  ripl = get_ripl(seed=seed)
+  for i in range(10):
+    ripl.assume("p%d" % i, "(tag 'latent %d (uniform_continuous 0.0 1.0))" % i)
+    ripl.observe("(flip p%d)" % i, True)
+  ripl.predict("p3", label="pid")
+  assertAllBatched(ripl, 10)
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  return reportKnownContinuous(stats.beta(2, 1).cdf, predictions, "beta(2, 1)")
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchStudentTNoScale(seed):
+  # student_t with a location but no scale
+  ripl = get_ripl(seed=seed)
+  for i in range(10):
+    ripl.assume("a%d" % i, "(tag 'latent %d (student_t 2.0 1.0))" % i)
+    ripl.observe("(normal a%d 1.0)" % i, 3.0)
+  ripl.predict("a3", label="pid")
+  assertAllBatched(ripl, 10)
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  def postprop(a):
+    return stats.t(2, loc=1).pdf(a) * stats.norm(loc=3).pdf(a)
+  (normalize, _) = integrate.quad(postprop, -20, 20)
+  (meana, _) = integrate.quad(lambda x: x * postprop(x), -20, 20)
+  (meanasq, _) = integrate.quad(lambda x: x * x * postprop(x), -20, 20)
+  meana /= normalize
+  vara = meanasq / normalize - meana * meana
+  return reportKnownMean(meana, predictions, variance=vara)
+
+@broken_in('puma', "Batch MH only implemented in Lite.")
+@statisticalTest
+@on_inf_prim("mh_batch")
+def testBatchSharedChild(seed):
+  # The two latents share an absorbing child, so although either could
+  # be batched alone, only the first is; the other gets a scalar
+  # transition.  Posterior on a is proportional to N(a; 0, 1) times
+  # the integral over b in [0.5, 1.5] of N(2.4; a, b).
+  ripl = get_ripl(seed=seed)
+  ripl.assume("a", "(tag 'latent 0 (normal 0.0 1.0))", label="pid")
+  ripl.assume("b", "(tag 'latent 1 (uniform_continuous 0.5 1.5))")
+  ripl.observe("(normal a b)", 2.4)
+  trace = ripl.sivm.core_sivm.engine.getDistinguishedTrace()
+  scope = VentureSymbol("latent")
+  for block in trace.getScope(scope).keys():
+    assert _batchPlan(trace, scope, block) is not None
+  (batched, scalar) = batchedBlocks(ripl)
+  assert len(batched) == 1
+  assert len(scalar) == 1
+  predictions = collectSamples(ripl, "pid", infer=batchInfer())
+  def postprop(a):
+    (lik, _) = integrate.quad(
+      lambda b: stats.norm.pdf(2.4, loc=a, scale=b), 0.5, 1.5)
+    return stats.norm.pdf(a) * lik
+  (normalize, _) = integrate.quad(postprop, -10, 10)
+  (meana, _) = integrate.quad(lambda x: x * postprop(x), -10, 10)
+  (meanasq, _) = integrate.quad(lambda x: x * x * postprop(x), -10, 10)
+  meana /= normalize
+  vara = meanasq / normalize - meana * meana
+  return reportKnownMean(meana, predictions, variance=vara)
@@ -15,11 +15,16 @@
 # You should have received a copy of the GNU General Public License
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import threading
 
-from nose.tools import eq_
 from nose import SkipTest
+from nose.tools import assert_raises
+from nose.tools import eq_
 
+from venture.exception import VentureException
+from venture.multiprocess import ForkingMaster
+from venture.multiprocess import ForkingWorker
 from venture.test.config import default_num_samples
 from venture.test.config import gen_on_inf_prim
 from venture.test.config import get_ripl
@@ -41,7 +46,8 @@ def checkSynchronousIsSerial(mode):
 
 @gen_on_inf_prim("resample")
 def testResamplingSmoke():
-  for mode in ["", "_serializing", "_threaded", "_thread_ser", "_multiprocess"]:
+  for mode in ["", "_serializing", "_threaded", "_thread_ser", "_multiprocess",
+               "_forking"]:
     yield checkResamplingSmoke, mode
 
 @statisticalTest
@@ -79,6 +85,80 @@ def testResamplingSmoke4(seed):
   eq_(n, len(predictions))
   return reportKnownGaussian(0, 1, predictions)
 
+@on_inf_prim("resample_forking")
+def testForkingResample():
+  r = get_ripl()
+  r.infer("(resample_forking 20)")
+  r.assume("x", "(flip 0.5)")
+  r.observe("(normal (if x 0 100) 1)", 0)
+  # Resamples by forking the workers, which should select the
+  # particles that explain the observation
+  r.infer("(resample_forking 10)")
+  eq_([True] * 10, r.sample_all("x"))
+  # Reseeded after forking
+  eq_(10, len(set(r.sample_all("(normal 0 1)"))))
+  # The forked workers can run inference and be forked in turn
+  r.infer("(resimulation_mh default one 5)")
+  r.infer("(resample_forking 4)")
+  eq_([True] * 4, r.sample_all("x"))
+
+@on_inf_prim("resample_forking")
+def testForkingTimesOut():
+  # Copies that die before reporting in must neither hang the master
+  # nor stay zombies of the workers that forked them
+  if not os.path.exists("/proc/self/stat"):
+    raise SkipTest("Needs /proc to find zombie processes")
+  serve = ForkingWorker._serve_as_copy
+  ForkingWorker._serve_as_copy = lambda self, *args: os._exit(0)
+  try:
+    master = ForkingMaster([1, 2], None, 1)
+  finally:
+    ForkingWorker._serve_as_copy = serve
+  master.fork_timeout = 0.5
+  assert_raises(VentureException, master.fork, [0, 1, 1], 2)
+  # The workers reap after each command
+  master.reset_seeds(3)
+  master.reset_seeds(4)
+  for process in master.processes:
+    eq_([], zombieChildren(process.pid))
+
+def zombieChildren(pid):
+  zombies = []
+  for entry in os.listdir("/proc"):
+    if not entry.isdigit():
+      continue
+    try:
+      with open("/proc/%s/stat" % entry) as f:
+        stat = f.read()
+    except IOError:
+      continue
+    # The fields after the parenthesized command are the state and
+    # the parent pid
+    fields = stat.rsplit(")", 1)[1].split()
+    if fields[0] == "Z" and int(fields[1]) == pid:
+      zombies.append(int(entry))
+  return zombies
+
+@gen_on_inf_prim("resample")
+def testResamplingKeepsPool():
+  for mode in ["_serializing", "_threaded", "_thread_ser", "_multiprocess"]:
+    yield checkResamplingKeepsPool, mode
+
+def checkResamplingKeepsPool(mode):
+  r = get_ripl()
+  resample = "(resample%s 20)" % mode if mode != "_multiprocess" \
+             else "(resample_multiprocess 20 3)"
+  r.infer(resample)
+  pool = r.sivm.core_sivm.engine.model.traces
+  r.assume("x", "(flip 0.5)")
+  r.observe("(normal (if x 0 100) 1)", 0)
+  r.infer(resample)
+  # The workers exchanged the surviving particles rather than being
+  # replaced
+  assert pool is r.sivm.core_sivm.engine.model.traces
+  eq_([True] * 20, r.sample_all("x"))
+  eq_(20, len(set(r.sample_all("(normal 0 1)"))))
+
 @on_inf_prim("resample_serializing")
 def testSerializingTracesWithRandomSPs():
   # Check that the presence of random variables that are SPs does not
@@ -61,14 +61,16 @@ def checkPGibbsBasic2(in_parallel, seed):
 # Not the same test generator because I want to annotate them differently.
 @gen_on_inf_prim("pgibbs")
 def testPGibbsBlockingMHHMM1():
-  yield checkPGibbsBlockingMHHMM1, "pgibbs"
+  yield checkPGibbsBlockingMHHMM1, "pgibbs", None
+  yield checkPGibbsBlockingMHHMM1, "pgibbs", 0.5
 
 @gen_on_inf_prim("func_pgibbs")
 def testFuncPGibbsBlockingMHHMM1():
-  yield checkPGibbsBlockingMHHMM1, "func_pgibbs"
+  yield checkPGibbsBlockingMHHMM1, "func_pgibbs", None
+  yield checkPGibbsBlockingMHHMM1, "func_pgibbs", 0.5
 
 @statisticalTest
-def checkPGibbsBlockingMHHMM1(operator, seed):
+def checkPGibbsBlockingMHHMM1(operator, ess_threshold, seed):
   # The point of this is that it should give reasonable results in
   # very few transitions but with a large number of particles.
   ripl = get_ripl(seed=seed)
@@ -93,9 +95,14 @@ def checkPGibbsBlockingMHHMM1(operator, seed):
   ripl.predict("x4",label="pid")
 
   if ignore_inference_quality():
-    infer = "(%s 0 ordered 3 2)" % operator
+    (particles, transitions) = (3, 2)
   else:
-    infer = "(%s 0 ordered 20 10)" % operator
+    (particles, transitions) = (20, 10)
+  if ess_threshold is None:
+    infer = "(%s 0 ordered %d %d)" % (operator, particles, transitions)
+  else:
+    infer = "(%s 0 ordered %d %s %d)" % \
+      (operator, particles, ess_threshold, transitions)
 
   predictions = collectSamples(ripl,"pid",infer=infer)
   return reportKnownGaussian(390.0/89.0, math.sqrt(55/89.0), predictions)
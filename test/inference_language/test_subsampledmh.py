@@ -17,6 +17,7 @@
 
 import numpy as np
 import scipy.stats as stats
+from nose import SkipTest
 from nose.plugins.attrib import attr
 
 from venture.lite.infer.subsampled_mh import sequentialTest
@@ -81,6 +82,62 @@ def testNormalWithObserves2(seed):
   predictions = collectSamples(ripl,"pid",infer="(subsampled_mh default one 2 3 0.01 true %f false 50)" % post_std)
   return reportKnownContinuous(cdf, predictions, "N(%f,%f^2)" % (post_mean, post_std))
 
+@broken_in('puma', "Subsampled MH only implemented in Lite.")
+@on_inf_prim("subsampled_mh")
+def testStaleSectionsRefreshedOnRead():
+  # Loose epsilon makes the sequential test stop early, leaving local
+  # sections stale; reading them must bring them up to date.
+  ripl = get_ripl()
+  ripl.assume("mu", "(normal 0 1)")
+  N = 20
+  for i in range(N):
+    ripl.assume("m%d" % i, "(* 2 mu)")
+    ripl.observe("(normal m%d 1)" % i, np.random.normal(1, 1))
+  for _ in range(10):
+    ripl.infer("(subsampled_mh default one 2 3 0.5 false 0 false 5)")
+    mu = ripl.sample("mu")
+    for i in range(N):
+      assert abs(ripl.sample("m%d" % i) - 2 * mu) < 1e-10
+
+def leaveStaleSections(ripl, N):
+  ripl.assume("mu", "(normal 0 1)")
+  for i in range(N):
+    ripl.assume("m%d" % i, "(* 2 mu)")
+    ripl.observe("(normal m%d 1)" % i, np.random.normal(1, 1))
+  trace = ripl.sivm.core_sivm.engine.getDistinguishedTrace()
+  for _ in range(50):
+    ripl.infer("(subsampled_mh default one 2 3 0.5 false 0 false 5)")
+    if trace.stale_sections is not None and trace.stale_sections.borders:
+      return trace
+  return None
+
+@broken_in('puma', "Subsampled MH only implemented in Lite.")
+@on_inf_prim("subsampled_mh")
+def testNewDirectiveRefreshesOnlyWhatItReads():
+  ripl = get_ripl()
+  trace = leaveStaleSections(ripl, 20)
+  if trace is None:
+    raise SkipTest("No proposal left a local section stale")
+  # Reading the global border needs no local section
+  ripl.predict("(* 3 mu)")
+  assert trace.stale_sections.borders
+  mu = ripl.sample("mu")
+  assert abs(ripl.predict("m0") - 2 * mu) < 1e-10
+
+@broken_in('puma', "Subsampled MH only implemented in Lite.")
+@on_inf_prim("subsampled_mh")
+def testStaleSectionsRefreshedByMHOnBorder():
+  ripl = get_ripl()
+  trace = leaveStaleSections(ripl, 20)
+  if trace is None:
+    raise SkipTest("No proposal left a local section stale")
+  # Resampling the global border detaches through all its local sections
+  ripl.infer("(mh default all 1)")
+  assert not trace.stale_sections.borders
+  mu = ripl.sample("mu")
+  for i in range(20):
+    assert abs(ripl.sample("m%d" % i) - 2 * mu) < 1e-10
+
 def setupNormalWithObserves(N, sigma, seed):
   ripl = get_ripl(seed=seed)
   ripl.assume("mu", "(normal 10.0 %f)" % sigma, label="pid")
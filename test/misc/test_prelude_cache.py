@@ -0,0 +1,75 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from venture.test.config import on_inf_prim
+import venture.engine.engine as engine
+
+@contextmanager
+def cache_dir(value):
+  old = os.environ.get("VENTURE_CACHE_DIR")
+  if value is None:
+    os.environ.pop("VENTURE_CACHE_DIR", None)
+  else:
+    os.environ["VENTURE_CACHE_DIR"] = value
+  try:
+    yield
+  finally:
+    if old is None:
+      os.environ.pop("VENTURE_CACHE_DIR", None)
+    else:
+      os.environ["VENTURE_CACHE_DIR"] = old
+
+@on_inf_prim("none")
+def testPreludeCacheIsOptIn():
+  with cache_dir(None):
+    eq_(None, engine._inference_prelude_path())
+  with cache_dir(""):
+    eq_(None, engine._inference_prelude_path())
+
+@on_inf_prim("none")
+def testPreludeCacheRoundTrip():
+  tmp = tempfile.mkdtemp()
+  try:
+    with cache_dir(tmp):
+      prelude = engine._load_inference_prelude()
+      eq_([os.path.basename(engine._inference_prelude_path())],
+          os.listdir(tmp))
+      eq_(prelude, engine._load_inference_prelude())
+  finally:
+    shutil.rmtree(tmp)
+
+@on_inf_prim("none")
+def testPreludeCacheCleansUpFailedWrite():
+  tmp = tempfile.mkdtemp()
+  dump = engine.cPickle.dump
+  def fail(*_args):
+    raise IOError("Disk full")
+  try:
+    engine.cPickle.dump = fail
+    with cache_dir(tmp):
+      engine._load_inference_prelude()
+    eq_([], os.listdir(tmp))
+  finally:
+    engine.cPickle.dump = dump
+    shutil.rmtree(tmp)
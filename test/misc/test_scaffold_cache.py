@@ -0,0 +1,127 @@
+# Copyright (c) 2015 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+from nose.tools import eq_
+
+from venture.test.config import broken_in
+from venture.test.config import get_ripl
+from venture.test.config import on_inf_prim
+
+def scaffoldShape(scaffold):
+  addrs = lambda nodes: sorted(str(node.address) for node in nodes)
+  return (addrs(scaffold.drg), addrs(scaffold.absorbing),
+          addrs(scaffold.aaa), addrs(scaffold.brush),
+          sorted((str(node.address), ct)
+                 for (node, ct) in scaffold.regenCounts.iteritems()))
+
+@on_inf_prim("mh")
+@broken_in("puma", "Puma does not cache scaffolds.")
+def testScaffoldCacheAgreesWithConstruction():
+  from venture.lite.scaffold import constructScaffold
+  ripl = get_ripl()
+  ripl.execute_program("""
+    [assume mu (normal 0 1)]
+    [assume z (mem (lambda (i) (tag 'z i (flip 0.5))))]
+    [assume means (mem (lambda (k) (normal 0 10)))]
+    [assume x (lambda (i) (normal (if (z i) (means 1) mu) 1))]
+    [observe (x 0) 1.5]
+    [observe (x 1) -0.5]
+    [observe (x 2) 0.7]
+  """)
+  engine = ripl.sivm.core_sivm.engine
+  engine.set_scaffold_cache(True)
+  trace = engine.getDistinguishedTrace()
+  for _ in range(30):
+    ripl.infer("(resimulation_mh default one 1)")
+    ripl.infer("(resimulation_mh 'z one 1)")
+    # Every entry that would be reused must match what construction
+    # would give now
+    for entry in trace.scaffold_cache.entries.values():
+      if entry.isValid(trace, entry.setsOfPNodes):
+        fresh = constructScaffold(trace, entry.setsOfPNodes)
+        eq_(scaffoldShape(fresh), scaffoldShape(entry.scaffold))
+  stats = trace.scaffold_cache_stats()
+  assert stats["hits"] > 0
+  assert stats["misses"] > 0
+  assert stats["invalidations"] > 0
+
+@on_inf_prim("mh")
+@broken_in("puma", "Puma does not cache scaffolds.")
+def testScaffoldCacheSeesNewChildren():
+  ripl = get_ripl()
+  ripl.assume("mu", "(normal 0 1)")
+  ripl.observe("(normal mu 1)", 1)
+  engine = ripl.sivm.core_sivm.engine
+  engine.set_scaffold_cache(True)
+  ripl.infer("(resimulation_mh default all 3)")
+  eq_([{"hits": 2, "misses": 1, "invalidations": 0, "size": 1}],
+      engine.scaffold_cache_stats())
+  ripl.observe("(normal mu 1)", 2)
+  ripl.infer("(resimulation_mh default all 1)")
+  eq_([{"hits": 2, "misses": 2, "invalidations": 1, "size": 1}],
+      engine.scaffold_cache_stats())
+  trace = engine.getDistinguishedTrace()
+  [entry] = trace.scaffold_cache.entries.values()
+  # Both observations and their (null) requests
+  eq_(4, len(entry.scaffold.absorbing))
+
+@on_inf_prim("mh")
+@broken_in("puma", "Puma does not cache scaffolds.")
+def testExtentCacheAgreesWithWalk():
+  from venture.lite.scaffold import ExtentCacheEntry
+  ripl = get_ripl()
+  ripl.execute_program("""
+    [assume z (mem (lambda (i) (tag 'z i (flip 0.5))))]
+    [assume x (mem (lambda (i)
+      (tag 'x i (if (z i) (normal 0 1) ((lambda () (normal 5 1)))))))]
+    [observe (normal (x 0) 1) 1.5]
+    [observe (normal (x 1) 1) 4.5]
+  """)
+  engine = ripl.sivm.core_sivm.engine
+  engine.set_scaffold_cache(True)
+  trace = engine.getDistinguishedTrace()
+  for _ in range(30):
+    ripl.infer("""(resimulation_mh
+      (minimal_subproblem (random_singleton (by_extent (by_tag 'x)))) 1)""")
+    for (key, entry) in trace.scaffold_cache.entries.items():
+      if key[0] is ExtentCacheEntry and entry.isValid(trace):
+        eq_(list(trace.randomChoicesInExtent(key[1], None, None)),
+            entry.pnodes)
+  stats = trace.scaffold_cache_stats()
+  assert stats["hits"] > 0
+  assert stats["invalidations"] > 0
+
+@on_inf_prim("mh")
+@broken_in("puma", "Puma does not cache scaffolds.")
+def testScaffoldCacheStaysBounded():
+  ripl = get_ripl()
+  ripl.assume("mu", "(normal 0 1)")
+  engine = ripl.sivm.core_sivm.engine
+  engine.set_scaffold_cache(True)
+  trace = engine.getDistinguishedTrace()
+  trace.scaffold_cache.max_entries = 5
+  # Each block is used once and then goes away
+  for i in range(20):
+    ripl.predict("(tag 'x %d (normal mu 1))" % i, label="x%d" % i)
+    ripl.infer("(resimulation_mh 'x %d 1)" % i)
+    ripl.forget("x%d" % i)
+  stats = trace.scaffold_cache_stats()
+  eq_(20, stats["misses"])
+  eq_(5, stats["size"])
+  # Nor do the evicted entries leave anything watching
+  for keys in trace.scaffold_cache.watchers.values():
+    assert keys <= set(trace.scaffold_cache.entries)
@@ -0,0 +1,32 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+from nose.plugins.attrib import attr
+
+from venture.test.config import get_ripl
+from venture.test.config import on_inf_prim
+import venture.test.timing as timing
+
+# Tracks the cost of creating ripls.  Only the first should parse the
+# inference prelude or build the shared builtin frames; the rest pay
+# the same per-ripl cost.
+@attr('slow')
+@on_inf_prim("none")
+def testRiplCreationAsymptotics():
+  def create(n):
+    return lambda : [get_ripl() for _ in range(n)]
+  timing.assertLinearTime(create)
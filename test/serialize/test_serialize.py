@@ -257,6 +257,31 @@ def test_serialize_forget(seed):
         ans = [(False, 0.8), (True, 0.2)]
         return reportKnownDiscrete(ans, samples)
 
+@gen_on_inf_prim("none")
+def test_serialize_formats():
+    for version in [None, '0.2']:
+        yield check_serialize_format, version
+
+def check_serialize_format(version):
+    v1 = get_ripl()
+    v1.infer('(resample 3)')
+    v1.assume('x', '(normal 0 1)')
+    v1.assume('n', '(poisson 4)')
+    v1.assume('b', '(flip)')
+    v1.assume('s', '(symmetric_dirichlet 1 3)')
+    v1.assume('m', '(wishart (id_matrix 2) 3)')
+    v1.assume('k', '(categorical (simplex 0.5 0.5) (array (quote a) (quote b)))')
+    v1.observe('(normal x 1)', 2, label='obs')
+    v1.infer('(incorporate)')
+    exps = ['x', 'n', 'b', 's', 'm', 'k']
+    before = [repr(v1.sample_all(exp)) for exp in exps]
+    saved = v1.sivm.core_sivm.engine.saves(version=version)
+    v2 = get_ripl()
+    v2.sivm.core_sivm.engine.loads(saved)
+    eq_(before, [repr(v2.sample_all(exp)) for exp in exps])
+    # Directives and labels come back too
+    v2.sivm.core_sivm.engine.labeled_forget('obs')
+
 @on_inf_prim("none")
 def test_serialize_recursion():
     v = get_ripl()
@@ -177,3 +177,38 @@ def testBasicParticleFilter2(seed):
     predictions.append(ripl.report("pid"))
 
   return reportKnownGaussian(390/89.0, math.sqrt(55/89.0), predictions)
+
+@on_inf_prim("resample")
+@statisticalTest
+def testLowVarianceResampling(seed):
+  # Like testResampling1, but with systematic resampling gated on the
+  # effective sample size
+  P = 10
+  ripl = get_ripl(seed=seed)
+  def a_sample():
+    ripl.clear()
+    ripl.infer("(set_resampling 'systematic 0.5)")
+    ripl.infer("(resample %d)" % P)
+    ripl.assume("x", "(normal 0 1)")
+    ripl.observe("(normal x 1)", 2)
+    ripl.infer("(resample %d)" % P)
+    ripl.infer("(resample 1)")
+    return ripl.sample("x")
+  predictions = [a_sample() for _ in range(default_num_samples())]
+  return reportKnownGaussian(1, math.sqrt(0.5), predictions)
+
+@on_inf_prim("resample")
+def testResamplingSkippedAtHighESS():
+  ripl = get_ripl()
+  ripl.infer("(set_resampling 'residual 0.5)")
+  ripl.infer("(resample 4)")
+  ripl.assume("x", "(normal 0 1)")
+  ripl.observe("(normal x 1)", 0.1)
+  ripl.infer("(incorporate)")
+  before = ripl.sample_all("x")
+  weights = list(ripl.sivm.core_sivm.engine.model.log_weights)
+  ripl.infer("(resample 4)")
+  # The weights are nearly even, so nothing changed
+  after = ripl.sample_all("x")
+  assert before == after
+  assert weights == ripl.sivm.core_sivm.engine.model.log_weights
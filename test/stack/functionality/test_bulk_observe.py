@@ -15,10 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
+from nose.tools import assert_raises
 from nose.tools import eq_
+import numpy as np
 
+from venture.test.config import collectSamples
 from venture.test.config import get_ripl
 from venture.test.config import on_inf_prim
+from venture.test.stats import reportKnownGaussian
+from venture.test.stats import statisticalTest
 
 @on_inf_prim("mh")
 def testBulkObserve1():
@@ -26,8 +31,62 @@ def testBulkObserve1():
   n_before = len(ripl.list_directives())
   ripl.observe_dataset("normal",[(0,5,11),(2,8,22),(3,10,33)],label="pid")
   ripl.infer(100)
-  eq_(ripl.report("pid_0"),11)
-  eq_(ripl.report("pid_1"),22)
-  eq_(ripl.report("pid_2"),33)
+  eq_(ripl.report("pid"),[11,22,33])
   n_after = len(ripl.list_directives())
-  eq_(n_after, n_before + 3)
+  eq_(n_after, n_before + 1)
+
+@on_inf_prim("none")
+def testBulkObserveForget():
+  ripl = get_ripl()
+  ripl.assume("mu", "(normal 0 1)")
+  n_before = len(ripl.list_directives())
+  ripl.bulk_observe("(normal mu 1)", np.array([1.5, 2.0, 2.5]), label="data")
+  [directive] = ripl.list_directives()[n_before:]
+  eq_("bulk_observe", directive["instruction"])
+  eq_([1.5, 2.0, 2.5], directive["value"])
+  ripl.forget("data")
+  eq_(n_before, len(ripl.list_directives()))
+  # All the members went, so the same data can be observed again
+  ripl.bulk_observe("(normal mu 1)", [1.5, 2.0, 2.5], label="data")
+  eq_([1.5, 2.0, 2.5], ripl.report("data"))
+
+@on_inf_prim("mh")
+@statisticalTest
+def testObserveDatasetPosterior(seed):
+  # Five observations of 1 at unit noise put mu at N(5/6, 1/6)
+  ripl = get_ripl(seed=seed)
+  ripl.assume("mu", "(normal 0 1)")
+  ripl.assume("obs", "(lambda (noise) (normal mu noise))")
+  ripl.observe_dataset("obs", np.array([[1, 1]] * 5))
+  ripl.predict("mu", label="pid")
+  predictions = collectSamples(ripl, "pid", infer="(resimulation_mh default one 20)")
+  return reportKnownGaussian(5.0/6, (1.0/6)**0.5, predictions)
+
+@on_inf_prim("none")
+def testBulkObserveStreamsChunks():
+  ripl = get_ripl()
+  ripl.sivm.core_sivm.engine.bulk_chunk_size = 2
+  ripl.assume("mu", "(normal 0 1)")
+  n_before = len(ripl.list_directives())
+  items = (x for x in [1.5, 2.0, 2.5, 3.0, 3.5])
+  ripl.bulk_observe("(normal mu 1)", items, label="data")
+  [directive] = ripl.list_directives()[n_before:]
+  eq_([1.5, 2.0, 2.5, 3.0, 3.5], directive["value"])
+  ripl.bulk_observe("(normal mu 1)", np.array([4.0, 4.5, 5.0]), label="more")
+  eq_([4.0, 4.5, 5.0], ripl.report("more"))
+  eq_([4.0, 4.5, 5.0], list(ripl.list_directives()[-1]["data"]))
+
+@on_inf_prim("none")
+def testBulkObserveFailsAsUnit():
+  ripl = get_ripl()
+  ripl.sivm.core_sivm.engine.bulk_chunk_size = 2
+  ripl.assume("mu", "(normal 0 1)")
+  n_before = len(ripl.list_directives())
+  def items():
+    yield 1.5
+    yield 2.0
+    yield 2.5
+    raise ValueError("Out of data")
+  assert_raises(ValueError, ripl.bulk_observe, "(normal mu 1)", items())
+  eq_(n_before, len(ripl.list_directives()))
+  assert not ripl.sivm.core_sivm.engine.bulk_ids
@@ -0,0 +1,56 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+import copy
+import cPickle as pickle
+
+from nose.tools import eq_
+
+import venture.lite.address as addr
+
+def deep_address(did, depth):
+  ans = addr.directive_address(did)
+  for i in range(depth):
+    ans = addr.extend(addr.request(ans, addr.req_frame(str(i))), i % 3)
+  return ans
+
+def test_addresses_are_hash_consed():
+  a = deep_address(1, 50)
+  b = deep_address(1, 50)
+  assert a is b
+  eq_(hash(a), hash(b))
+  assert a != deep_address(2, 50)
+  assert a != deep_address(1, 49)
+
+def test_copies_are_interned():
+  a = deep_address(1, 20)
+  assert pickle.loads(pickle.dumps(a, pickle.HIGHEST_PROTOCOL)) is a
+  assert pickle.loads(pickle.dumps(a, 0)) is a
+  assert copy.deepcopy(a) is a
+
+def test_address_order_is_total():
+  addrs = [deep_address(did, depth) for did in range(3) for depth in range(5)]
+  in_order = sorted(addrs)
+  for (a, b) in zip(in_order, in_order[1:]):
+    assert a < b and b > a and a <= b and not b <= a
+  eq_(set(addrs), set(in_order))
+
+def test_dead_addresses_are_dropped():
+  size = len(addr._interned)
+  a = deep_address(7, 10)
+  assert len(addr._interned) > size
+  del a
+  eq_(size, len(addr._interned))
@@ -0,0 +1,130 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+from nose.tools import eq_
+import numpy as np
+
+from venture.lite.hmm import HMMSPAux
+from venture.lite.hmm import UncollapsedHMMSP
+from venture.test.config import broken_in
+from venture.test.config import get_ripl
+from venture.test.config import on_inf_prim
+
+def random_hmm(rng, K=3, M=4):
+  p0 = rng.dirichlet(np.ones(K))
+  T = rng.dirichlet(np.ones(K), K)
+  O = rng.dirichlet(np.ones(M), K)
+  return UncollapsedHMMSP(p0, T, O)
+
+def observe(aux, rng, M, times):
+  for n in times:
+    aux.os.setdefault(n, []).append(rng.randint(M))
+    aux.observationsChanged(n)
+
+def extend_states(aux, K, length):
+  aux.xs.extend([np.eye(K, dtype=int)[0]] * (length - len(aux.xs)))
+
+def naive_marginal(sp, aux):
+  # The forward recursion in probability space, one step at a time
+  weight = 0
+  f = None
+  for i in range(len(aux.xs)):
+    f = sp.p0 if i == 0 else np.dot(f, sp.T)
+    for o in aux.os.get(i, []):
+      f = f * sp.O[:, o]
+    weight += math.log(np.sum(f))
+    f = f / np.sum(f)
+  return weight
+
+def test_forward_filter_extends_incrementally():
+  rng = np.random.RandomState(1)
+  sp = random_hmm(rng)
+  aux = HMMSPAux()
+  extend_states(aux, 3, 30)
+  observe(aux, rng, 4, range(0, 30, 2))
+  assert np.allclose(naive_marginal(sp, aux), sp.forwardMarginalWeight(aux))
+  # Streaming observations at the end
+  extend_states(aux, 3, 40)
+  observe(aux, rng, 4, [31, 35, 35, 39])
+  assert np.allclose(naive_marginal(sp, aux), sp.forwardMarginalWeight(aux))
+  # A change in the middle, and dropping trailing states
+  observe(aux, rng, 4, [5])
+  del aux.xs[36:]
+  assert np.allclose(naive_marginal(sp, aux), sp.forwardMarginalWeight(aux))
+  # A copy of the aux keeps its own filter
+  aux2 = aux.copy()
+  observe(aux2, rng, 4, [1])
+  assert np.allclose(naive_marginal(sp, aux), sp.forwardMarginalWeight(aux))
+  assert np.allclose(naive_marginal(sp, aux2), sp.forwardMarginalWeight(aux2))
+
+def test_long_sequence_does_not_underflow():
+  rng = np.random.RandomState(2)
+  sp = random_hmm(rng)
+  aux = HMMSPAux()
+  extend_states(aux, 3, 20000)
+  observe(aux, rng, 4, range(20000))
+  sp.forwardBackwardSample(aux, rng)
+  weight = sp.forwardMarginalWeight(aux)
+  assert np.isfinite(weight)
+  assert np.allclose(naive_marginal(sp, aux), weight)
+  assert np.isfinite(sp.outputPSP.psp.logDensityOfData(aux))
+
+def test_complete_log_density():
+  rng = np.random.RandomState(3)
+  sp = random_hmm(rng)
+  aux = HMMSPAux()
+  extend_states(aux, 3, 10)
+  observe(aux, rng, 4, [0, 4, 4, 9])
+  sp.forwardBackwardSample(aux, rng)
+  states = [int(np.argmax(x)) for x in aux.xs]
+  expected = math.log(sp.p0[states[0]])
+  for (i, j) in zip(states[:-1], states[1:]):
+    expected += math.log(sp.T[i, j])
+  for (n, obs) in aux.os.iteritems():
+    for o in obs:
+      expected += math.log(sp.O[states[n], o])
+  assert np.allclose(expected, sp.outputPSP.psp.logDensityOfData(aux))
+
+@broken_in("puma", "Puma does not cache HMM forward filters")
+@on_inf_prim("mh")
+def test_forward_filter_survives_resimulation():
+  # Resimulating the maker makes a new SP each time, but with the same
+  # parameters, so the filter is kept and extended as observations
+  # are appended rather than rebuilt
+  r = get_ripl()
+  r.assume("hmm", """(make_lazy_hmm
+ (simplex 0.5 0.5)
+ (matrix (array (array 0.7 0.3)
+                (array 0.3 0.7)))
+ (matrix (array (array 0.9 0.2)
+                (array 0.1 0.8))))""")
+  for n in range(0, 20, 2):
+    r.observe("(hmm %d)" % n, n % 3 % 2)
+  r.infer("(resimulation_mh default one 3)")
+  trace = r.sivm.core_sivm.engine.getDistinguishedTrace()
+  aux = trace.madeSPAuxAt(trace.families.values()[0])
+  [f] = aux.filters.values()
+  eq_(len(aux.xs), len(f.fs))
+  first = f.fs[0]
+  r.observe("(hmm 25)", 1)
+  r.infer("(resimulation_mh default one 3)")
+  aux = trace.madeSPAuxAt(trace.families.values()[0])
+  [f] = aux.filters.values()
+  eq_(26, len(f.fs))
+  assert f.fs[0] is first
@@ -0,0 +1,61 @@
+# Copyright (c) 2015 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from venture.lite.node import Node
+from venture.lite.orderedset import OrderedSet
+from venture.lite.trace import Trace
+from venture.lite.types import ExpressionType
+import venture.lite.address as addr
+
+def test_children_behave_like_an_ordered_set():
+  # Across the switch between tuple and set representations
+  prng = random.Random(1)
+  node = Node(addr.directive_address(1))
+  reference = OrderedSet()
+  for _ in range(500):
+    child = prng.randint(0, 20)
+    if child in reference and prng.random() < 0.6:
+      node.removeChild(child)
+      reference.remove(child)
+    else:
+      node.addChild(child)
+      reference.add(child)
+    eq_(list(reference), list(node.children))
+  for child in list(reference):
+    node.removeChild(child)
+  eq_(0, len(node.children))
+  with assert_raises(KeyError):
+    node.removeChild(3)
+
+def test_traces_share_builtin_frame():
+  def exp(e): return ExpressionType().asVentureValue(e).asStackDict()
+  traces = [Trace(1), Trace(2)]
+  apply_node = traces[0].globalEnv.findSymbol("apply")
+  assert apply_node is traces[1].globalEnv.findSymbol("apply")
+  # Applying apply registers a family, which must stay in its own trace
+  for trace in traces:
+    trace.eval(1, exp(["apply", "normal", ["array", 0, 1]]))
+    eq_(1, len(trace.madeSPFamiliesAt(apply_node).families))
+  traces[0].uneval(1)
+  eq_(0, len(traces[0].madeSPFamiliesAt(apply_node).families))
+  eq_(1, len(traces[1].madeSPFamiliesAt(apply_node).families))
+  eq_(0, len(apply_node.children))
@@ -528,3 +528,25 @@ def test_clear(prng, klass, generator):
     s.clear()
     assert not s
     assert 0 == len(s)
+
+@checkem
+def test_interleaved_removal(prng, klass, generator):
+    if klass == OrderedFrozenSet:
+        raise SkipTest('destructive operations')
+    elements = pick_elements(prng, 3*pick_length(prng), generator)
+    s = klass()
+    present = []
+    for x in elements:
+        s.add(x)
+        present.append(x)
+        if pick_integer(prng, 3) == 0:
+            y = present.pop(pick_integer(prng, len(present)))
+            s.remove(y)
+        elif pick_integer(prng, 4) == 0:
+            assert present.pop(0) == s.pop()
+        assert list(s) == present
+        assert list(klass(s)) == present
+        assert list(copy.deepcopy(s)) == present
+        assert len(s) == len(present)
+    for x in elements:
+        assert (x in s) == (x in present)
@@ -0,0 +1,134 @@
+# Copyright (c) 2014 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+import math
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+import numpy as np
+
+from venture.lite.utils import effectiveSampleSize
+from venture.lite.utils import resampleLogCategorical
+from venture.test.config import gen_in_backend
+from venture.test.config import in_backend
+from venture.test.stats import reportKnownDiscrete
+from venture.test.stats import statisticalTest
+
+WEIGHTS = [0.1, 0.0, 0.45, 0.05, 0.4]
+LOGS = [math.log(w) if w > 0 else float("-inf") for w in WEIGHTS]
+
+@gen_in_backend("none")
+def testResamplingSchemes():
+  for scheme in ["multinomial", "systematic", "stratified", "residual"]:
+    yield checkResamplingScheme, scheme
+
+@statisticalTest
+def checkResamplingScheme(scheme, seed):
+  # Whatever the scheme, a particle chosen uniformly from the
+  # resampled set is distributed according to the weights.
+  rng = np.random.RandomState(seed)
+  observed = []
+  for _ in range(200):
+    ans = resampleLogCategorical(LOGS, 7, rng, scheme)
+    eq_(7, len(ans))
+    observed.append(ans[rng.randint(7)])
+  return reportKnownDiscrete(zip(range(len(WEIGHTS)), WEIGHTS), observed)
+
+@gen_in_backend("none")
+def testResamplingFirstSlot():
+  for scheme in ["multinomial", "systematic", "stratified", "residual"]:
+    yield checkResamplingFirstSlot, scheme
+
+@statisticalTest
+def checkResamplingFirstSlot(scheme, seed):
+  # The first resampled particle becomes the distinguished one, so it
+  # must itself be distributed according to the weights.
+  rng = np.random.RandomState(seed)
+  observed = [resampleLogCategorical(LOGS, 7, rng, scheme)[0]
+              for _ in range(200)]
+  return reportKnownDiscrete(zip(range(len(WEIGHTS)), WEIGHTS), observed)
+
+class Labeled(object):
+  def __init__(self, label): self._label = label
+  def label(self): return self._label
+
+class LabeledCopier(object):
+  def copy(self, obj): return Labeled(obj.label())
+  def dump(self, obj): return obj.label()
+  def restore(self, label): return Labeled(label)
+
+@in_backend("none")
+def testReassignKeepsFirstAncestor():
+  # Reassigning a pool puts a copy of the first ancestor first, and
+  # the right number of copies of each somewhere.
+  from venture.multiprocess import SynchronousSerializingMaster
+  rng = np.random.RandomState(1)
+  for process_cap in [1, 2, 3]:
+    master = SynchronousSerializingMaster(
+      [Labeled(i) for i in range(5)], process_cap, 1)
+    for _ in range(20):
+      labels = master.map('label')
+      ancestors = list(rng.randint(len(labels), size=5))
+      master.reassign(ancestors, LabeledCopier(), rng.randint(1, 100))
+      new_labels = master.map('label')
+      eq_(labels[ancestors[0]], new_labels[0])
+      eq_(sorted(labels[a] for a in ancestors), sorted(new_labels))
+
+@statisticalTest
+@in_backend("none")
+def testReassignFirstSlot(seed):
+  # The distinguished particle of a reassigned pool follows the weights
+  from venture.multiprocess import SynchronousSerializingMaster
+  rng = np.random.RandomState(seed)
+  observed = []
+  for _ in range(200):
+    master = SynchronousSerializingMaster(
+      [Labeled(i) for i in range(len(WEIGHTS))], 2, 1)
+    ancestors = resampleLogCategorical(LOGS, 6, rng, "systematic")
+    master.reassign(ancestors, LabeledCopier(), 1)
+    observed.append(master.map('label')[0])
+  return reportKnownDiscrete(zip(range(len(WEIGHTS)), WEIGHTS), observed)
+
+@in_backend("none")
+def testSystematicCopies():
+  # Every index gets within one of its expected number of copies
+  rng = np.random.RandomState(1)
+  for _ in range(50):
+    ans = resampleLogCategorical(LOGS, 20, rng, "systematic")
+    for (i, w) in enumerate(WEIGHTS):
+      assert math.floor(20 * w) <= ans.count(i) <= math.ceil(20 * w)
+
+@in_backend("none")
+def testResidualCopies():
+  # Every index gets at least the integer part of its expected number
+  # of copies, and impossible ones get none
+  rng = np.random.RandomState(1)
+  for _ in range(50):
+    ans = resampleLogCategorical(LOGS, 20, rng, "residual")
+    for (i, w) in enumerate(WEIGHTS):
+      assert math.floor(20 * w) <= ans.count(i)
+    eq_(0, ans.count(1))
+
+@in_backend("none")
+def testUnknownScheme():
+  with assert_raises(ValueError):
+    resampleLogCategorical(LOGS, 3, np.random.RandomState(1), "bogus")
+
+@in_backend("none")
+def testEffectiveSampleSize():
+  eq_(4, effectiveSampleSize([0.0] * 4))
+  eq_(4, effectiveSampleSize([float("-inf")] * 4))
+  assert abs(1 - effectiveSampleSize([0.0, -1000, -1000])) < 1e-9
@@ -0,0 +1,72 @@
+# Copyright (c) 2015 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import random
+
+from nose.tools import assert_almost_equal
+from nose.tools import eq_
+
+from venture.lite.smap import BlockMap
+from venture.lite.smap import SamplableMap
+
+def test_sample_agrees_with_random_sample():
+  m = SamplableMap()
+  for k in range(50):
+    m[k] = str(k)
+  del m[7]
+  del m[0]
+  (r1, r2) = (random.Random(1), random.Random(1))
+  for _ in range(100):
+    eq_(r1.sample(m.a, 1)[0], m.sample(r2))
+
+def test_sorted_keys_maintained():
+  prng = random.Random(2)
+  m = SamplableMap()
+  present = set()
+  m.sortedKeys() # Build the index early, so it is maintained
+  for _ in range(500):
+    k = prng.randrange(100)
+    if k in present:
+      del m[k]
+      present.remove(k)
+    else:
+      m[k] = k
+      present.add(k)
+    eq_(sorted(present), m.sortedKeys())
+  eq_([k for k in sorted(present) if 20 <= k <= 40], m.sortedKeys(20, 40))
+
+def test_sample_by_size():
+  prng = random.Random(3)
+  m = BlockMap()
+  for (block, n) in [("a", 1), ("b", 3), ("c", 6)]:
+    for i in range(n):
+      m.addNode(block, (block, i))
+  m.removeNode("c", ("c", 0))
+  m.addNode("d", ("d", 0))
+  m.removeNode("d", ("d", 0))
+  assert "d" not in m
+  eq_(set(["a", "b", "c"]), set(m.keys()))
+  eq_(9, m.numNodes())
+  counts = {"a": 0, "b": 0, "c": 0}
+  for _ in range(9000):
+    (block, nodes) = m.sampleBySize(prng)
+    eq_(nodes, m[block])
+    counts[block] += 1
+  for (block, n) in [("a", 1), ("b", 3), ("c", 5)]:
+    assert abs(counts[block] - 1000 * n) < 200, counts
+    assert_almost_equal(math.log(n / 9.0), m.logDensityBySize(block))
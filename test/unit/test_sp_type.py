@@ -0,0 +1,88 @@
+# Copyright (c) 2016 MIT Probabilistic Computing Project.
+#
+# This file is part of Venture.
+#
+# Venture is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Venture is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Venture.  If not, see <http://www.gnu.org/licenses/>.
+
+import cPickle as pickle
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from venture.lite.exception import VentureError
+from venture.lite.sp import SPType
+from venture.lite.sp_use import MockArgs
+import venture.lite.types as t
+import venture.lite.value as vv
+
+def reference_unwrap(sp_type, lst):
+  # The uncompiled definition of SPType.unwrap_arg_list
+  n = len(sp_type.args_types)
+  if not sp_type.variadic:
+    return [sp_type.args_types[i].asPythonNoneable(val)
+            for (i, val) in enumerate(lst)]
+  else:
+    return [sp_type.args_types[i].asPythonNoneable(val)
+            for (i, val) in enumerate(lst[:n-1])] + \
+      [sp_type.args_types[-1].asPythonNoneable(val) for val in lst[n-1:]]
+
+def test_compiled_unwrapping_agrees():
+  num = vv.VentureNumber
+  cases = [
+    (SPType([t.NumberType(), t.NumberType()], t.NumberType()),
+     [num(1), num(2.5)]),
+    (SPType([t.NumberType(), t.NumberType()], t.NumberType(), min_req_args=1),
+     [num(1)]),
+    (SPType([t.NumberType()], t.NumberType()), [None]),
+    (SPType([t.NumberType()], t.NumberType()), [vv.VentureInteger(3)]),
+    (SPType([t.NumberType()], t.NumberType(), variadic=True),
+     [num(1), num(2), num(3)]),
+    (SPType([t.PositiveType(), t.BoolType()], t.NumberType()),
+     [num(2), vv.VentureBool(True)]),
+    (SPType([t.BoolType(), t.NumberType()], t.NumberType(), variadic=True),
+     [vv.VentureBool(False), num(4), num(5)]),
+  ]
+  for (sp_type, lst) in cases:
+    eq_(reference_unwrap(sp_type, lst), sp_type.unwrap_arg_list(lst))
+    args = sp_type.unwrap_args(MockArgs(lst, None))
+    eq_(reference_unwrap(sp_type, lst), args.operandValues())
+
+def test_compiled_arity_errors():
+  sp_type = SPType([t.NumberType(), t.NumberType()], t.NumberType(),
+                   min_req_args=1)
+  with assert_raises(VentureError):
+    sp_type.unwrap_arg_list([])
+  with assert_raises(VentureError):
+    sp_type.unwrap_arg_list([vv.VentureNumber(1)] * 3)
+  variadic = SPType([t.BoolType(), t.NumberType()], t.NumberType(),
+                    variadic=True)
+  with assert_raises(VentureError):
+    variadic.unwrap_arg_list([])
+
+def test_compiled_return_marshalling():
+  sp_type = SPType([], t.NumberType())
+  eq_(vv.VentureNumber(2.0), sp_type.wrap_return(2))
+  eq_(2.0, sp_type.unwrap_return(vv.VentureNumber(2)))
+  eq_(None, sp_type.unwrap_return(None))
+  with assert_raises(VentureError) as cm:
+    sp_type.wrap_return("foo")
+  assert cm.exception.message.startswith("Wrong return type: ")
+  bool_type = SPType([], t.BoolType())
+  eq_(vv.VentureBool(True), bool_type.wrap_return(True))
+
+def test_compiled_sp_type_pickles():
+  sp_type = SPType([t.NumberType()], t.NumberType())
+  sp_type.unwrap_arg_list([vv.VentureNumber(1)])
+  copied = pickle.loads(pickle.dumps(sp_type))
+  eq_([1.0], copied.unwrap_arg_list([vv.VentureNumber(1)]))
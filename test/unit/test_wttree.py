@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with Venture.  If not, see <http://www.gnu.org/licenses/>.
 
+import cPickle as pickle
+
 from venture.lite.wttree import PMap
 from venture.lite.wttree import PSet
 from venture.test.config import in_backend
@@ -182,3 +184,41 @@ def testPMapKey():
   assert isinstance(x[0], Lose)
   assert x[0].value == 54
   assert x[1] == 'eland'
+
+@in_backend("none")
+def testPMapKeyAtWeight():
+  r = PMap()
+  for (k, v) in [(3, 2), (1, 1), (7, 4), (5, 3)]:
+    r = r.insert(k, v)
+  assert r.total() == 10
+  keys = [r.keyAtWeight(x) for x in [0, 0.5, 1, 2.9, 3, 5.9, 6, 9.9]]
+  assert keys == [1, 1, 3, 3, 5, 5, 7, 7]
+  # Each entry weighs its value minus the discount
+  assert r.keyAtWeight(0.4, discount=0.5) == 1
+  assert r.keyAtWeight(0.6, discount=0.5) == 3
+  assert r.keyAtWeight(7.9, discount=0.5) == 7
+  # Sums follow updates, and the original is unchanged
+  r2 = r.adjust(1, lambda v: v + 5).delete(7)
+  assert r2.total() == 11
+  assert r2.keyAtWeight(6.5) == 3
+  assert r.total() == 10
+
+@in_backend("none")
+def testPickle():
+  m = PMap()
+  for (k, v) in [(3, 2), (1, 1), (7, 4), (5, 3)]:
+    m = m.insert(k, v)
+  m.total() # Pickled with its cached sums
+  s = PSet()
+  for k in [4, 2, 8]:
+    s = s.insert(k)
+  for protocol in [0, 1, 2]:
+    m2 = pickle.loads(pickle.dumps(m, protocol))
+    assert list(m2.iteritems()) == list(m.iteritems())
+    assert m2.total() == 10
+    assert m2.insert(2, 5).total() == 15
+    s2 = pickle.loads(pickle.dumps(s, protocol))
+    assert list(s2) == [2, 4, 8]
+    assert 4 in s2.delete(8)
+    assert list(pickle.loads(pickle.dumps(PMap(), protocol))) == []
+
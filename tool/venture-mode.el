@@ -167,7 +167,7 @@ See `run-hooks'."
                "ordered_range" "particle_log_weights" "pgibbs" "pgibbs_update" "plot"
                "plot_to_file" "plotf" "plotf_to_file" "log_joint_at" "print"
                "print_scaffold_stats" "printf" "pyeval" "pyexec" "regen" "regen_with_proposal"
-               "rejection" "resample" "resample_multiprocess" "resample_serializing"
+               "rejection" "resample" "resample_forking" "resample_multiprocess" "resample_serializing"
                "resample_thread_ser" "resample_threaded" "restore" "select"
                "set_particle_log_weights" "slice" "slice_doubling" "subsampled_mh"
                "subsampled_mh_check_applicability" "subsampled_mh_make_consistent" "sweep" 